@@ -0,0 +1,135 @@
+"""
+Offline benchmark of the full qa.ask pipeline over a corpus of Russian questions.
+First record the responses of DBpedia, the translator and SimpleDB (needs network and AWS settings):
+    python -m benchmarks.ask_pipeline record
+then replay them on any machine:
+    python -m benchmarks.ask_pipeline replay [--workers 4] [--latency-scale 1.0]
+The replay reports per-question latency percentiles, throughput and the per-stage breakdown
+of a cold-cache run and of a warm-cache run over the same corpus.
+"""
+import argparse
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'questions_ru.txt')
+FIXTURES_PATH = os.path.join(ROOT, 'data', 'benchmarks', 'fixtures.json')
+STAGES = ['ask', 'categorize', 'subject', 'translate', 'lookup', 'sparql_properties', 'descriptions',
+          'tfidf_ranking', 'answer_formatting', 'image']
+
+# The benchmark must not read or fill the shared cache files, so settings are fixed before src is imported
+_tmp_dir = tempfile.mkdtemp(prefix='deepanswer_benchmark_')
+os.environ.setdefault('DEEPANSWER_TRANSLATION_CACHE_PATH', '')
+os.environ.setdefault('DEEPANSWER_ANSWER_CACHE_BACKEND', 'memory')
+os.environ.setdefault('DEEPANSWER_PROPERTY_INDEX_PATH', os.path.join(_tmp_dir, 'property_index.pkl'))
+# The label index starts empty and learns only from the Lookup calls of this run, so every subject
+# that is resolved while recording has its Lookup fixture
+os.environ.setdefault('DEEPANSWER_LABEL_INDEX_PATH', os.path.join(_tmp_dir, 'label_index.pkl'))
+
+import src.knowledge_base as kdb  # noqa: E402
+import src.label_index as label_index  # noqa: E402
+import src.metrics as metrics  # noqa: E402
+import src.nlp as nlp  # noqa: E402
+import src.qa as qa  # noqa: E402
+import src.translation as tr  # noqa: E402
+from benchmarks.replay import Fixtures, install  # noqa: E402
+
+
+def load_corpus(path: str) -> list:
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def clear_caches() -> None:
+    qa._answer_cache.clear()
+    kb = kdb.get_knowledge_base()
+    kb._entity_cache.clear()
+    kb._lookup_cache.clear()
+    kb._image_cache.clear()
+    if kb._label_index is not None:
+        # Forget the entities learned by the previous run (without a path, nothing more is written to its journal)
+        kb._label_index = label_index.LabelIndex()
+    tr.get_cached_translator()._cache.clear()
+    nlp._morph_cache._cache.clear()
+
+
+def percentile(values: list, q: float) -> float:
+    # nearest-rank percentile
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def run(questions: list, workers: int) -> dict:
+    metrics.registry.clear()
+
+    def timed_ask(question):
+        start = time.perf_counter()
+        result = qa.ask(question)
+        return time.perf_counter() - start, result
+
+    start = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(timed_ask, questions))
+    else:
+        results = [timed_ask(question) for question in questions]
+    wall_time = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+    return {'latencies':  latencies,
+            'wall_time':  wall_time,
+            'n_errors':   sum('error' in result for _, result in results),
+            'stages':     {stage: metrics.registry.get_histogram('deepanswer_stage_seconds', stage=stage)
+                           for stage in STAGES}}
+
+
+def report(name: str, stats: dict) -> None:
+    latencies = stats['latencies']
+    print('{0}: {1} questions ({2} errors), {3:.1f} questions/sec'.format(
+        name, len(latencies), stats['n_errors'], len(latencies) / stats['wall_time']))
+    print('  latency p50 {0:.1f} ms, p90 {1:.1f} ms, p99 {2:.1f} ms, max {3:.1f} ms'.format(
+        *[percentile(latencies, q) * 1000 for q in (50, 90, 99, 100)]))
+    ask_total = stats['stages']['ask'].sum if stats['stages']['ask'] else 0
+    for stage, histogram in stats['stages'].items():
+        if stage == 'ask' or histogram is None:
+            continue
+        print('  {0:<18} {1:>5} calls {2:>9.1f} ms total {3:>8.2f} ms/call {4:>6.1%}'.format(
+            stage, histogram.count, histogram.sum * 1000, histogram.sum / histogram.count * 1000,
+            histogram.sum / ask_total if ask_total else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('--corpus', default=CORPUS_PATH)
+    parser.add_argument('--fixtures', default=FIXTURES_PATH)
+    parser.add_argument('--workers', type=int, default=1, help='questions answered concurrently')
+    parser.add_argument('--latency-scale', type=float, default=0.0,
+                        help='sleep the recorded network time multiplied by this factor on replay')
+    args = parser.parse_args()
+
+    questions = load_corpus(args.corpus)
+    fixtures = Fixtures(args.fixtures, args.latency_scale)
+    if args.mode == 'replay':
+        fixtures.load()
+    install(fixtures, args.mode)
+    qa.warm_up()
+
+    if args.mode == 'record':
+        for question in questions:
+            qa.ask(question)
+        fixtures.save()
+        print('{0} responses recorded to {1}'.format(len(fixtures), args.fixtures))
+        return
+
+    clear_caches()
+    report('Cold caches', run(questions, args.workers))
+    report('Warm caches', run(questions, args.workers))
+    if fixtures.n_misses:
+        print('{0} calls had no fixture, record the corpus again'.format(fixtures.n_misses))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""
+Benchmark of the import time of the package modules (each import in a fresh interpreter).
+Usage: python -m benchmarks.import_time [n_runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ['src.qa', 'src.knowledge_base', 'src.text', 'src.db']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(module: str) -> float:
+    code = ('import time; t = time.perf_counter(); import {0}; '
+            'print(time.perf_counter() - t)').format(module)
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return float(out)
+
+
+def main(n_runs=5):
+    for module in MODULES:
+        times = [import_time(module) for _ in range(n_runs)]
+        print('import {0}: {1:.1f} ms (median of {2})'.format(module, statistics.median(times) * 1000, n_runs))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,210 @@
+"""
+Record/replay stand-ins for the external services used by qa.ask: DBpedia Lookup and SPARQL (HTTP),
+the Microsoft translator and SimpleDB.
+In 'record' mode the real clients are wrapped and every response is saved to a JSON fixture file,
+in 'replay' mode the responses are served from the fixtures, so the whole pipeline runs without network.
+Replayed calls can sleep the recorded network time scaled by <latency_scale> (0 to measure CPU time only).
+"""
+import json
+import os
+import threading
+import time
+
+import src.db as db
+import src.transport as transport
+import src.translation as tr
+
+
+class Fixtures:
+    """
+    Responses of the external services: kind ('http', 'translator', 'sdb') -> key -> (response, elapsed seconds).
+    """
+
+    def __init__(self, path, latency_scale=0.0):
+        self.path = path
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._data = {'http': {}, 'translator': {}, 'sdb': {}}
+        self.n_misses = 0
+
+    def load(self) -> 'Fixtures':
+        with open(self.path, encoding='utf-8') as f:
+            self._data = json.load(f)
+        return self
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._lock:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+    def record(self, kind: str, key: str, response, elapsed: float) -> None:
+        with self._lock:
+            self._data[kind][key] = {'response': response, 'elapsed': elapsed}
+
+    def replay(self, kind: str, key: str):
+        """
+        :return: recorded response or None if the call was not recorded
+        """
+        entry = self._data[kind].get(key)
+        if entry is None:
+            with self._lock:
+                self.n_misses += 1
+            print('No fixture for {0} call: {1}'.format(kind, key[:200]))
+            return None
+        if self.latency_scale:
+            time.sleep(entry['elapsed'] * self.latency_scale)
+        return entry['response']
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._data.values())
+
+
+def _key(*parts) -> str:
+    return json.dumps(parts, ensure_ascii=False, sort_keys=True)
+
+
+def _http_key(request) -> str:
+    body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+    return _key(request.method, request.url, body)
+
+
+def _make_adapters(fixtures: Fixtures, mode: str):
+    from requests.adapters import BaseAdapter, HTTPAdapter
+
+    class RecordingAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            start = time.perf_counter()
+            response = super().send(request, **kwargs)
+            content = response.content
+            fixtures.record('http', _http_key(request),
+                            {'status':       response.status_code,
+                             'content_type': response.headers.get('Content-Type', ''),
+                             'content':      content.decode('utf-8')},
+                            time.perf_counter() - start)
+            return response
+
+    class ReplayAdapter(BaseAdapter):
+        def send(self, request, **kwargs):
+            import requests
+            entry = fixtures.replay('http', _http_key(request))
+            if entry is None:
+                raise requests.ConnectionError('No fixture for {0} {1}'.format(request.method, request.url),
+                                               request=request)
+            response = requests.Response()
+            response.status_code = entry['status']
+            response.headers['Content-Type'] = entry['content_type']
+            response._content = entry['content'].encode('utf-8')
+            # streamed responses are read from the content
+            response._content_consumed = True
+            response.encoding = 'utf-8'
+            response.url = request.url
+            response.request = request
+            return response
+
+        def close(self):
+            pass
+
+    return RecordingAdapter() if mode == 'record' else ReplayAdapter()
+
+
+class RecordingTranslator:
+    def __init__(self, translator, fixtures: Fixtures):
+        self._translator = translator
+        self._fixtures = fixtures
+
+    def translate(self, text, lang):
+        start = time.perf_counter()
+        result = self._translator.translate(text, lang)
+        self._fixtures.record('translator', _key('translate', text, lang), result, time.perf_counter() - start)
+        return result
+
+    def translate_array(self, texts, lang):
+        start = time.perf_counter()
+        result = self._translator.translate_array(texts, lang)
+        self._fixtures.record('translator', _key('translate_array', texts, lang), result,
+                              time.perf_counter() - start)
+        return result
+
+
+class ReplayTranslator:
+    def __init__(self, fixtures: Fixtures):
+        self._fixtures = fixtures
+
+    def _replay(self, *parts):
+        import requests
+        result = self._fixtures.replay('translator', _key(*parts))
+        if result is None:
+            raise requests.ConnectionError('No translator fixture')
+        return result
+
+    def translate(self, text, lang):
+        return self._replay('translate', text, lang)
+
+    def translate_array(self, texts, lang):
+        return self._replay('translate_array', texts, lang)
+
+
+class RecordingSdbClient:
+    """
+    Wrapper of the boto3 SimpleDB client that records the responses of reads.
+    """
+
+    def __init__(self, client, fixtures: Fixtures):
+        self._client = client
+        self._fixtures = fixtures
+
+    def __getattr__(self, method):
+        function = getattr(self._client, method)
+
+        def call(**kwargs):
+            start = time.perf_counter()
+            response = function(**kwargs)
+            response = {key: value for key, value in response.items() if key != 'ResponseMetadata'}
+            self._fixtures.record('sdb', _key(method, kwargs), response, time.perf_counter() - start)
+            return response
+
+        return call
+
+
+class ReplaySdbClient:
+    """
+    SimpleDB client that serves reads from the fixtures and drops writes.
+    """
+    write_methods = ('put_attributes', 'batch_put_attributes', 'delete_attributes')
+
+    def __init__(self, fixtures: Fixtures):
+        self._fixtures = fixtures
+
+    def __getattr__(self, method):
+        def call(**kwargs):
+            if method in self.write_methods:
+                return {}
+            response = self._fixtures.replay('sdb', _key(method, kwargs))
+            # Unknown reads behave as an empty domain
+            return {} if response is None else response
+
+        return call
+
+
+def install(fixtures: Fixtures, mode: str) -> None:
+    """
+    Route the HTTP sessions, the translator and the SimpleDB client of the process through the fixtures.
+    :param mode: 'record' (call the real services and save their responses) or 'replay'
+    """
+    if mode not in ('record', 'replay'):
+        raise ValueError('Unknown mode: {0}'.format(mode))
+    for name in ('sparql', 'lookup'):
+        adapter = _make_adapters(fixtures, mode)
+        session = transport.get_session(name)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    translator = tr.get_cached_translator()
+    sdb = db.get_db()
+    if mode == 'record':
+        real_translator = tr.get_translator()
+        translator._translator_factory = lambda: RecordingTranslator(real_translator, fixtures)
+        sdb._client = RecordingSdbClient(sdb._client, fixtures)
+    else:
+        translator._translator_factory = lambda: ReplayTranslator(fixtures)
+        sdb._client = ReplaySdbClient(fixtures)
@@ -0,0 +1,39 @@
+"""
+Microbenchmark of the per-question tokenizer setup cost.
+Compares building the NLTK models for every tokenizer (old behaviour) with the shared model registry.
+Usage: python -m benchmarks.tokenizer_setup [n_runs]
+"""
+import sys
+import timeit
+
+from nltk.corpus import wordnet
+from nltk.stem.wordnet import WordNetLemmatizer
+from nltk.tag.perceptron import PerceptronTagger
+
+import src.nlp as nlp
+import src.text as txt
+
+
+def legacy_setup():
+    WordNetLemmatizer()
+    wordnet.ensure_loaded()
+    PerceptronTagger()
+
+
+def shared_setup():
+    # One PropertyQuestion builds three tokenizers
+    txt.QATokenizer('question')
+    txt.QATokenizer('property')
+    txt.QATokenizer('question')
+
+
+def main(n_runs=20):
+    nlp.load_models()
+    legacy = timeit.timeit(legacy_setup, number=n_runs) / n_runs * 3
+    shared = timeit.timeit(shared_setup, number=n_runs) / n_runs
+    print('Tokenizer setup per question, legacy: {:.2f} ms'.format(legacy * 1000))
+    print('Tokenizer setup per question, shared: {:.4f} ms'.format(shared * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
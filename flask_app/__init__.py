@@ -1,6 +1,22 @@
 from flask import Flask
 
+import src.config as config
+import src.qa as qa
+from src.db import get_db
+from src.knowledge_base import get_knowledge_base
+
 app = Flask('DeepAnswer')
 app.root_path += '/flask_app'
 
-from flask_app import routes
\ No newline at end of file
+if config.WARM_UP:
+    try:
+        qa.warm_up()
+    except Exception as e:
+        # The models and resources are loaded lazily by the first questions instead
+        print('Warning: warm-up failed, loading lazily:', e)
+if config.QA_STATS_RECONCILE_INTERVAL:
+    get_db().start_qa_stats_reconciliation(config.QA_STATS_RECONCILE_INTERVAL)
+if config.PROPERTY_DESCR_REFRESH_INTERVAL:
+    get_knowledge_base().start_property_descr_refresh(config.PROPERTY_DESCR_REFRESH_INTERVAL)
+
+from flask_app import routes
@@ -2,9 +2,10 @@ import json
 
 from flask import render_template, request
 
+import src.metrics as metrics
 from flask_app import app
-from src.db import DB
-from src.qa import ask
+from src.db import get_db
+from src.qa import ask, ask_many
 
 
 @app.route('/')
@@ -20,15 +21,42 @@ def get_answer():
     return json.dumps(ask(question, language=language))
 
 
+@app.route('/get_answers', methods=['POST'])
+def get_answers():
+    """
+    Answer a batch of questions: either a JSON list of questions (language in the query string)
+    or {"questions": [...], "language": "ru"}.
+    """
+    data = request.get_json(force=True, silent=True)
+    if isinstance(data, dict):
+        questions = data.get('questions')
+        language = data.get('language', 'ru')
+    else:
+        questions = data
+        language = request.args.get('language', 'ru')
+    if not isinstance(questions, list) or not all(isinstance(q, str) and q.strip() for q in questions):
+        return json.dumps({'error': 'Questions must be a list of non-empty strings.'}), 400
+    return json.dumps(ask_many(questions, language=language))
+
+
 @app.route('/set_feedback', methods=['POST'])
 def set_feedback():
     question = request.form['question']
     language = request.form['language']
     is_correct = request.form['isCorrect']
-    DB().put_qa(question, language, is_correct)
+    get_db().put_qa(question, language, is_correct)
     return json.dumps({'success': True})
 
 
 @app.route('/get_feedback_stats', methods=['GET'])
 def get_feedback_stats():
-    return json.dumps(DB().get_qa_quality())
+    per_day = request.args.get('per_day', '').lower() in ('1', 'true')
+    return json.dumps(get_db().get_qa_quality(per_day))
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Latency of the stages of answering, question counters and cache statistics in the Prometheus text format.
+    """
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
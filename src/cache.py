@@ -0,0 +1,314 @@
+"""
+Caches shared by the whole process: in-memory LRU with expiration and an optional sqlite tier
+that survives restarts and is shared by all workers of the host.
+"""
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory LRU cache. Entries expire after <ttl> seconds (never if ttl is None).
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value, tag = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None, tag=None) -> None:
+        """
+        :param ttl: lifetime of this entry, the cache default is used if None
+        :param tag: optional tag (e.g. entity URI) to invalidate many entries at once
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value, tag)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def items(self) -> list:
+        """
+        Snapshot of (key, value) pairs that are not expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (expires_at, value, tag) in self._data.items()
+                    if expires_at is None or expires_at > now]
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_tag(self, tag) -> None:
+        with self._lock:
+            for key in [key for key, entry in self._data.items() if entry[2] == tag]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return _stats(self.hits, self.misses, len(self._data))
+
+
+class SqliteCache:
+    """
+    LRU cache with expiration stored in a sqlite file, so it can be shared by several processes.
+    Keys must be JSON-serializable, values are pickled.
+    The access time of an entry is updated at most once per <access_resolution> seconds, and the table
+    is counted only by the evictions: when the estimated size exceeds maxsize or every <evict_every> sets
+    (the entries added by other processes are not in the estimate). An eviction frees a tenth of maxsize,
+    so a full cache isn't evicted on every set.
+    """
+
+    def __init__(self, path, table='cache', maxsize=100000, ttl=None, access_resolution=60, evict_every=1000):
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.access_resolution = access_resolution
+        self.evict_every = evict_every
+        self._conn = None
+        self._lock = threading.Lock()
+        # estimated number of entries, None until the first eviction counts them
+        self._size = None
+        self._n_sets = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use, so creating the cache doesn't touch the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS {0} (key TEXT PRIMARY KEY, value BLOB, '
+                         'expires_at REAL, accessed_at REAL, tag TEXT)'.format(self.table))
+            conn.execute('CREATE INDEX IF NOT EXISTS {0}_accessed ON {0} (accessed_at)'.format(self.table))
+            conn.execute('CREATE INDEX IF NOT EXISTS {0}_tag ON {0} (tag)'.format(self.table))
+            conn.execute('CREATE INDEX IF NOT EXISTS {0}_expires ON {0} (expires_at)'.format(self.table))
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _encode_key(key) -> str:
+        return json.dumps(key, ensure_ascii=False)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute('SELECT count(*) FROM {0}'.format(self.table)).fetchone()[0]
+
+    def get(self, key, default=None):
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def get_entry(self, key):
+        """
+        :return: tuple (value, remaining lifetime in seconds or None, tag) or None if there is no such entry
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute('SELECT value, expires_at, tag, accessed_at FROM {0} WHERE key = ?'.
+                               format(self.table), (self._encode_key(key),)).fetchone()
+            if row is not None and (row[1] is None or row[1] > now):
+                # Every update takes the write lock of the file shared by the workers
+                if row[3] is None or now - row[3] >= self.access_resolution:
+                    conn.execute('UPDATE {0} SET accessed_at = ? WHERE key = ?'.format(self.table),
+                                 (now, self._encode_key(key)))
+                self.hits += 1
+                return pickle.loads(row[0]), None if row[1] is None else row[1] - now, row[2]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None, tag=None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            conn = self._connection()
+            conn.execute('INSERT OR REPLACE INTO {0} (key, value, expires_at, accessed_at, tag) '
+                         'VALUES (?, ?, ?, ?, ?)'.format(self.table),
+                         (self._encode_key(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                          expires_at, now, tag))
+            self._n_sets += 1
+            if self._size is not None:
+                # a replaced key is counted too, that only makes the next eviction come earlier
+                self._size += 1
+            if self._size is None or self._size > self.maxsize or self._n_sets >= self.evict_every:
+                self._evict(conn, now)
+
+    def _evict(self, conn, now) -> None:
+        """
+        Delete the expired entries and, if the table is over maxsize, the least recently used ones.
+        """
+        conn.execute('DELETE FROM {0} WHERE expires_at IS NOT NULL AND expires_at <= ?'.format(self.table),
+                     (now,))
+        size = conn.execute('SELECT count(*) FROM {0}'.format(self.table)).fetchone()[0]
+        if size > self.maxsize:
+            target_size = self.maxsize - self.maxsize // 10
+            conn.execute('DELETE FROM {0} WHERE key IN (SELECT key FROM {0} ORDER BY accessed_at LIMIT ?)'.
+                         format(self.table), (size - target_size,))
+            size = target_size
+        self._size = size
+        self._n_sets = 0
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._connection().execute('DELETE FROM {0} WHERE key = ?'.format(self.table),
+                                       (self._encode_key(key),))
+
+    def invalidate_tag(self, tag) -> None:
+        with self._lock:
+            self._connection().execute('DELETE FROM {0} WHERE tag = ?'.format(self.table), (tag,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection().execute('DELETE FROM {0}'.format(self.table))
+            self._size = 0
+
+    def stats(self) -> dict:
+        return _stats(self.hits, self.misses, len(self))
+
+
+class TieredCache:
+    """
+    In-memory cache in front of an optional sqlite cache. Disk hits are promoted to memory.
+    """
+
+    def __init__(self, memory: TTLCache, disk: SqliteCache = None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _missing)
+        if value is _missing and self.disk is not None:
+            entry = self.disk.get_entry(key)
+            if entry is not None:
+                value, ttl, tag = entry
+                self.memory.set(key, value, ttl, tag)
+        return default if value is _missing else value
+
+    def set(self, key, value, ttl=None, tag=None) -> None:
+        self.memory.set(key, value, ttl, tag)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl, tag)
+
+    def delete(self, key) -> None:
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def invalidate_tag(self, tag) -> None:
+        self.memory.invalidate_tag(tag)
+        if self.disk is not None:
+            self.disk.invalidate_tag(tag)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        memory_stats = self.memory.stats()
+        if self.disk is None:
+            return memory_stats
+        disk_stats = self.disk.stats()
+        return dict(_stats(memory_stats['hits'] + disk_stats['hits'], disk_stats['misses'], memory_stats['size']),
+                    memory=memory_stats, disk=disk_stats)
+
+
+def _stats(hits, misses, size) -> dict:
+    total = hits + misses
+    return {'hits':     hits,
+            'misses':   misses,
+            'size':     size,
+            'hit_rate': hits / total if total else 0.0}
+
+
+def make_cache(name, maxsize, ttl=None, path=None, disk_maxsize=None) -> TieredCache:
+    """
+    Build an in-memory cache with a sqlite tier if <path> is given.
+    :param name: table name in the sqlite file
+    :param maxsize: max number of entries in memory
+    :param ttl: default lifetime of entries in seconds
+    :param path: sqlite file, None to keep the cache in memory only
+    :param disk_maxsize: max number of entries on disk (10 * maxsize by default)
+    """
+    disk = SqliteCache(path, name, disk_maxsize or 10 * maxsize, ttl) if path else None
+    return TieredCache(TTLCache(maxsize, ttl), disk)
+
+
+class AnswerCache:
+    """
+    Cache of question answers with separate lifetimes for answers and for error results
+    (errors are often transient, e.g. a failed lookup) and invalidation of all answers about an entity.
+    """
+
+    def __init__(self, backend, answer_ttl, error_ttl):
+        """
+        :param backend: TTLCache (one process) or SqliteCache (shared by the workers of the host)
+        :param answer_ttl: lifetime of answers in seconds
+        :param error_ttl: lifetime of error results in seconds
+        """
+        self._backend = backend
+        self.answer_ttl = answer_ttl
+        self.error_ttl = error_ttl
+
+    def get(self, question: str, language: str):
+        return self._backend.get((question, language))
+
+    def set(self, question: str, language: str, result: dict, entity_uri=None) -> None:
+        ttl = self.error_ttl if 'error' in result else self.answer_ttl
+        self._backend.set((question, language), result, ttl, entity_uri)
+
+    def invalidate_entity(self, entity_uri: str) -> None:
+        self._backend.invalidate_tag(entity_uri)
+
+    def clear(self) -> None:
+        self._backend.clear()
+
+    def stats(self) -> dict:
+        return self._backend.stats()
+
+
+def make_answer_cache(backend, maxsize, answer_ttl, error_ttl, path=None) -> AnswerCache:
+    """
+    :param backend: 'memory' or 'sqlite'
+    """
+    if backend == 'memory':
+        return AnswerCache(TTLCache(maxsize), answer_ttl, error_ttl)
+    elif backend == 'sqlite':
+        return AnswerCache(SqliteCache(path, 'answers', maxsize), answer_ttl, error_ttl)
+    else:
+        raise ValueError('Unknown answer cache backend: {0}'.format(backend))
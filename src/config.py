@@ -0,0 +1,142 @@
+"""
+Process-wide settings. Every value can be overridden with an environment variable of the same name
+prefixed by DEEPANSWER_, e.g. DEEPANSWER_WARM_UP=0.
+"""
+import os
+
+
+def _env(name, default, cast=str):
+    value = os.environ.get('DEEPANSWER_' + name)
+    if value is None:
+        return default
+    if cast is bool:
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return cast(value)
+
+
+# Load NLP models, translator, property descriptions and the TF-IDF index at server start
+# instead of on the first question (see qa.warm_up)
+WARM_UP = _env('WARM_UP', True, bool)
+
+# Query all DBpedia classes of an entity concurrently and take the first non-empty result in class order
+PARALLEL_CLASS_QUERIES = _env('PARALLEL_CLASS_QUERIES', True, bool)
+# Max number of class queries in flight for one entity
+CLASS_QUERY_MAX_FANOUT = _env('CLASS_QUERY_MAX_FANOUT', 3, int)
+# Max number of concurrent SPARQL queries sent by the whole process
+SPARQL_MAX_WORKERS = _env('SPARQL_MAX_WORKERS', 8, int)
+
+# Keep-alive connection pools of the HTTP clients (one pool per endpoint host)
+HTTP_POOL_SIZE = _env('HTTP_POOL_SIZE', 16, int)
+# Ask endpoints for gzip-compressed responses
+HTTP_GZIP = _env('HTTP_GZIP', True, bool)
+
+# TF-IDF index over all property descriptions, fitted once and loaded by every worker at start
+PROPERTY_INDEX_PATH = _env('PROPERTY_INDEX_PATH',
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                        'data', 'property_index.pkl'))
+# Refit the index (to take new terms into the vocabulary) after this number of incremental additions
+PROPERTY_INDEX_REFIT_EVERY = _env('PROPERTY_INDEX_REFIT_EVERY', 1000, int)
+
+# Cache of entity properties: max entities in memory, lifetime in seconds and optional sqlite file
+ENTITY_CACHE_SIZE = _env('ENTITY_CACHE_SIZE', 1000, int)
+ENTITY_CACHE_TTL = _env('ENTITY_CACHE_TTL', 24 * 60 * 60, int)
+ENTITY_CACHE_PATH = _env('ENTITY_CACHE_PATH', None)
+
+# Cache of DBpedia Lookup results; misses are cached as negative entries with a shorter lifetime
+LOOKUP_CACHE_SIZE = _env('LOOKUP_CACHE_SIZE', 10000, int)
+LOOKUP_CACHE_TTL = _env('LOOKUP_CACHE_TTL', 7 * 24 * 60 * 60, int)
+LOOKUP_NEGATIVE_TTL = _env('LOOKUP_NEGATIVE_TTL', 10 * 60, int)
+LOOKUP_CACHE_PATH = _env('LOOKUP_CACHE_PATH', None)
+
+# Write-behind queue of SimpleDB writes: flush on <DB_FLUSH_SIZE> pending items or every <DB_FLUSH_INTERVAL> seconds
+# (in batch calls of 25 items at most, the SimpleDB limit), retry failed batches with exponential backoff
+DB_WRITE_BEHIND = _env('DB_WRITE_BEHIND', True, bool)
+DB_FLUSH_SIZE = _env('DB_FLUSH_SIZE', 25, int)
+DB_FLUSH_INTERVAL = _env('DB_FLUSH_INTERVAL', 5.0, float)
+DB_MAX_RETRIES = _env('DB_MAX_RETRIES', 5, int)
+
+# Pull the property descriptions stored by other workers every <PROPERTY_DESCR_REFRESH_INTERVAL> seconds
+# (0 to disable)
+PROPERTY_DESCR_REFRESH_INTERVAL = _env('PROPERTY_DESCR_REFRESH_INTERVAL', 15 * 60, float)
+# A description becomes visible in SimpleDB later than its time_add: after the write-behind flush, the retries
+# (0.5 s backoff doubled on each attempt) and the eventual consistency of selects. Each refresh selects
+# descriptions added <PROPERTY_DESCR_REFRESH_OVERLAP> seconds before the previous one, so none of them is missed.
+PROPERTY_DESCR_REFRESH_OVERLAP = _env('PROPERTY_DESCR_REFRESH_OVERLAP',
+                                      DB_FLUSH_INTERVAL + 0.5 * (2 ** DB_MAX_RETRIES - 1) + 60, float)
+
+# Rebuild the QA feedback statistics from SimpleDB every <QA_STATS_RECONCILE_INTERVAL> seconds (0 to disable)
+QA_STATS_RECONCILE_INTERVAL = _env('QA_STATS_RECONCILE_INTERVAL', 15 * 60, float)
+
+# Cache of translations (text, target language) -> translation: entries in memory, entries on disk and
+# the sqlite file shared by all workers (empty to keep translations in memory only)
+TRANSLATION_CACHE_SIZE = _env('TRANSLATION_CACHE_SIZE', 10000, int)
+TRANSLATION_DISK_CACHE_SIZE = _env('TRANSLATION_DISK_CACHE_SIZE', 200000, int)
+TRANSLATION_CACHE_PATH = _env('TRANSLATION_CACHE_PATH',
+                              os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                           'data', 'translations.sqlite'))
+# Max number of texts and of characters in one translator call
+TRANSLATION_MAX_TEXTS = _env('TRANSLATION_MAX_TEXTS', 100, int)
+TRANSLATION_MAX_CHARS = _env('TRANSLATION_MAX_CHARS', 10000, int)
+
+# Max number of tokens in the memo of morphological analysis
+MORPH_CACHE_SIZE = _env('MORPH_CACHE_SIZE', 50000, int)
+
+# Number of entities answered concurrently by qa.ask_many
+ASK_MANY_WORKERS = _env('ASK_MANY_WORKERS', 8, int)
+
+# Max seconds a question waits for an identical question that is already being answered
+COALESCE_TIMEOUT = _env('COALESCE_TIMEOUT', 60.0, float)
+
+# Cache of answers: 'memory' (one per process) or 'sqlite' (shared by the workers of the host),
+# with separate lifetimes in seconds for answers and for error results
+ANSWER_CACHE_BACKEND = _env('ANSWER_CACHE_BACKEND', 'memory')
+ANSWER_CACHE_SIZE = _env('ANSWER_CACHE_SIZE', 10000, int)
+ANSWER_CACHE_PATH = _env('ANSWER_CACHE_PATH',
+                         os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      'data', 'answers.sqlite'))
+ANSWER_TTL = _env('ANSWER_TTL', 24 * 60 * 60, int)
+ANSWER_ERROR_TTL = _env('ANSWER_ERROR_TTL', 5 * 60, int)
+
+# Time budget of one question in seconds, shared by all its stages (translate, lookup, SPARQL)
+QUESTION_TIME_BUDGET = _env('QUESTION_TIME_BUDGET', 30.0, float)
+# Max timeouts of single calls in seconds (the remaining budget can make them shorter)
+SPARQL_TIMEOUT = _env('SPARQL_TIMEOUT', 20.0, float)
+LOOKUP_TIMEOUT = _env('LOOKUP_TIMEOUT', 10.0, float)
+TRANSLATOR_TIMEOUT = _env('TRANSLATOR_TIMEOUT', 10.0, float)
+# Threads of the translator calls (its client has no timeout, so calls are waited for with one)
+TRANSLATION_MAX_WORKERS = _env('TRANSLATION_MAX_WORKERS', 8, int)
+# Retries with exponential backoff and jitter: delay before retry n is random in [0, min(max, base * 2^n)]
+RETRY_MAX_ATTEMPTS = _env('RETRY_MAX_ATTEMPTS', 4, int)
+RETRY_BASE_DELAY = _env('RETRY_BASE_DELAY', 0.5, float)
+RETRY_MAX_DELAY = _env('RETRY_MAX_DELAY', 8.0, float)
+# Circuit breaker per service: open after this many failures in a row, try again after the reset timeout
+BREAKER_FAILURE_THRESHOLD = _env('BREAKER_FAILURE_THRESHOLD', 5, int)
+BREAKER_RESET_TIMEOUT = _env('BREAKER_RESET_TIMEOUT', 30.0, float)
+
+# Print the intermediate results of answering a question (tokens, top properties, answers)
+DEBUG = _env('DEBUG', False, bool)
+
+# Knowledge base: 'dbpedia' (public SPARQL and Lookup endpoints) or 'local' (indexes built from a DBpedia dump
+# with python -m src.local_knowledge_base, stored in LOCAL_KNOWLEDGE_BASE_PATH)
+KNOWLEDGE_BASE_BACKEND = _env('KNOWLEDGE_BASE_BACKEND', 'dbpedia')
+LOCAL_KNOWLEDGE_BASE_PATH = _env('LOCAL_KNOWLEDGE_BASE_PATH',
+                                 os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                              'data', 'knowledge_base'))
+
+# Index of entity labels that answers DBpedia Lookup queries in process (built with python -m src.label_index
+# and extended with the results of live lookups, appended to a journal shared by the workers after every
+# LABEL_INDEX_SAVE_EVERY additions).
+# Only exact labels are answered before the live Lookup. Labels learned from live lookups expire after
+# LABEL_INDEX_LEARNED_TTL seconds, like the cached lookups.
+# If LABEL_INDEX_FUZZY is set, the strings that Lookup doesn't find get the most similar label with a trigram
+# Jaccard similarity of at least LABEL_INDEX_MIN_SIMILARITY, or LABEL_INDEX_MIN_CLASS_SIMILARITY if the search
+# is restricted to a class (similar labels are often different entities, e.g. 'Apollo 11' and 'Apollo 13')
+LABEL_INDEX = _env('LABEL_INDEX', True, bool)
+LABEL_INDEX_PATH = _env('LABEL_INDEX_PATH',
+                        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                     'data', 'label_index.pkl'))
+LABEL_INDEX_SAVE_EVERY = _env('LABEL_INDEX_SAVE_EVERY', 100, int)
+LABEL_INDEX_LEARNED_TTL = _env('LABEL_INDEX_LEARNED_TTL', LOOKUP_CACHE_TTL, int)
+LABEL_INDEX_FUZZY = _env('LABEL_INDEX_FUZZY', False, bool)
+LABEL_INDEX_MIN_SIMILARITY = _env('LABEL_INDEX_MIN_SIMILARITY', 0.8, float)
+LABEL_INDEX_MIN_CLASS_SIMILARITY = _env('LABEL_INDEX_MIN_CLASS_SIMILARITY', 0.7, float)
@@ -1,20 +1,203 @@
+import atexit
 import datetime as dt
-from statistics import mean
+import threading
+import time
+from collections import OrderedDict, defaultdict
 
-import boto3
 import botocore.exceptions
 from urllib.parse import quote_plus, unquote_plus
 
+import src.config as config
+
+# Max number of items in one batch_put_attributes() call accepted by SimpleDB
+MAX_BATCH_ITEMS = 25
+
+
+class WriteBehindQueue:
+    """
+    Buffer of SimpleDB writes that a background thread flushes with batch_put_attributes().
+    Writes of the same item are coalesced, the last one wins.
+    """
+
+    def __init__(self, db, flush_size=25, flush_interval=5.0, max_retries=5, backoff=0.5):
+        """
+        :param flush_size: number of pending items that triggers a flush (they are sent in batches of 25 at most)
+        """
+        self._db = db
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        # number of batch_put_attributes() calls and of items written by them
+        self.n_calls = 0
+        self.n_items = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, domain: str, item_name: str, attributes: list) -> None:
+        with self._cond:
+            self._pending.pop((domain, item_name), None)
+            self._pending[(domain, item_name)] = attributes
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name='sdb-write-behind', daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.flush_size:
+                self._cond.notify()
+
+    def flush(self) -> None:
+        """
+        Write all pending items synchronously.
+        """
+        with self._cond:
+            batches = self._take_batches()
+        for domain, items in batches:
+            self._put_batch(domain, items)
+
+    def close(self) -> None:
+        """
+        Stop the background thread and flush what is left, e.g. at shutdown.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and len(self._pending) < self.flush_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+                batches = self._take_batches()
+            for domain, items in batches:
+                self._put_batch(domain, items)
+
+    def _take_batches(self) -> list:
+        items_by_domain = defaultdict(list)
+        for (domain, item_name), attributes in self._pending.items():
+            items_by_domain[domain].append({'Name': item_name, 'Attributes': attributes})
+        self._pending.clear()
+        return [(domain, items[i:i + MAX_BATCH_ITEMS])
+                for domain, items in items_by_domain.items()
+                for i in range(0, len(items), MAX_BATCH_ITEMS)]
+
+    def _put_batch(self, domain: str, items: list) -> None:
+        for attempt in range(self.max_retries):
+            try:
+                self._db._client.batch_put_attributes(DomainName=domain, Items=items)
+                self.n_calls += 1
+                self.n_items += len(items)
+                return
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                print('SimpleDB batch write failed, attempt {0}: {1}'.format(attempt + 1, e))
+                if attempt + 1 < self.max_retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        print('SimpleDB batch write of {0} items to <{1}> dropped.'.format(len(items), domain))
+
+
+class QAStats:
+    """
+    Aggregate of the QA feedback: number of answers and of correct ones in total, per language and per day.
+    A question has one answer in the questions domain, so rating it again replaces its previous rating.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.correct = 0
+        self.by_language = defaultdict(lambda: [0, 0])
+        self.by_day = defaultdict(lambda: [0, 0])
+        # item name -> (language, is_correct, day) of the counted rating
+        self._items = {}
+        # False until the aggregate is built from the questions domain
+        self.loaded = False
+
+    def add(self, item_name: str, language: str, is_correct: bool, day: str) -> None:
+        """
+        :param item_name: name of the question item, its previous rating (if any) is subtracted
+        """
+        with self._lock:
+            previous = self._items.get(item_name)
+            if previous is not None:
+                self._count(*previous, sign=-1)
+            self._items[item_name] = (language, is_correct, day)
+            self._count(language, is_correct, day)
+
+    def _count(self, language, is_correct, day, sign=1) -> None:
+        for counts in (self.by_language[language], self.by_day[day]):
+            counts[0] += sign
+            counts[1] += sign * int(is_correct)
+        self.count += sign
+        self.correct += sign * int(is_correct)
+
+    def summary(self, per_day=False) -> dict:
+        def score(count, correct):
+            return correct / count if count else 0.0
+
+        with self._lock:
+            summary = {'avg_score':     score(self.count, self.correct),
+                       'count_answers': self.count,
+                       'by_language':   {language: {'avg_score': score(*counts), 'count_answers': counts[0]}
+                                         for language, counts in self.by_language.items()}}
+            if per_day:
+                summary['by_day'] = {day: {'avg_score': score(*counts), 'count_answers': counts[0]}
+                                     for day, counts in self.by_day.items()}
+        return summary
+
 
 class DB:
     """
     Adapter for AWS Simple DB.
     """
 
-    def __init__(self):
-        self._client = boto3.client('sdb')
+    def __init__(self, write_behind=False):
+        self._sdb_client = None
         self._property_domain = 'properties'
         self._qa_domain = 'questions'
+        self._qa_stats = QAStats()
+        # guards the aggregate and the log of the answers stored while a reconciliation scans the domain
+        self._qa_lock = threading.Lock()
+        self._qa_log = None
+        self._reconcile_lock = threading.Lock()
+        self._writer = None
+        if write_behind:
+            self._writer = WriteBehindQueue(self, config.DB_FLUSH_SIZE, config.DB_FLUSH_INTERVAL,
+                                            config.DB_MAX_RETRIES)
+            atexit.register(self._writer.close)
+
+    @property
+    def _client(self):
+        # boto3 is slow to import and the client needs AWS settings, so both wait until the first query
+        if self._sdb_client is None:
+            import boto3
+            self._sdb_client = boto3.client('sdb')
+        return self._sdb_client
+
+    @_client.setter
+    def _client(self, client):
+        self._sdb_client = client
+
+    def _put(self, domain: str, item_name: str, attributes: list) -> None:
+        if self._writer is not None:
+            self._writer.put(domain, item_name, attributes)
+        else:
+            self._client.put_attributes(DomainName=domain, ItemName=item_name, Attributes=attributes)
+
+    def flush(self) -> None:
+        if self._writer is not None:
+            self._writer.flush()
 
     @staticmethod
     def put_attr_format(dictionary: dict, replace=False) -> list:
@@ -51,11 +234,35 @@ class DB:
                          'uri':         quote_plus(property_uri),
                          'description': quote_plus(property_descr)}
         try:
-            self._client.put_attributes(DomainName=self._property_domain, ItemName=property_uri,
-                                        Attributes=self.put_attr_format(property_dict, replace=True))
+            self._put(self._property_domain, property_uri, self.put_attr_format(property_dict, replace=True))
         except botocore.exceptions.ClientError as e:
             print(e)
 
+    def put_property_descrs(self, prop_descrs: dict, batch_size=MAX_BATCH_ITEMS) -> None:
+        """
+        Store many property descriptions in SimpleDB with batch_put_attributes()
+        (SimpleDB accepts up to 25 items per call).
+        :param prop_descrs: dictionary of pairs (property URI, description)
+        :param batch_size: max number of items in one call
+        :return:
+        """
+        time_add = str(dt.datetime.now())
+        items = [{'Name':       property_uri,
+                  'Attributes': self.put_attr_format({'time_add':    time_add,
+                                                      'uri':         quote_plus(property_uri),
+                                                      'description': quote_plus(property_descr)},
+                                                     replace=True)}
+                 for property_uri, property_descr in prop_descrs.items()]
+        if self._writer is not None:
+            for item in items:
+                self._writer.put(self._property_domain, item['Name'], item['Attributes'])
+            return
+        for i in range(0, len(items), batch_size):
+            try:
+                self._client.batch_put_attributes(DomainName=self._property_domain, Items=items[i:i + batch_size])
+            except botocore.exceptions.ClientError as e:
+                print(e)
+
     def get_property_descr(self, property_uri: str) -> str:
         """
         Get property description by its url
@@ -67,56 +274,149 @@ class DB:
         property_dict = self.get_attr_format(r['Attributes'])
         return unquote_plus(property_dict['description'])
 
-    def get_all_property_descr(self) -> dict:
+    def iter_property_descr_pages(self, since=None, page_size=2500):
         """
-        Get property description by its url
-        :param property_uri:
-        :return:
+        Stream all property descriptions page by page, following NextToken to the end of the domain.
+        :param since: if given, only descriptions with time_add after it (str(dt.datetime) format)
+        :param page_size: number of items per select (2500 is the SimpleDB maximum)
+        :return: generator of lists of (property URI, description)
         """
-        r = self._client.select(SelectExpression="SELECT uri, description FROM properties "
-                                                "WHERE uri is not NULL and "
-                                                "      description is not NULL "
-                                                "LIMIT 2500")
-
-        prop_descr = dict()
-        if 'Items' in r:
-            for item in r['Items']:
+        query = ("SELECT uri, description FROM properties "
+                 "WHERE uri is not NULL and "
+                 "      description is not NULL ")
+        if since is not None:
+            query += "and time_add > '{0}' ".format(str(since).replace("'", "''"))
+        query += "LIMIT {0}".format(page_size)
+        kwargs = {'SelectExpression': query}
+        while True:
+            r = self._client.select(**kwargs)
+            page = []
+            for item in r.get('Items', []):
                 if 'Attributes' in item:
                     flat_dict = self.get_attr_format(item['Attributes'])
-                    prop_descr[unquote_plus(flat_dict['uri'])] = unquote_plus(flat_dict['description'])
+                    page.append((unquote_plus(flat_dict['uri']), unquote_plus(flat_dict['description'])))
+            if page:
+                yield page
+            if 'NextToken' not in r:
+                break
+            kwargs['NextToken'] = r['NextToken']
+
+    def get_all_property_descr(self, since=None) -> dict:
+        """
+        Get descriptions of all properties.
+        :param since: if given, only descriptions added after this time
+        :return: dictionary of pairs (property URI, description)
+        """
+        prop_descr = dict()
+        for page in self.iter_property_descr_pages(since):
+            prop_descr.update(page)
         return prop_descr
 
     def put_qa(self, question: str, language: str, is_correct: str) -> None:
         """
-        Store QA data.
+        Store QA data and count it in the feedback statistics.
         """
+        time_add = dt.datetime.now()
         qa_dict = {'question':        quote_plus(question),
                    'language':        language,
-                   'is_correct':      is_correct}
+                   'is_correct':      is_correct,
+                   'time_add':        str(time_add)}
         print('AWS saved:', qa_dict)
-        self._client.put_attributes(DomainName=self._qa_domain, ItemName=quote_plus(question),
-                                    Attributes=self.put_attr_format(qa_dict, replace=True))
-
-    def get_qa_quality(self) -> dict:
-        """
-        Get QA data.
-        """
-        r = self._client.select(SelectExpression="SELECT * FROM questions ",
-                                ConsistentRead=True)
-        scores = []
-        for item in r['Items']:
-            if 'Attributes' in item:
-                flat_dict = self.get_attr_format(item['Attributes'])
-                question = unquote_plus(flat_dict['question'])
-                is_correct = unquote_plus(flat_dict['is_correct'])
-                scores.append(1 if is_correct == 'true' else 0)
-                print(question, is_correct)
-        avg_score = mean(scores)
-        count_answers = len(scores)
+        item_name = quote_plus(question)
+        self._put(self._qa_domain, item_name, self.put_attr_format(qa_dict, replace=True))
+        with self._qa_lock:
+            self._qa_stats.add(item_name, language, is_correct == 'true', time_add.date().isoformat())
+            if self._qa_log is not None:
+                self._qa_log.append((item_name, language, is_correct, str(time_add)))
+
+    def get_qa_quality(self, per_day=False) -> dict:
+        """
+        Get QA feedback statistics from the maintained aggregate.
+        The aggregate is rebuilt from the questions domain on first use (or taken from the reconciliation
+        that is already running) and by reconcile_qa_stats().
+        :param per_day: add the statistics per day of the answer
+        """
+        if not self._qa_stats.loaded:
+            with self._reconcile_lock:
+                if not self._qa_stats.loaded:
+                    self._reconcile_qa_stats()
+        return self._qa_stats.summary(per_day)
+
+    def reconcile_qa_stats(self) -> None:
+        """
+        Rebuild the feedback statistics from the raw questions domain (page by page).
+        Pending writes are flushed before the scan and the answers stored during the scan are added
+        unless the scan has already seen them.
+        Answers rated again between two reconciliations are counted twice until the next one.
+        """
+        with self._reconcile_lock:
+            self._reconcile_qa_stats()
+
+    def _reconcile_qa_stats(self) -> None:
+        with self._qa_lock:
+            self._qa_log = []
+        try:
+            self.flush()
+            qa_stats = QAStats()
+            # (item name, time_add) of the scanned answers
+            scanned = set()
+            kwargs = {'SelectExpression': "SELECT language, is_correct, time_add FROM questions",
+                      'ConsistentRead': True}
+            while True:
+                r = self._client.select(**kwargs)
+                for item in r.get('Items', []):
+                    if 'Attributes' in item:
+                        flat_dict = self.get_attr_format(item['Attributes'])
+                        # time_add is missing for the oldest answers
+                        time_add = flat_dict.get('time_add', '')
+                        qa_stats.add(item.get('Name'), flat_dict.get('language', ''),
+                                     flat_dict.get('is_correct') == 'true', time_add[:10])
+                        scanned.add((item.get('Name'), time_add))
+                if 'NextToken' not in r:
+                    break
+                kwargs['NextToken'] = r['NextToken']
+            with self._qa_lock:
+                for item_name, language, is_correct, time_add in self._qa_log:
+                    if (item_name, time_add) not in scanned:
+                        qa_stats.add(item_name, language, is_correct == 'true', time_add[:10])
+                qa_stats.loaded = True
+                self._qa_stats = qa_stats
+        finally:
+            with self._qa_lock:
+                self._qa_log = None
+        summary = qa_stats.summary()
         print('Total QA result: {:.1%} with {} answers.'.
-              format(avg_score, count_answers))
-        return {'avg_score': avg_score,
-                'count_answers': count_answers}
+              format(summary['avg_score'], summary['count_answers']))
+
+    def start_qa_stats_reconciliation(self, interval: float) -> None:
+        """
+        Reconcile the feedback statistics every <interval> seconds in a background thread.
+        """
+        def run():
+            while True:
+                try:
+                    self.reconcile_qa_stats()
+                except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                    print('QA stats reconciliation failed:', e)
+                time.sleep(interval)
+
+        threading.Thread(target=run, name='qa-stats-reconciliation', daemon=True).start()
+
+
+_db_lock = threading.Lock()
+_db = None
+
+
+def get_db() -> DB:
+    """
+    DB shared by the whole process. Its writes go through the write-behind queue if DB_WRITE_BEHIND is set.
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = DB(write_behind=config.DB_WRITE_BEHIND)
+    return _db
 
 
 def _admin_queries():
@@ -1,132 +1,448 @@
-import json
-import urllib.error
-from collections import defaultdict
-from importlib import reload
+import contextvars
+import csv
+import datetime as dt
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from SPARQLWrapper import SPARQLWrapper, JSON
+import botocore.exceptions
+
+import src.cache as cache
+import src.config as config
 import src.db as db
+import src.label_index as label_index
+import src.metrics as metrics
+import src.resilience as resilience
+import src.transport as transport
 import src.utils as utils
 
-for module in [db, utils]:
-    reload(module)
+_not_cached = object()
+THUMBNAIL = 'http://dbpedia.org/ontology/thumbnail'
 
 
 class DBPediaKnowledgeBase:
-    _db = db.DB()
-    _prop_descr = _db.get_all_property_descr()
-    _cached_prop_descr = _prop_descr.copy()
+    # descriptions of all properties stored in DB, loaded on first use (see _cached_prop_descr)
+    _prop_descr = None
+    _prop_descr_loaded_at = None
+    _prop_descr_lock = threading.Lock()
     _basic_entity_class = 'http://www.w3.org/2002/07/owl#Thing'
     # list of meaningless properties for QA system
     _prop_black_list = ['http://dbpedia.org/property/years',
                        'http://dbpedia.org/property/name']
+    # bounded pool shared by all speculative class queries of the process
+    _executor = ThreadPoolExecutor(max_workers=config.SPARQL_MAX_WORKERS)
 
     def __init__(self):
         self._sparql_uri = 'http://dbpedia.org/sparql'
-        self._sparql_format = JSON
+        self._sparql_format = 'application/sparql-results+json'
         self._lookup_uri = 'http://lookup.dbpedia.org/api/search/'
+        # entity URI -> {property URI: [values]}, shared by all questions about the entity
+        self._entity_cache = cache.make_cache('entity_properties', config.ENTITY_CACHE_SIZE,
+                                              config.ENTITY_CACHE_TTL, config.ENTITY_CACHE_PATH)
+        # entity URI -> thumbnail URL or None, for questions that don't need the other properties
+        self._image_cache = cache.make_cache('entity_images', config.ENTITY_CACHE_SIZE,
+                                             config.ENTITY_CACHE_TTL, config.ENTITY_CACHE_PATH)
+        # (string, cls, type_, max_hits) -> (uri, name, description, classes) or None for a miss
+        self._lookup_cache = cache.make_cache('lookup', config.LOOKUP_CACHE_SIZE,
+                                              config.LOOKUP_CACHE_TTL, config.LOOKUP_CACHE_PATH)
+        # answers lookups in process, live lookups are only made for the labels it doesn't know
+        self._label_index = label_index.get_label_index() if config.LABEL_INDEX else None
+
+    @property
+    def _db(self):
+        return db.get_db()
+
+    @property
+    def _cached_prop_descr(self) -> dict:
+        cls = DBPediaKnowledgeBase
+        if cls._prop_descr is None:
+            with cls._prop_descr_lock:
+                if cls._prop_descr is None:
+                    cls._prop_descr_loaded_at = dt.datetime.now()
+                    cls._prop_descr = self._db.get_all_property_descr()
+        return cls._prop_descr
 
+    @metrics.timed('lookup')
     def search(self, string, cls='', type_='Keyword', max_hits=1):
+        key = (string, cls, type_, max_hits)
+        result = self._lookup_cache.get(key, _not_cached)
+        if result is _not_cached:
+            result = self._search_label_index(string, cls, type_)
+            if result is None:
+                result = self._lookup(string, cls, type_, max_hits)
+            ttl = config.LOOKUP_CACHE_TTL if result else config.LOOKUP_NEGATIVE_TTL
+            if result is None and self._label_index is not None and config.LABEL_INDEX_FUZZY:
+                # A similar label is a guess, it is cached only as long as a miss
+                result = self._fuzzy_search_label_index(string, cls)
+            self._lookup_cache.set(key, result, ttl)
+        return result
+
+    def _search_label_index(self, string, cls, type_):
+        if self._label_index is None:
+            return None
+        if type_ == 'Prefix':
+            results = self._label_index.complete(string, cls, max_hits=1)
+            result = results[0] if results else None
+        else:
+            result = self._label_index.search(string, cls)
+        if result is None:
+            return None
+        uri, name, description, classes = result
+        return uri, name, description, self._entity_classes(classes)
+
+    def _fuzzy_search_label_index(self, string, cls):
+        result = self._label_index.fuzzy_search(string, cls)
+        if result is None:
+            return None
+        uri, name, description, classes = result
+        return uri, name, description, self._entity_classes(classes)
+
+    def _entity_classes(self, class_uris) -> tuple:
+        classes = [cls for cls in class_uris if utils.is_dbpedia_link(cls)]
+        return tuple(classes) if classes else (self._basic_entity_class,)
+
+    def _lookup(self, string, cls, type_, max_hits):
+        import requests
         url = self._lookup_uri + type_ + 'Search'
         params = {'QueryString': string,
                   'QueryClass':  cls,
                   'MaxHits':     max_hits}
         headers = {'Accept': 'application/json'}
-        resp = json.loads(requests.
-                          get(url=url, params=params, headers=headers).
-                          text)
+
+        def call_lookup(timeout):
+            resp = transport.get_session('lookup').get(url=url, params=params, headers=headers, timeout=timeout)
+            resilience.check_response(resp)
+            return resp.json()
+
+        resp = resilience.call('lookup', call_lookup, config.LOOKUP_TIMEOUT, (requests.RequestException, ValueError))
         if resp['results']:
             res = resp['results'][0]
             uri = res['uri']
             name = res['label']
             description = res['description']
-            classes = [cls['uri'] for cls in res['classes']
-                       if utils.is_dbpedia_link(cls['uri'])]
-            if not classes:
-                classes = [self._basic_entity_class]
+            classes = self._entity_classes(cls['uri'] for cls in res['classes'])
+            if self._label_index is not None:
+                self._label_index.learn(uri, name, description, classes, res.get('refCount') or 0, string)
             return uri, name, description, classes
         else:
-            print('No results for <{0}> of class <{1}> (<{2}Search>)'.
-                  format(string, cls, type_))
+            if config.DEBUG:
+                print('No results for <{0}> of class <{1}> (<{2}Search>)'.format(string, cls, type_))
             return None
 
     def sparql(self, query):
-        sparql = SPARQLWrapper(self._sparql_uri)
-        sparql.setReturnFormat(self._sparql_format)
-        sparql.setTimeout(60)
-        sparql.setQuery(query)
-        counter = 0
-        while counter < 10:
-            try:
-                return sparql.query().convert()
-            except (urllib.error.HTTPError, urllib.error.URLError):
-                print('Rerun SPARQL query due to HTTP error.')
-                counter += 1
+        """
+        Run the SPARQL query with retries and the circuit breaker of the endpoint.
+        :raises resilience.ServiceUnavailableError: if the endpoint doesn't answer within the question budget
+        :raises resilience.RequestRejectedError: if the endpoint rejects the query, e.g. an IRI it can't parse
+        """
+        import requests
+        data = {'query': query, 'format': self._sparql_format}
+        headers = {'Accept': self._sparql_format}
+
+        def call_sparql(timeout):
+            resp = transport.get_session('sparql').post(self._sparql_uri, data=data, headers=headers,
+                                                        timeout=timeout)
+            resilience.check_response(resp)
+            return resp.json()
+
+        return resilience.call('sparql', call_sparql, config.SPARQL_TIMEOUT, (requests.RequestException, ValueError))
+
+    def sparql_stream(self, query, consume):
+        """
+        Run the SPARQL query and parse the CSV result while it is downloaded, without keeping the whole response.
+        The stream is consumed inside the retries, so a connection broken in the middle is retried as a whole.
+        :param consume: function of the iterator of result rows (lists of values, the header is skipped)
+        :return: result of <consume>
+        :raises resilience.ServiceUnavailableError: if the endpoint doesn't answer within the question budget
+        :raises resilience.RequestRejectedError: if the endpoint rejects the query, e.g. an IRI it can't parse
+        """
+        import requests
+        data = {'query': query, 'format': 'text/csv'}
+        headers = {'Accept': 'text/csv'}
+
+        def call_sparql(timeout):
+            resp = transport.get_session('sparql').post(self._sparql_uri, data=data, headers=headers,
+                                                        timeout=timeout, stream=True)
+            with resp:
+                resilience.check_response(resp)
+                resp.encoding = 'utf-8'
+                return consume(iter_csv_rows(resp.iter_content(chunk_size=64 * 1024, decode_unicode=True)))
+
+        return resilience.call('sparql', call_sparql, config.SPARQL_TIMEOUT,
+                               (requests.RequestException, ValueError, csv.Error))
 
     def get_entity_properties(self, entity_uri, entity_class):
         """
         Fetch properties for the given entity.
+        Only DBpedia properties (they have descriptions) that are not blacklisted are selected,
+        with links or literals without language or in russian or english (thus eliminate 'de', 'jp', ...).
         Query example:
-        select distinct ?property, ?subject, ?obj
+        select distinct ?property ?obj
         where {
-             ?subject a <http://dbpedia.org/ontology/Place> .
-             ?subject ?property ?obj .
-             FILTER(?subject=<http://dbpedia.org/resource/Pavlohrad>)
+             <http://dbpedia.org/resource/Pavlohrad> a <http://dbpedia.org/ontology/Place> .
+             <http://dbpedia.org/resource/Pavlohrad> ?property ?obj .
+             FILTER(STRSTARTS(STR(?property), "http://dbpedia.org/"))
+             FILTER(?property NOT IN (<http://dbpedia.org/property/years>, <http://dbpedia.org/property/name>))
+             FILTER(!isLiteral(?obj) || lang(?obj) IN ("", "en", "ru"))
         }
         :param entity_uri: URI of the entity
         :return: dictionary of pairs (property URI, property value)
         """
+        query = """
+        select distinct ?property ?obj
+        where {{
+             <{1}> a <{0}> .
+             <{1}> ?property ?obj .
+             FILTER(STRSTARTS(STR(?property), "http://dbpedia.org/"))
+             FILTER(?property NOT IN ({2}))
+             FILTER(!isLiteral(?obj) || lang(?obj) IN ("", "en", "ru"))
+        }}
+        """
+        black_list = ', '.join('<{0}>'.format(prop_uri) for prop_uri in self._prop_black_list)
+        query_with_values = query.format(entity_class, entity_uri, black_list)
+
+        def to_prop_dict(rows):
+            prop_dict = defaultdict(list)
+            for prop_uri, prop_value in rows:
+                prop_dict[prop_uri].append(prop_value)
+            return prop_dict
+
+        return self.sparql_stream(query_with_values, to_prop_dict)
+
+    @metrics.timed('sparql_properties')
+    def get_first_entity_properties(self, entity_uri, entity_classes):
+        """
+        Fetch properties for the first class of the entity that gives a non-empty result.
+        If PARALLEL_CLASS_QUERIES is set, up to CLASS_QUERY_MAX_FANOUT class queries are sent concurrently,
+        the results are still taken in class order and the queries that are no longer needed are cancelled.
+        :param entity_uri: URI of the entity
+        :param entity_classes: list of class URIs in order of preference
+        :return: dictionary of pairs (property URI, property value)
+        """
+        prop_dict = self._entity_cache.get(entity_uri)
+        if prop_dict is None:
+            prop_dict = dict(self._query_first_entity_properties(entity_uri, entity_classes))
+            self._entity_cache.set(entity_uri, prop_dict)
+        return prop_dict
+
+    def _query_first_entity_properties(self, entity_uri, entity_classes):
+        if not config.PARALLEL_CLASS_QUERIES or len(entity_classes) < 2:
+            for cls in entity_classes:
+                prop_dict = self.get_entity_properties(entity_uri, cls)
+                if prop_dict:
+                    return prop_dict
+            return {}
+
+        classes = iter(entity_classes)
+        pending = deque()
+
+        def submit_next():
+            cls = next(classes, None)
+            if cls is not None:
+                # the query keeps the time budget of the question
+                pending.append(self._executor.submit(contextvars.copy_context().run,
+                                                     self.get_entity_properties, entity_uri, cls))
 
-        # entity_class = 'http://dbpedia.org/ontology/Place'
+        for _ in range(max(config.CLASS_QUERY_MAX_FANOUT, 1)):
+            submit_next()
+        try:
+            while pending:
+                prop_dict = pending.popleft().result()
+                if prop_dict:
+                    return prop_dict
+                submit_next()
+            return {}
+        finally:
+            # Queries that are already running can't be cancelled, their results are just ignored
+            for future in pending:
+                future.cancel()
+
+    @metrics.timed('image')
+    def get_entity_image(self, entity_uri):
+        """
+        Thumbnail of the entity: taken from its cached properties or fetched with a query of this one predicate.
+        Query example:
+        select ?thumbnail
+        where {
+             <http://dbpedia.org/resource/Pavlohrad> <http://dbpedia.org/ontology/thumbnail> ?thumbnail .
+        }
+        limit 1
+        :param entity_uri: URI of the entity
+        :return: URL of the image or None
+        """
+        prop_dict = self._entity_cache.get(entity_uri)
+        if prop_dict is not None:
+            return (prop_dict.get(THUMBNAIL) or [None])[0]
+        image = self._image_cache.get(entity_uri, _not_cached)
+        if image is _not_cached:
+            query = """
+            select ?thumbnail
+            where {{
+                 <{0}> <{1}> ?thumbnail .
+            }}
+            limit 1
+            """
+            r_json = self.sparql(query.format(entity_uri, THUMBNAIL))
+            bindings = r_json['results']['bindings']
+            image = bindings[0]['thumbnail']['value'] if bindings else None
+            self._image_cache.set(entity_uri, image)
+        return image
+
+    def invalidate_entity(self, entity_uri) -> None:
+        self._entity_cache.delete(entity_uri)
+        self._image_cache.delete(entity_uri)
+
+    def cache_stats(self) -> dict:
+        return {'entity_properties': self._entity_cache.stats(),
+                'entity_images':     self._image_cache.stats(),
+                'lookup':            self._lookup_cache.stats()}
+
+    def get_property_descr(self, property_uri):
+        return self.get_property_descrs([property_uri])[property_uri]
+
+    @metrics.timed('descriptions')
+    def get_property_descrs(self, property_uris, chunk_size=50):
+        """
+        Get descriptions for many properties at once.
+        Properties that are not cached yet are fetched with one SPARQL query per <chunk_size> properties.
+        Query example:
+        select ?property, ?p, ?o
+        where {
+             VALUES ?property { <http://dbpedia.org/property/website> <http://dbpedia.org/ontology/country> }
+             VALUES ?p { rdfs:label rdfs:comment }
+             ?property ?p ?o .
+             FILTER(lang(?o) = 'en')
+        }
+        :param property_uris: iterable of property URIs
+        :param chunk_size: max number of properties in one query
+        :return: dictionary of pairs (property URI, description)
+        """
+        descrs = {}
+        missing = []
+        for property_uri in property_uris:
+            if property_uri in self._prop_black_list:
+                # Just return empty description
+                descrs[property_uri] = ''
+            elif property_uri in self._cached_prop_descr:
+                descrs[property_uri] = self._cached_prop_descr[property_uri]
+            elif property_uri not in missing:
+                missing.append(property_uri)
+
+        if missing:
+            if config.DEBUG:
+                print('Fetch {0} property descrs from DBpedia.'.format(len(missing)))
+            fetched = {}
+            for i in range(0, len(missing), chunk_size):
+                fetched.update(self._fetch_property_descrs(missing[i:i + chunk_size]))
+            self._add_to_cached_prop_descr(fetched)
+            descrs.update(fetched)
+        return descrs
+
+    def _fetch_property_descrs(self, property_uris):
+        rdfs_descr = {'label':   'http://www.w3.org/2000/01/rdf-schema#label',
+                      'comment': 'http://www.w3.org/2000/01/rdf-schema#comment'}
         query = """
-        select distinct ?property, ?subject, ?obj
+        select ?property, ?p, ?o
         where {{
-             ?subject a <{0}> .
-             ?subject ?property ?obj .
-             FILTER(?subject=<{1}>)
+             VALUES ?property {{ {0} }}
+             VALUES ?p {{ <{1}> <{2}> }}
+             ?property ?p ?o .
+             FILTER(lang(?o) = 'en')
         }}
         """
-        query_with_values = query.format(entity_class, entity_uri)
+        query_with_values = query.format(' '.join('<{0}>'.format(uri) for uri in property_uris),
+                                         rdfs_descr['label'], rdfs_descr['comment'])
         r_json = self.sparql(query_with_values)
-        prop_dict = defaultdict(list)
+        labels, comments = defaultdict(list), defaultdict(list)
         for spo in r_json['results']['bindings']:
-            # Add (property -> value) if property is from DBPedia and thus has description
-            if utils.is_dbpedia_link(spo['property']['value']):
-                # Add (property -> value) if lang is not defined (for links) or if it is
-                # russian or english (thus eliminate 'de', 'jp', ...)
-                if 'xml:lang' not in spo['obj'] or spo['obj']['xml:lang'] in ('ru', 'en'):
-                    prop_uri = spo['property']['value']
-                    prop_value = spo['obj']['value']
-                    prop_dict[prop_uri] += [prop_value]
-        return prop_dict
+            target = labels if spo['p']['value'] == rdfs_descr['label'] else comments
+            target[spo['property']['value']].append(spo['o']['value'])
+        # Label goes first, then comment, e.g. 'country | The country where the thing is located.'
+        return {uri: ' | '.join(labels[uri] + comments[uri]) for uri in property_uris}
 
-    def get_property_descr(self, property_uri):
-        if property_uri in self._prop_black_list:
-            # Just return empty description
-            return ''
-        if property_uri in self._cached_prop_descr:
-            descr = self._cached_prop_descr[property_uri]
-        else:
-            print("Fetch property descr from DBpedia:", property_uri)
-
-            rdfs_descr = {'label':   'http://www.w3.org/2000/01/rdf-schema#label',
-                          'comment': 'http://www.w3.org/2000/01/rdf-schema#comment'}
-
-            r_json = self.sparql('DESCRIBE <{0}>'.format(property_uri))
-            descr_list = []
-            for spo in r_json['results']['bindings']:
-                # if the given predicate is description (label or comment for ontology/property)
-                if spo['p']['value'] in rdfs_descr.values():
-                    if spo['o']['lang'] == 'en':
-                        descr_list.append(spo['o']['value'])
-            descr = ' | '.join(descr_list)
-
-            self._add_to_cached_prop_descr(property_uri, descr)
-        return descr
-
-    def _add_to_cached_prop_descr(self, property_uri: str, descr: str):
-        self._cached_prop_descr[property_uri] = descr
-        self._db.put_property_descr(property_uri, descr)
+    def refresh_property_descr(self) -> int:
+        """
+        Pull only the descriptions that were stored (e.g. by other workers) since the last load.
+        If no descriptions are loaded yet, all of them are loaded (and nothing else is selected).
+        :return: number of new descriptions
+        """
+        if DBPediaKnowledgeBase._prop_descr is None:
+            return len(self._cached_prop_descr)
+        prop_descr = self._cached_prop_descr
+        loaded_at = dt.datetime.now()
+        since = self._prop_descr_loaded_at - dt.timedelta(seconds=config.PROPERTY_DESCR_REFRESH_OVERLAP)
+        n_new = 0
+        for page in self._db.iter_property_descr_pages(since=str(since)):
+            prop_descr.update(page)
+            n_new += len(page)
+        DBPediaKnowledgeBase._prop_descr_loaded_at = loaded_at
+        return n_new
+
+    def start_property_descr_refresh(self, interval: float) -> None:
+        """
+        Pull the new property descriptions every <interval> seconds in a background thread.
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    n_new = self.refresh_property_descr()
+                    if config.DEBUG:
+                        print('{0} new property descriptions.'.format(n_new))
+                except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                    print('Property descriptions refresh failed:', e)
+
+        threading.Thread(target=run, name='property-descr-refresh', daemon=True).start()
+
+    def _add_to_cached_prop_descr(self, prop_descrs: dict):
+        self._cached_prop_descr.update(prop_descrs)
+        self._db.put_property_descrs(prop_descrs)
+
+
+def iter_csv_rows(chunks):
+    """
+    :param chunks: iterable of text chunks of a CSV document with a header
+    :return: generator of rows, values spanning several lines and lines split between chunks are handled
+    """
+    def lines():
+        pending = ''
+        for chunk in chunks:
+            chunk_lines = (pending + chunk).splitlines(keepends=True)
+            pending = chunk_lines.pop() if chunk_lines and not chunk_lines[-1].endswith(('\r', '\n')) else ''
+            yield from chunk_lines
+        if pending:
+            yield pending
+
+    rows = csv.reader(lines())
+    next(rows, None)
+    for row in rows:
+        # a line break split between chunks gives an empty row
+        if row:
+            yield row
+
+
+_kb_lock = threading.Lock()
+_kb = None
+
+
+def get_knowledge_base() -> DBPediaKnowledgeBase:
+    """
+    Knowledge base shared by the whole process (it holds the HTTP sessions and caches):
+    the public DBpedia endpoints or the local indexes, see KNOWLEDGE_BASE_BACKEND.
+    """
+    global _kb
+    if _kb is None:
+        with _kb_lock:
+            if _kb is None:
+                if config.KNOWLEDGE_BASE_BACKEND == 'dbpedia':
+                    _kb = DBPediaKnowledgeBase()
+                elif config.KNOWLEDGE_BASE_BACKEND == 'local':
+                    from src.local_knowledge_base import LocalKnowledgeBase
+                    _kb = LocalKnowledgeBase(config.LOCAL_KNOWLEDGE_BASE_PATH)
+                else:
+                    raise ValueError('Unknown knowledge base backend: {0}'.format(config.KNOWLEDGE_BASE_BACKEND))
+    return _kb
 
 
 # 'é'.encode().decode()
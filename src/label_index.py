@@ -0,0 +1,358 @@
+"""
+In-process index of entity labels and redirects that answers DBpedia Lookup queries without HTTP.
+Every entity has a URI, name, description (abstract), classes and popularity (e.g. the Lookup refCount),
+and any number of labels. Labels are kept in a sorted list for prefix search and in trigram postings
+for fuzzy search (a last resort, similar labels are often different entities); among matching entities
+the most popular one wins.
+The index is built from a labels file and grows with every successful live lookup.
+Usage to build the index file: python -m src.label_index <labels.tsv[.bz2|.gz]> ...
+where each line is: URI <TAB> label [<TAB> description [<TAB> space-separated classes [<TAB> popularity]]]
+and the lines after the first one of a URI add its alternative labels (redirects).
+The index file is only written by the build. Live lookups are appended in the same format to a journal next to it
+(<index file>.learned.tsv), with the time they were learned at as a 6th field. All workers share the journal and
+read it when they load the index. Learned labels expire after LABEL_INDEX_LEARNED_TTL seconds like cached lookups,
+built labels never do.
+"""
+import atexit
+import bisect
+import bz2
+import gzip
+import os
+import pickle
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+
+import src.config as config
+import src.local_knowledge_base as lkb
+
+
+def _trigrams(key: str) -> set:
+    padded = ' ' + key + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _clean(field) -> str:
+    # fields of the journal can't have tabs or line breaks
+    return ' '.join(str(field).split())
+
+
+class LabelIndex:
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        # entities, indexed by entity id
+        self._ids = {}
+        self._uris = []
+        self._names = []
+        self._descriptions = []
+        self._classes = []
+        self._popularity = []
+        # labels, indexed by label id
+        self._label_keys = []
+        self._label_entities = array('I')
+        self._label_n_trigrams = array('H')
+        # unix time a label was learned at, 0 for built labels (they don't expire)
+        self._label_learned_at = array('d')
+        # normalized label -> label ids
+        self._exact = {}
+        # (normalized label, label id) for prefix search, sorted on the next prefix search after additions
+        self._sorted = []
+        self._is_sorted = True
+        # trigram -> label ids
+        self._trigrams = {}
+        # lines of learned entities not written to the journal yet
+        self._learned = []
+        self._journal_running = False
+
+    def __len__(self):
+        return len(self._uris)
+
+    def __contains__(self, uri):
+        return uri in self._ids
+
+    def add(self, uri, name, description='', classes=(), popularity=0, labels=(), learned_at=0.0) -> None:
+        """
+        Add an entity or update a known one: new labels are added, empty fields don't override stored ones.
+        :param name: main label of the entity
+        :param labels: alternative labels, e.g. redirects or queries that were resolved to this entity
+        :param learned_at: unix time of the live lookup the labels come from, 0 if they don't expire
+        """
+        with self._lock:
+            entity_id = self._ids.get(uri)
+            if entity_id is None:
+                entity_id = self._ids[uri] = len(self._uris)
+                self._uris.append(uri)
+                self._names.append(name)
+                self._descriptions.append(description)
+                self._classes.append(tuple(classes))
+                self._popularity.append(popularity)
+            else:
+                if description:
+                    self._descriptions[entity_id] = description
+                if classes:
+                    self._classes[entity_id] = tuple(classes)
+                self._popularity[entity_id] = max(self._popularity[entity_id], popularity)
+            for label in (name,) + tuple(labels):
+                self._add_label(entity_id, lkb.normalize_label(label), learned_at)
+
+    def _add_label(self, entity_id, key, learned_at) -> None:
+        if not key:
+            return
+        label_ids = self._exact.setdefault(key, [])
+        for label_id in label_ids:
+            if self._label_entities[label_id] == entity_id:
+                # a label learned again lives longer, a built one never expires
+                current = self._label_learned_at[label_id]
+                if current:
+                    self._label_learned_at[label_id] = max(current, learned_at) if learned_at else 0.0
+                return
+        label_id = len(self._label_keys)
+        trigrams = _trigrams(key)
+        self._label_keys.append(key)
+        self._label_entities.append(entity_id)
+        self._label_n_trigrams.append(min(len(trigrams), 65535))
+        self._label_learned_at.append(learned_at)
+        label_ids.append(label_id)
+        # sorting once after many additions is much cheaper than an insort per label
+        self._sorted.append((key, label_id))
+        self._is_sorted = False
+        for trigram in trigrams:
+            self._trigrams.setdefault(trigram, array('I')).append(label_id)
+
+    def _entity(self, entity_id) -> tuple:
+        return (self._uris[entity_id], self._names[entity_id], self._descriptions[entity_id],
+                self._classes[entity_id])
+
+    def _matches_class(self, entity_id, cls) -> bool:
+        return not cls or 'http://dbpedia.org/ontology/' + cls in self._classes[entity_id]
+
+    @staticmethod
+    def _min_learned_at() -> float:
+        return time.time() - config.LABEL_INDEX_LEARNED_TTL
+
+    def _is_live(self, label_id, min_learned_at) -> bool:
+        learned_at = self._label_learned_at[label_id]
+        return not learned_at or learned_at >= min_learned_at
+
+    def search(self, string, cls=''):
+        """
+        Exact match of the normalized label (the entity name or one of its alternative labels).
+        :param cls: DBpedia ontology class of the entity, e.g. 'Person' (any class if empty)
+        :return: tuple (uri, name, description, classes) as DBPediaKnowledgeBase.search or None
+        """
+        key = lkb.normalize_label(string)
+        min_learned_at = self._min_learned_at()
+        with self._lock:
+            entity_ids = [self._label_entities[label_id] for label_id in self._exact.get(key, ())
+                          if self._is_live(label_id, min_learned_at)]
+            entity_ids = [entity_id for entity_id in entity_ids if self._matches_class(entity_id, cls)]
+            if entity_ids:
+                return self._entity(max(entity_ids, key=self._popularity.__getitem__))
+            return None
+
+    def fuzzy_search(self, string, cls=''):
+        """
+        The label with the most similar trigrams (Jaccard similarity of at least LABEL_INDEX_MIN_SIMILARITY,
+        or LABEL_INDEX_MIN_CLASS_SIMILARITY if the entity must be of class <cls>).
+        Similar labels are often different entities ('Apollo 11' and 'Apollo 13'), so this is only a last resort
+        for strings that nothing else resolves.
+        :return: tuple (uri, name, description, classes) as DBPediaKnowledgeBase.search or None
+        """
+        key = lkb.normalize_label(string)
+        with self._lock:
+            best = self._fuzzy_match(key, cls)
+            return None if best is None else self._entity(best)
+
+    def _fuzzy_match(self, key, cls):
+        trigrams = _trigrams(key)
+        threshold = config.LABEL_INDEX_MIN_CLASS_SIMILARITY if cls else config.LABEL_INDEX_MIN_SIMILARITY
+        min_learned_at = self._min_learned_at()
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        # Jaccard similarity >= threshold needs at least this number of shared trigrams
+        min_shared = threshold * len(trigrams)
+        best, best_rank = None, None
+        for label_id in [label_id for label_id, n_shared in shared.items() if n_shared >= min_shared]:
+            n_shared = shared[label_id]
+            similarity = n_shared / (len(trigrams) + self._label_n_trigrams[label_id] - n_shared)
+            entity_id = self._label_entities[label_id]
+            if similarity >= threshold and self._matches_class(entity_id, cls) and \
+                    self._is_live(label_id, min_learned_at):
+                rank = (similarity, self._popularity[entity_id])
+                if best_rank is None or rank > best_rank:
+                    best, best_rank = entity_id, rank
+        return best
+
+    def complete(self, prefix, cls='', max_hits=10, max_scanned=1000) -> list:
+        """
+        Entities with a label that starts with <prefix>, the most popular first.
+        :param max_scanned: max number of labels looked at
+        :return: list of tuples (uri, name, description, classes)
+        """
+        key = lkb.normalize_label(prefix)
+        min_learned_at = self._min_learned_at()
+        with self._lock:
+            if not self._is_sorted:
+                self._sorted.sort()
+                self._is_sorted = True
+            start = bisect.bisect_left(self._sorted, (key,))
+            entity_ids = []
+            for label, label_id in self._sorted[start:start + max_scanned]:
+                if not label.startswith(key):
+                    break
+                if self._is_live(label_id, min_learned_at):
+                    entity_ids.append(self._label_entities[label_id])
+            entity_ids = [entity_id for entity_id in set(entity_ids) if self._matches_class(entity_id, cls)]
+            entity_ids.sort(key=lambda entity_id: -self._popularity[entity_id])
+            return [self._entity(entity_id) for entity_id in entity_ids[:max_hits]]
+
+    @property
+    def journal_path(self):
+        return None if self.path is None else self.path + '.learned.tsv'
+
+    def learn(self, uri, name, description, classes, popularity, query) -> None:
+        """
+        Add the result of a live lookup (the query becomes a label of the entity). The learned entities are
+        appended to the journal in a background thread after every LABEL_INDEX_SAVE_EVERY additions.
+        """
+        learned_at = time.time()
+        self.add(uri, name, description, classes, popularity, labels=(query,), learned_at=learned_at)
+        if self.journal_path is None:
+            return
+        fields = [uri, name, description, ' '.join(classes), str(popularity), repr(learned_at)]
+        label_fields = [uri, query, '', '', '', repr(learned_at)]
+        # Both lines are written at once, the entity must come before its alternative label
+        lines = '\n'.join('\t'.join(_clean(field) for field in line_fields)
+                          for line_fields in (fields, label_fields)) + '\n'
+        with self._lock:
+            self._learned.append(lines)
+            start_writing = len(self._learned) >= config.LABEL_INDEX_SAVE_EVERY and not self._journal_running
+            if start_writing:
+                self._journal_running = True
+        if start_writing:
+            threading.Thread(target=self._write_journal, name='label-index-journal', daemon=True).start()
+
+    def _write_journal(self) -> None:
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._journal_running = False
+
+    def flush(self) -> None:
+        """
+        Append the learned entities to the journal.
+        Every entity is one write to a file opened with O_APPEND, so the workers don't overwrite each other.
+        """
+        with self._lock:
+            learned, self._learned = self._learned, []
+        if not learned:
+            return
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            for lines in learned:
+                os.write(fd, lines.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def save(self) -> None:
+        """
+        Write the whole index file, e.g. after a build (the journal is kept and read on top of it).
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            state = {name: value for name, value in self.__dict__.items()
+                     if name not in ('path', '_lock', '_learned', '_journal_running')}
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+
+    def load(self) -> bool:
+        """
+        Load the index file and the journal of learned entities.
+        The expired lines of the journal are skipped (and the lines without the time they were learned at).
+        :return: False if there is neither
+        """
+        if self.path is None:
+            return False
+        loaded = False
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            # index files built before labels could expire
+            state.setdefault('_label_learned_at', array('d', [0.0]) * len(state['_label_keys']))
+            with self._lock:
+                self.__dict__.update(state)
+            loaded = True
+        if os.path.exists(self.journal_path):
+            min_learned_at = self._min_learned_at()
+            with open(self.journal_path, encoding='utf-8') as f:
+                for uri, label, description, classes, popularity, learned_at in read_labels(f):
+                    if learned_at >= min_learned_at:
+                        self.add(uri, label, description, classes, popularity, learned_at=learned_at)
+            loaded = True
+        return loaded
+
+
+def read_labels(lines):
+    """
+    :param lines: lines of a labels file or of the journal (see the module docstring)
+    :return: generator of (uri, label, description, classes, popularity, learned_at), learned_at is 0 if not given
+    """
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 2 or not fields[0]:
+            continue
+        fields += [''] * (6 - len(fields))
+        uri, label, description, classes, popularity, learned_at = fields[:6]
+        yield uri, label, description, tuple(classes.split()), int(popularity or 0), float(learned_at or 0)
+
+
+def build_index(paths: list, index_path=None) -> LabelIndex:
+    """
+    Stream labels files into a new index.
+    :param paths: labels files, optionally compressed with bz2 or gzip
+    """
+    index = LabelIndex(index_path)
+    for path in paths:
+        opener = bz2.open if path.endswith('.bz2') else gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for uri, label, description, classes, popularity, learned_at in read_labels(f):
+                index.add(uri, label, description, classes, popularity)
+    return index
+
+
+_index_lock = threading.Lock()
+_index = None
+
+
+def get_label_index() -> LabelIndex:
+    """
+    Index shared by the whole process, loaded from LABEL_INDEX_PATH (empty if there is no index file yet).
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = LabelIndex(config.LABEL_INDEX_PATH)
+                index.load()
+                atexit.register(index.flush)
+                _index = index
+    return _index
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    label_index = build_index(sys.argv[1:], config.LABEL_INDEX_PATH)
+    label_index.save()
+    print('Label index of {0} entities saved to {1}'.format(len(label_index), config.LABEL_INDEX_PATH))
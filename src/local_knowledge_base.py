@@ -0,0 +1,388 @@
+"""
+Knowledge base read from local indexes built from a DBpedia dump (N-Triples), an offline alternative
+to the public SPARQL and Lookup endpoints with the same interface as DBPediaKnowledgeBase.
+Three indexes are built: entity URI -> its classes, label, description and properties,
+property URI -> description (label | comment) and normalized label -> entity URIs by popularity.
+Every index is a sorted table of fixed-size records plus key and data files, all read through mmap,
+so opening the knowledge base costs nothing and only the pages of the requested entities are read.
+Usage to build the indexes: python -m src.local_knowledge_base <index dir> <file.nt[.bz2|.gz]> ...
+"""
+import bz2
+import gzip
+import heapq
+import itertools
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+
+import src.config as config
+import src.metrics as metrics
+import src.utils as utils
+
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+RDFS_LABEL = 'http://www.w3.org/2000/01/rdf-schema#label'
+RDFS_COMMENT = 'http://www.w3.org/2000/01/rdf-schema#comment'
+DBO_ABSTRACT = 'http://dbpedia.org/ontology/abstract'
+DBO_REDIRECTS = 'http://dbpedia.org/ontology/wikiPageRedirects'
+DBO_THUMBNAIL = 'http://dbpedia.org/ontology/thumbnail'
+# list of meaningless properties for QA system (as in DBPediaKnowledgeBase)
+PROP_BLACK_LIST = ['http://dbpedia.org/property/years',
+                   'http://dbpedia.org/property/name']
+
+# key offset, key length, data offset, data length
+_record = struct.Struct('<4Q')
+
+
+class MmapIndex:
+    """
+    Read-only map of string keys to bytes stored in <prefix>.idx (sorted records), <prefix>.keys and <prefix>.data.
+    Keys are found by binary search over the memory-mapped records.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._maps = None
+
+    def _open(self):
+        if self._maps is None:
+            with self._lock:
+                if self._maps is None:
+                    maps = []
+                    for ext in ('.idx', '.keys', '.data'):
+                        with open(self.prefix + ext, 'rb') as f:
+                            # empty files can't be mapped
+                            maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                                        if os.fstat(f.fileno()).st_size else b'')
+                    self._maps = maps
+        return self._maps
+
+    def __len__(self):
+        return len(self._open()[0]) // _record.size
+
+    def _key_at(self, i) -> bytes:
+        idx, keys, _ = self._open()
+        key_offset, key_len, _, _ = _record.unpack_from(idx, i * _record.size)
+        return keys[key_offset:key_offset + key_len]
+
+    def get(self, key: str):
+        """
+        :return: data of the key or None if there is no such key
+        """
+        idx, keys, data = self._open()
+        target = key.encode('utf-8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self._key_at(lo) == target:
+            _, _, data_offset, data_len = _record.unpack_from(idx, lo * _record.size)
+            return data[data_offset:data_offset + data_len]
+        return None
+
+    def items(self):
+        """
+        :return: generator of (key, data) in key order
+        """
+        idx, keys, data = self._open()
+        for i in range(len(self)):
+            key_offset, key_len, data_offset, data_len = _record.unpack_from(idx, i * _record.size)
+            yield keys[key_offset:key_offset + key_len].decode('utf-8'), data[data_offset:data_offset + data_len]
+
+
+class MmapIndexWriter:
+    """
+    Writes an MmapIndex from (key, data) pairs added in increasing key order.
+    """
+
+    def __init__(self, prefix):
+        self._files = [open(prefix + ext, 'wb') for ext in ('.idx', '.keys', '.data')]
+        self._offsets = [0, 0]
+        self._last_key = None
+        self.n_items = 0
+
+    def add(self, key: str, data: bytes) -> None:
+        encoded_key = key.encode('utf-8')
+        if self._last_key is not None and encoded_key <= self._last_key:
+            raise ValueError('Keys must be added in increasing order: {0}'.format(key))
+        idx_file, keys_file, data_file = self._files
+        idx_file.write(_record.pack(self._offsets[0], len(encoded_key), self._offsets[1], len(data)))
+        keys_file.write(encoded_key)
+        data_file.write(data)
+        self._offsets[0] += len(encoded_key)
+        self._offsets[1] += len(data)
+        self._last_key = encoded_key
+        self.n_items += 1
+
+    def close(self) -> None:
+        for f in self._files:
+            f.close()
+
+
+_triple_re = re.compile(r'^(<[^>]*>|_:\S+)\s+<([^>]*)>\s+'
+                        r'(<[^>]*>|_:\S+|"((?:[^"\\]|\\.)*)"(?:@([\w-]+)|\^\^<[^>]*>)?)\s*\.\s*$')
+_escape_re = re.compile(r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)')
+_escapes = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+
+def _unescape(match):
+    code = match.group(1)
+    if code[0] in 'uU' and len(code) > 1:
+        return chr(int(code[1:], 16))
+    return _escapes.get(code, code)
+
+
+def parse_ntriples(lines):
+    """
+    :param lines: iterable of N-Triples lines
+    :return: generator of (subject URI, property URI, value, language) where language is None for URI values
+             and '' for literals without a language; triples about blank nodes are skipped
+    """
+    for line in lines:
+        match = _triple_re.match(line)
+        if match is None:
+            continue
+        subject, prop, obj, literal, lang = match.groups()
+        if subject.startswith('_:') or obj.startswith('_:'):
+            continue
+        if literal is None:
+            yield subject[1:-1], prop, obj[1:-1], None
+        else:
+            yield subject[1:-1], prop, _escape_re.sub(_unescape, literal), lang or ''
+
+
+def normalize_label(label: str) -> str:
+    return ' '.join(label.lower().replace('_', ' ').split())
+
+
+def _is_kept(prop, lang) -> bool:
+    # Same filter as the SPARQL backend: DBpedia properties that are not blacklisted, with links or
+    # english/russian/untagged literals, plus the triples needed to describe entities and properties
+    if prop in (RDFS_LABEL, RDFS_COMMENT):
+        return lang == 'en'
+    return (prop == RDF_TYPE or
+            utils.is_dbpedia_link(prop) and prop not in PROP_BLACK_LIST and lang in (None, '', 'en', 'ru'))
+
+
+def _external_sort(lines, tmp_dir, chunk_size):
+    """
+    Sort lines that don't fit in memory: sorted chunks are written to <tmp_dir> and merged.
+    :return: generator of sorted lines
+    """
+    chunk_paths = []
+    while True:
+        chunk = sorted(itertools.islice(lines, chunk_size))
+        if not chunk:
+            break
+        path = os.path.join(tmp_dir, 'chunk{0}.txt'.format(len(chunk_paths)))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(line + '\n' for line in chunk)
+        chunk_paths.append(path)
+    files = [open(path, encoding='utf-8') for path in chunk_paths]
+    try:
+        for line in heapq.merge(*files):
+            yield line.rstrip('\n')
+    finally:
+        for f in files:
+            f.close()
+        for path in chunk_paths:
+            os.remove(path)
+
+
+def _group_by_key(sorted_lines):
+    """
+    :param sorted_lines: lines 'key<TAB>JSON value' sorted by key
+    :return: generator of (key, list of values)
+    """
+    split_lines = (line.split('\t', 1) for line in sorted_lines)
+    for key, group in itertools.groupby(split_lines, key=lambda pair: pair[0]):
+        yield key, [json.loads(value) for _, value in group]
+
+
+def _open_dump(path):
+    opener = bz2.open if path.endswith('.bz2') else gzip.open if path.endswith('.gz') else open
+    return opener(path, 'rt', encoding='utf-8')
+
+
+def build_indexes(nt_paths: list, index_dir: str, chunk_size=1000000) -> dict:
+    """
+    Build the indexes from N-Triples files in a streaming way: triples are sorted by subject with an external
+    sort in chunks of <chunk_size> lines, so memory does not depend on the size of the dump.
+    :param nt_paths: N-Triples files, optionally compressed with bz2 or gzip
+    :param index_dir: directory of the indexes
+    :return: dictionary of index sizes
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=index_dir)
+    properties = set()
+
+    def triple_lines():
+        for path in nt_paths:
+            with _open_dump(path) as f:
+                for subject, prop, value, lang in parse_ntriples(f):
+                    if _is_kept(prop, lang):
+                        properties.add(prop)
+                        yield subject + '\t' + json.dumps([prop, value, lang], ensure_ascii=False)
+
+    entities = MmapIndexWriter(os.path.join(index_dir, 'entities'))
+    prop_descrs = MmapIndexWriter(os.path.join(index_dir, 'properties'))
+    label_index = MmapIndexWriter(os.path.join(index_dir, 'labels'))
+    try:
+        label_path = os.path.join(tmp_dir, 'labels.txt')
+        with open(label_path, 'w', encoding='utf-8') as label_file:
+            for subject, triples in _group_by_key(_external_sort(triple_lines(), tmp_dir, chunk_size)):
+                classes, labels, comments, abstracts, redirects = [], [], [], [], []
+                props = {}
+                for prop, value, lang in triples:
+                    if prop == RDF_TYPE:
+                        classes.append(value)
+                    elif prop == RDFS_LABEL:
+                        labels.append(value)
+                    elif prop == RDFS_COMMENT:
+                        comments.append(value)
+                    else:
+                        if prop == DBO_ABSTRACT and lang == 'en':
+                            abstracts.append(value)
+                        elif prop == DBO_REDIRECTS:
+                            redirects.append(value)
+                        props.setdefault(prop, []).append(value)
+                if subject in properties and (labels or comments):
+                    # Label goes first, then comment, as in the SPARQL backend
+                    prop_descrs.add(subject, ' | '.join(labels + comments).encode('utf-8'))
+                # Redirect pages are only alternative labels of their targets
+                for target in redirects:
+                    for label in labels:
+                        label_file.write('{0}\t{1}\n'.format(normalize_label(label), json.dumps([0, target])))
+                if redirects or not props:
+                    continue
+                record = {'label':       labels[0] if labels else utils.extract_link_entity(subject),
+                          'description': (comments or abstracts or [''])[0],
+                          'classes':     classes,
+                          'properties':  props}
+                entities.add(subject, json.dumps(record, ensure_ascii=False).encode('utf-8'))
+                for label in labels:
+                    label_file.write('{0}\t{1}\n'.format(normalize_label(label), json.dumps([len(props), subject])))
+        with open(label_path, encoding='utf-8') as label_file:
+            label_lines = _external_sort((line.rstrip('\n') for line in label_file), tmp_dir, chunk_size)
+            for label, candidates in _group_by_key(label_lines):
+                # the most popular entity (by number of properties) first
+                uris = utils.unique_values([uri for _, uri in sorted(candidates, key=lambda c: -c[0])])
+                label_index.add(label, json.dumps(uris, ensure_ascii=False).encode('utf-8'))
+    finally:
+        for writer in (entities, prop_descrs, label_index):
+            writer.close()
+        shutil.rmtree(tmp_dir)
+    return {'entities': entities.n_items, 'properties': prop_descrs.n_items, 'labels': label_index.n_items}
+
+
+class LocalKnowledgeBase:
+    _basic_entity_class = 'http://www.w3.org/2002/07/owl#Thing'
+    _prop_black_list = PROP_BLACK_LIST
+
+    def __init__(self, index_dir):
+        self._entities = MmapIndex(os.path.join(index_dir, 'entities'))
+        self._properties = MmapIndex(os.path.join(index_dir, 'properties'))
+        self._labels = MmapIndex(os.path.join(index_dir, 'labels'))
+        self._prop_descr = None
+
+    @property
+    def _cached_prop_descr(self) -> dict:
+        if self._prop_descr is None:
+            self._prop_descr = {uri: descr.decode('utf-8') for uri, descr in self._properties.items()}
+        return self._prop_descr
+
+    def _get_entity(self, entity_uri):
+        data = self._entities.get(entity_uri)
+        return None if data is None else json.loads(data.decode('utf-8'))
+
+    @metrics.timed('lookup')
+    def search(self, string, cls='', type_='Keyword', max_hits=1):
+        data = self._labels.get(normalize_label(string))
+        for uri in json.loads(data.decode('utf-8')) if data is not None else []:
+            entity = self._get_entity(uri)
+            if entity is None or cls and 'http://dbpedia.org/ontology/' + cls not in entity['classes']:
+                continue
+            classes = [cls_uri for cls_uri in entity['classes'] if utils.is_dbpedia_link(cls_uri)]
+            if not classes:
+                classes = [self._basic_entity_class]
+            return uri, entity['label'], entity['description'], tuple(classes)
+        if config.DEBUG:
+            print('No results for <{0}> of class <{1}> (<{2}Search>)'.format(string, cls, type_))
+        return None
+
+    def get_entity_properties(self, entity_uri, entity_class):
+        """
+        :param entity_uri: URI of the entity
+        :param entity_class: only entities of this class have properties (any entity is an owl:Thing)
+        :return: dictionary of pairs (property URI, property values)
+        """
+        entity = self._get_entity(entity_uri)
+        if entity is None or (entity_class != self._basic_entity_class and entity_class not in entity['classes']):
+            return {}
+        # indexes built before the blacklist was applied in the build still have these properties
+        return {prop: values for prop, values in entity['properties'].items() if prop not in self._prop_black_list}
+
+    @metrics.timed('sparql_properties')
+    def get_first_entity_properties(self, entity_uri, entity_classes):
+        for cls in entity_classes:
+            prop_dict = self.get_entity_properties(entity_uri, cls)
+            if prop_dict:
+                return prop_dict
+        return {}
+
+    @metrics.timed('image')
+    def get_entity_image(self, entity_uri):
+        """
+        :return: URL of the thumbnail of the entity or None
+        """
+        entity = self._get_entity(entity_uri)
+        images = entity['properties'].get(DBO_THUMBNAIL) if entity is not None else None
+        return images[0] if images else None
+
+    def invalidate_entity(self, entity_uri) -> None:
+        # Nothing is cached, the indexes are read-only
+        pass
+
+    def cache_stats(self) -> dict:
+        return {}
+
+    def get_property_descr(self, property_uri):
+        return self.get_property_descrs([property_uri])[property_uri]
+
+    @metrics.timed('descriptions')
+    def get_property_descrs(self, property_uris, chunk_size=None):
+        """
+        :param property_uris: iterable of property URIs
+        :param chunk_size: not used, kept for compatibility with DBPediaKnowledgeBase
+        :return: dictionary of pairs (property URI, description), '' for unknown properties
+        """
+        descrs = {}
+        for property_uri in property_uris:
+            data = None if property_uri in self._prop_black_list else self._properties.get(property_uri)
+            descrs[property_uri] = '' if data is None else data.decode('utf-8')
+        return descrs
+
+    def refresh_property_descr(self) -> int:
+        return 0
+
+    def start_property_descr_refresh(self, interval: float) -> None:
+        # The indexes don't change while the process runs
+        pass
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    sizes = build_indexes(sys.argv[2:], sys.argv[1])
+    print('Indexes of {entities} entities, {properties} property descriptions '
+          'and {labels} labels saved to {0}'.format(sys.argv[1], **sizes))
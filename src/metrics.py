@@ -0,0 +1,147 @@
+"""
+In-process metrics: latency histograms of the stages of answering a question and counters,
+rendered in the Prometheus text format (see the /metrics route).
+Recording is a dictionary lookup and a few additions under a lock, so it stays on the hot path.
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Upper bounds of the latency buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # counts[i] is the number of values in (buckets[i - 1], buckets[i]], the last one is for +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> list:
+        counts, total = [], 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> {sorted label pairs -> value}
+        self._counters = OrderedDict()
+        self._histograms = OrderedDict()
+        self._collectors = []
+
+    def inc(self, name: str, amount=1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, OrderedDict())
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, OrderedDict())
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def get_counter(self, name: str, **labels):
+        with self._lock:
+            return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def get_histogram(self, name: str, **labels):
+        with self._lock:
+            return self._histograms.get(name, {}).get(tuple(sorted(labels.items())))
+
+    def register_collector(self, collector) -> None:
+        """
+        :param collector: function that returns a list of gauges (name, labels dict, value), called on every render
+        """
+        self._collectors.append(collector)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines.append('# TYPE {0} counter'.format(name))
+                for key, value in series.items():
+                    lines.append('{0}{1} {2}'.format(name, _format_labels(key), _format_value(value)))
+            for name, series in self._histograms.items():
+                lines.append('# TYPE {0} histogram'.format(name))
+                for key, histogram in series.items():
+                    bounds = [_format_value(bound) for bound in histogram.buckets] + ['+Inf']
+                    for bound, count in zip(bounds, histogram.cumulative_counts()):
+                        lines.append('{0}_bucket{1} {2}'.format(name, _format_labels(key + (('le', bound),)), count))
+                    lines.append('{0}_sum{1} {2}'.format(name, _format_labels(key), _format_value(histogram.sum)))
+                    lines.append('{0}_count{1} {2}'.format(name, _format_labels(key), histogram.count))
+        gauges = OrderedDict()
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+        for name, series in gauges.items():
+            lines.append('# TYPE {0} gauge'.format(name))
+            for key, value in series:
+                lines.append('{0}{1} {2}'.format(name, _format_labels(key), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(key) -> str:
+    if not key:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+    return '{' + ','.join('{0}="{1}"'.format(name, value) for (name, _), value in zip(key, escaped)) + '}'
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+
+def inc(name: str, amount=1, **labels) -> None:
+    registry.inc(name, amount, **labels)
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Record the duration of the block (or of the decorated function) in deepanswer_stage_seconds,
+    failures are counted in deepanswer_stage_errors_total.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc('deepanswer_stage_errors_total', stage=stage)
+        raise
+    finally:
+        registry.observe('deepanswer_stage_seconds', time.perf_counter() - start, stage=stage)
+
+
+def register_collector(collector) -> None:
+    registry.register_collector(collector)
+
+
+def render() -> str:
+    return registry.render()
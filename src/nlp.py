@@ -0,0 +1,112 @@
+"""
+Registry of NLP models shared by the whole process.
+Models are loaded once on first use (or eagerly via load_models()) and then reused by every
+QATokenizer, PatternMatcher and SubjectFinder.
+NLTK and pymorphy2 are imported on first use too, since importing them takes seconds.
+"""
+import sys
+import threading
+
+import src.cache as cache
+import src.config as config
+
+_lock = threading.Lock()
+_models = {}
+
+
+def _get(name, factory):
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                model = factory()
+                _models[name] = model
+    return model
+
+
+def _make_tagger():
+    from nltk.tag.perceptron import PerceptronTagger
+    return PerceptronTagger()
+
+
+def _make_lemmatizer():
+    from nltk.corpus import wordnet
+    from nltk.stem.wordnet import WordNetLemmatizer
+    lemmatizer = WordNetLemmatizer()
+    wordnet.ensure_loaded()
+    return lemmatizer
+
+
+def _make_morph():
+    import pymorphy2
+    return pymorphy2.MorphAnalyzer()
+
+
+def get_tagger():
+    return _get('tagger', _make_tagger)
+
+
+def get_lemmatizer():
+    return _get('lemmatizer', _make_lemmatizer)
+
+
+def get_morph():
+    return _get('morph', _make_morph)
+
+
+def word_tokenize(text: str) -> list:
+    import nltk
+    return nltk.word_tokenize(text)
+
+
+def pos_tag(tokens: list) -> list:
+    import nltk
+    return nltk.tag._pos_tag(tokens, None, get_tagger())
+
+
+class MorphCache:
+    """
+    Bounded memo of pymorphy2 analysis: token -> (POS, normal form) of its most probable parse.
+    """
+
+    def __init__(self, maxsize):
+        self._cache = cache.TTLCache(maxsize)
+
+    def analyze(self, token: str) -> tuple:
+        result = self._cache.get(token)
+        if result is None:
+            parsed = get_morph().parse(token)[0]
+            result = (parsed.tag.POS, parsed.normal_form)
+            self._cache.set(token, result)
+        return result
+
+    def stats(self) -> dict:
+        memory_bytes = sum(sys.getsizeof(token) + sys.getsizeof(result) + sys.getsizeof(result[1])
+                           for token, result in self._cache.items())
+        return dict(self._cache.stats(), memory_bytes=memory_bytes)
+
+
+_morph_cache = MorphCache(config.MORPH_CACHE_SIZE)
+
+
+def analyze(token: str) -> tuple:
+    """
+    Morphological analysis shared by SubjectFinder and PatternMatcher.
+    :param token: word form
+    :return: tuple (POS or None, normal form)
+    """
+    return _morph_cache.analyze(token)
+
+
+def morph_stats() -> dict:
+    return _morph_cache.stats()
+
+
+def load_models() -> None:
+    """
+    Eagerly load all models, e.g. at server start, so that the first question doesn't pay for it.
+    """
+    get_tagger()
+    get_lemmatizer()
+    get_morph()
@@ -0,0 +1,222 @@
+"""
+TF-IDF index over all known property descriptions.
+The vectorizer is fitted once over the whole description corpus and every description is kept as a row
+of a sparse matrix, so ranking the properties of an entity is a row selection plus a sparse dot product.
+Usage to (re)build the index file: python -m src.property_index
+numpy, scipy and sklearn are imported on first use, since importing them takes about a second.
+"""
+import copy
+import os
+import pickle
+import threading
+
+import src.config as config
+import src.knowledge_base as kdb
+import src.text as txt
+
+
+class PropertyIndex:
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._descrs = {}
+        self._rows = {}
+        self._vectorizer = None
+        self._question_vectorizer = None
+        self._matrix = None
+        # number of rows that were added after the last fit (their new terms are not in the vocabulary)
+        self._n_added = 0
+        # True while a background refit runs
+        self._refit_running = False
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, property_uri):
+        return property_uri in self._rows
+
+    def fit(self, prop_descrs: dict) -> None:
+        """
+        Fit the vectorizer over the whole description corpus and rebuild the matrix.
+        :param prop_descrs: dictionary of pairs (property URI, description)
+        """
+        fitted = self._fit(prop_descrs)
+        if fitted is not None:
+            with self._lock:
+                self._set(dict(prop_descrs), *fitted)
+
+    @staticmethod
+    def _fit(prop_descrs: dict):
+        """
+        :return: tuple (vectorizer, matrix with a row per description in <prop_descrs> order) or None
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        vect = TfidfVectorizer(ngram_range=(1, 3), sublinear_tf=True,
+                               tokenizer=txt.QATokenizer('property'), token_pattern=None)
+        try:
+            return vect, vect.fit_transform(list(prop_descrs.values())).tocsr()
+        except ValueError:
+            # Empty vocabulary, e.g. no descriptions yet: the index stays unfitted
+            return None
+
+    def _set(self, prop_descrs: dict, vect, matrix) -> None:
+        # called with the lock held
+        self._descrs = prop_descrs
+        self._rows = {uri: i for i, uri in enumerate(prop_descrs.keys())}
+        self._vectorizer = vect
+        self._question_vectorizer = self._make_question_vectorizer(vect)
+        self._matrix = matrix
+        self._n_added = 0
+
+    @staticmethod
+    def _make_question_vectorizer(vect):
+        # Same vocabulary and idf, but questions come already tokenized by the question tokenizer
+        question_vect = copy.copy(vect)
+        question_vect.tokenizer = str.split
+        question_vect.lowercase = False
+        return question_vect
+
+    def add(self, prop_descrs: dict) -> None:
+        """
+        Add descriptions of the properties that are not in the index yet.
+        New rows use the current vocabulary; after PROPERTY_INDEX_REFIT_EVERY additions the index is refitted
+        in a background thread (one at a time), the rows stay usable meanwhile.
+        :param prop_descrs: dictionary of pairs (property URI, description)
+        """
+        new_descrs = {uri: descr for uri, descr in prop_descrs.items() if uri not in self._rows}
+        if not new_descrs:
+            return
+        if self._vectorizer is None:
+            # Nothing to rank with yet: the first fit is small and the question waits for it
+            with self._lock:
+                self._descrs.update(new_descrs)
+            self.refit()
+            return
+        import scipy.sparse as sp
+        with self._lock:
+            uris = [uri for uri in new_descrs.keys() if uri not in self._rows]
+            if not uris:
+                return
+            new_matrix = self._vectorizer.transform([new_descrs[uri] for uri in uris])
+            offset = self._matrix.shape[0]
+            self._matrix = sp.vstack([self._matrix, new_matrix], format='csr')
+            for i, uri in enumerate(uris):
+                self._rows[uri] = offset + i
+                self._descrs[uri] = new_descrs[uri]
+            self._n_added += len(uris)
+            start_refit = self._n_added > config.PROPERTY_INDEX_REFIT_EVERY and not self._refit_running
+            if start_refit:
+                self._refit_running = True
+        if start_refit:
+            threading.Thread(target=self._refit_and_save, name='property-index-refit', daemon=True).start()
+
+    def refit(self) -> None:
+        """
+        Fit the index again over all its descriptions, e.g. to take new terms into the vocabulary.
+        Rows added while the vectorizer is fitted are kept (transformed with the new vocabulary).
+        """
+        with self._lock:
+            prop_descrs = dict(self._descrs)
+        fitted = self._fit(prop_descrs)
+        if fitted is None:
+            return
+        vect, matrix = fitted
+        import scipy.sparse as sp
+        with self._lock:
+            added = {uri: descr for uri, descr in self._descrs.items() if uri not in prop_descrs}
+            if added:
+                matrix = sp.vstack([matrix, vect.transform(list(added.values()))], format='csr')
+                prop_descrs.update(added)
+            self._set(prop_descrs, vect, matrix)
+
+    def _refit_and_save(self) -> None:
+        try:
+            self.refit()
+            self.save()
+        finally:
+            with self._lock:
+                self._refit_running = False
+
+    def rank(self, property_uris: list, question_en: str, subject_tokens: list):
+        """
+        Cosine similarity between the question and the descriptions of the given properties.
+        :param property_uris: list of property URIs
+        :param question_en: question in english
+        :param subject_tokens: tokens of the subject, they are not taken into account
+        :return: numpy array of similarities in the order of <property_uris> (0 for properties not in the index)
+        """
+        import numpy as np
+        sims = np.zeros(len(property_uris))
+        if self._vectorizer is None:
+            return sims
+        q_tokens = [token for token in txt.QATokenizer('question')(question_en)
+                    if token not in subject_tokens]
+        with self._lock:
+            question_vect, matrix, rows = self._question_vectorizer, self._matrix, self._rows
+            positions = [i for i, uri in enumerate(property_uris) if uri in rows]
+            row_ids = [rows[property_uris[i]] for i in positions]
+        if positions:
+            q_vector = question_vect.transform([' '.join(q_tokens)])
+            # rows and the question vector are l2-normalized, so the dot product is the cosine similarity
+            sims[positions] = (matrix[row_ids] @ q_vector.T).toarray().ravel()
+        return sims
+
+    def save(self) -> None:
+        if self.path is None or self._vectorizer is None:
+            return
+        # The matrix is replaced rather than modified, so copies of the dicts make a consistent snapshot
+        # and rank() doesn't wait for the pickling
+        with self._lock:
+            state = {'descrs':     dict(self._descrs),
+                     'rows':       dict(self._rows),
+                     'vectorizer': self._vectorizer,
+                     'matrix':     self._matrix,
+                     'n_added':    self._n_added}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = '{0}.{1}.{2}.tmp'.format(self.path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> bool:
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as f:
+            state = pickle.load(f)
+        with self._lock:
+            self._descrs = state['descrs']
+            self._rows = state['rows']
+            self._vectorizer = state['vectorizer']
+            self._question_vectorizer = self._make_question_vectorizer(self._vectorizer)
+            self._matrix = state['matrix']
+            self._n_added = state['n_added']
+        return True
+
+
+_index_lock = threading.Lock()
+_index = None
+
+
+def get_property_index() -> PropertyIndex:
+    """
+    Index shared by the whole process. It is loaded from PROPERTY_INDEX_PATH,
+    or fitted over the cached property descriptions if there is no index file yet.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = PropertyIndex(config.PROPERTY_INDEX_PATH)
+                if not index.load():
+                    index.fit(kdb.get_knowledge_base()._cached_prop_descr)
+                    index.save()
+                _index = index
+    return _index
+
+
+if __name__ == '__main__':
+    descrs = kdb.get_knowledge_base()._cached_prop_descr
+    property_index = PropertyIndex(config.PROPERTY_INDEX_PATH)
+    property_index.fit(descrs)
+    property_index.save()
+    print('Property index with {0} descriptions saved to {1}'.format(len(property_index), config.PROPERTY_INDEX_PATH))
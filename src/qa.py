@@ -1,18 +1,23 @@
+import contextvars
+import sys
 from abc import abstractmethod
-from functools import lru_cache
-from importlib import reload
-from operator import itemgetter
-
-from microsofttranslator import Translator
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+import src.cache as cache
+import src.config as config
 import src.knowledge_base as kdb
+import src.metrics as metrics
+import src.nlp as nlp
+import src.property_index as pidx
+import src.resilience as resilience
 import src.text as txt
+import src.translation as tr
 import src.utils as utils
 
-for module in [kdb, txt, utils]:
-    reload(module)
+
+# background work of questions, e.g. the image query of DescribeQuestion
+_background = ThreadPoolExecutor(max_workers=config.SPARQL_MAX_WORKERS)
 
 
 class EntityNotFoundError(Exception):
@@ -32,11 +37,31 @@ class UnknownQuestionTypeError(Exception):
 
 
 class Property:
-    def __init__(self, uri, values, fl_get_descr=True):
-        self.uri = uri
+    # entities have hundreds of properties, so no per-instance __dict__
+    __slots__ = ('uri', 'values', 'fl_get_descr', '_descr')
+
+    def __init__(self, uri, values, fl_get_descr=True, descr=None):
+        # the same property URIs occur in every entity
+        self.uri = sys.intern(uri)
         self.values = values
         self.fl_get_descr = fl_get_descr
-        self.descr = kdb.DBPediaKnowledgeBase().get_property_descr(self.uri) if fl_get_descr else ''
+        # None until resolved: on first access or in bulk by Entity.get_prop_descrs
+        self._descr = descr if descr is not None or fl_get_descr else ''
+
+    @property
+    def descr(self):
+        if self._descr is None:
+            self._descr = kdb.get_knowledge_base().get_property_descr(self.uri)
+        return self._descr
+
+    @descr.setter
+    def descr(self, descr):
+        self._descr = descr
+
+    @property
+    def is_descr_loaded(self):
+        # False while reading descr would fetch it
+        return self._descr is not None
 
     def get_uri(self):
         return self.uri
@@ -66,42 +91,46 @@ class Entity:
     def get_properties(self):
         # fetch properties from knowledge base if they are empty
         if not self.properties:
-            for cls in self.classes:
-                prop_dict = kdb.DBPediaKnowledgeBase().get_entity_properties(self.uri, cls)
-                if prop_dict != {}:
-                    for key in prop_dict.keys():
-                        self.properties.append(Property(key, prop_dict[key], self.fl_prop_descr))
-                    # Take only first <cls> that gives result after SPARQL query
-                    break
+            # Take only first <cls> that gives result after SPARQL query
+            prop_dict = kdb.get_knowledge_base().get_first_entity_properties(self.uri, self.classes)
+            # Descriptions are resolved only when they are needed (see get_prop_descrs)
+            self.properties = [Property(key, values, self.fl_prop_descr) for key, values in prop_dict.items()]
         return self.properties
 
     def get_image_link(self):
-        for prop in self.get_properties():
-            if prop.get_uri() == 'http://dbpedia.org/ontology/thumbnail':
+        if not self.properties:
+            # One small query instead of fetching all properties
+            return kdb.get_knowledge_base().get_entity_image(self.uri)
+        for prop in self.properties:
+            if prop.get_uri() == kdb.THUMBNAIL:
                 return prop.get_values()[0]
         return None
 
     def get_prop_descrs(self):
-        return [prop.descr for prop in self.get_properties()]
+        properties = self.get_properties()
+        # Fetch all missing descriptions in bulk instead of one query per property
+        unresolved = [prop for prop in properties if not prop.is_descr_loaded]
+        if unresolved:
+            descrs = kdb.get_knowledge_base().get_property_descrs([prop.uri for prop in unresolved])
+            for prop in unresolved:
+                prop.descr = descrs.get(prop.uri, '')
+        return [prop.descr for prop in properties]
 
     def get_most_similar_prop(self, text_en, subject_tokens, tokens, print_top_n=5):
-        # not include <main_word> in BagOfWord dictionary
-        vect = TfidfVectorizer(ngram_range=(1, 3), sublinear_tf=True,
-                               tokenizer=txt.QATokenizer('property', debug_info=True),
-                               stop_words=subject_tokens)
+        properties = self.get_properties()
         prop_descrs = self.get_prop_descrs()
         if prop_descrs:
-            props_matrix = vect.fit_transform(prop_descrs)
-
-            # Change tokenizer to handle questions
-            vect.tokenizer = txt.QATokenizer('question', debug_info=True)
-            q_vector = vect.transform([text_en])
-            print('Bag of words vocabulary:', vect.get_feature_names())
-            sims = cosine_similarity(q_vector, props_matrix).flatten()
-            top_sims = sims.argsort()[:-print_top_n - 1:-1]
-            top_n_properties = itemgetter(*top_sims)(self.get_properties())
-            print('Top {0} properties by Bag of Words similarity:'.format(print_top_n),
-                  *zip(top_n_properties, sims[top_sims]), sep='\n')
+            with metrics.timed('tfidf_ranking'):
+                # Rank with the global TF-IDF index instead of fitting a vectorizer for every question
+                index = pidx.get_property_index()
+                index.add({prop.get_uri(): prop.get_descr() for prop in properties})
+                # not include <main_word> in BagOfWord dictionary
+                sims = index.rank([prop.get_uri() for prop in properties], text_en, subject_tokens)
+                top_sims = sims.argsort()[:-print_top_n - 1:-1]
+                top_n_properties = [properties[i] for i in top_sims]
+            if config.DEBUG:
+                print('Top {0} properties by Bag of Words similarity:'.format(print_top_n),
+                      *zip(top_n_properties, sims[top_sims]), sep='\n')
             # return Property and confidence level
             return top_n_properties[0], sims[top_sims][0]
 
@@ -121,38 +150,42 @@ class QuestionCategorizer:
         self.question_types = [DescribeQuestion, PropertyQuestion, WrongQuestion]
 
     def categorize(self):
-        scores = []
-        for qtype in self.question_types:
-            patterns = qtype.get_pattern()
-            score = self._score_pattern_matching(self.text_ru, patterns)
-            scores.append(score)
-        arg_i = utils.argmax(scores)
-        categorized_qtype = self.question_types[arg_i]
-        return categorized_qtype(self.text_ru)
-
-    def _score_pattern_matching(self, text_ru, patterns):
-        for pattern in patterns:
-            bool_result = self.pattern_matcher(text_ru, pattern)
-            if bool_result:
-                return True
-        return False
+        return self.get_type()(self.text_ru)
+
+    def get_type(self):
+        # Question types are checked in priority order, the first one that matches wins
+        with metrics.timed('categorize'):
+            for qtype in self.question_types:
+                if self.pattern_matcher.match(self.text_ru, qtype.compiled_patterns):
+                    return qtype
+            return WrongQuestion
 
 
 class Question:
     """
     Abstract base class for different Question types.
     """
-    translator = Translator('max-andr', '36OSL0SDYEtJCS1Z9kmDvbXkaOFeriDcB2ZvLSAA+q8=')
     msg_entity_not_found = 'Указанная сущность не была найдена в базе. Пожалуйста, перефразируйте вопрос!'
     msg_entity_not_recognized = 'Указанная сущность не была распознана в вопросе. Пожалуйста, перефразируйте вопрос!'
     msg_property_not_found = 'Указанное свойство сущности не было найдено. Пожалуйста, перефразируйте вопрос!'
     msg_unknown_type = 'Тип вопроса не распознан. Спросите о какой-нибудь сущности либо её свойстве.'
     msg_no_property_descriptions = 'Указанная сущность не имеет свойств. Пожалуйста, задайте вопрос о другой сущности.'
+    msg_service_unavailable = 'База знаний временно недоступна. Пожалуйста, повторите вопрос позже.'
+    msg_query_rejected = 'Не удалось получить данные об указанной сущности. Пожалуйста, задайте вопрос о другой сущности.'
+    msg_internal_error = 'Не удалось ответить на вопрос. Пожалуйста, повторите вопрос позже.'
 
-    def __init__(self, text_ru):
+    patterns = []
+    compiled_patterns = []
+
+    def __init__(self, text_ru, subject_ru=None):
         self.text_ru = text_ru
-        self.text_en = translate(self.translator, text_ru, 'en')
-        self.tokenizer = txt.QATokenizer('question', debug_info=True)
+        if subject_ru is None:
+            self.text_en = tr.translate(text_ru, 'en')
+        else:
+            # Question and its subject are translated in one call
+            self.subject_ru = subject_ru
+            self.text_en, self.subject_en = tr.translate_many([text_ru, subject_ru], 'en')
+        self.tokenizer = txt.QATokenizer('question', debug_info=config.DEBUG)
         self.tokens = self.tokenizer(self.text_en)
 
     def __str__(self):
@@ -181,16 +214,19 @@ class DescribeQuestion(Question):
     'Днепропетровск'
     """
 
+    patterns = ['NOUN', 'Кто такой NOUN', 'Что такое NOUN']
+    compiled_patterns = txt.compile_patterns(patterns)
+
     def __init__(self, text_ru):
-        super().__init__(text_ru)
-        self.subject_ru = self.find_subject(self.text_ru)
-        self.subject_en = translate(self.translator, self.subject_ru, 'en')
+        super().__init__(text_ru, self.find_subject(text_ru))
         uri, name, description, classes = self.search_subject(self.subject_en)
         self.main_entity = Entity(uri, name, description, classes, fl_prop_descr=False)
+        # The image is fetched while the description is translated (the query keeps the time budget)
+        self._image_link = _background.submit(contextvars.copy_context().run, self.main_entity.get_image_link)
 
     @staticmethod
     def get_pattern():
-        return ['NOUN', 'Кто такой NOUN', 'Что такое NOUN']
+        return DescribeQuestion.patterns
 
     def get_answer(self, lang='ru'):
         descr = self.main_entity.description
@@ -198,24 +234,28 @@ class DescribeQuestion(Question):
             if lang == 'en':
                 return descr
             else:
-                return translate(self.translator, descr, lang)
+                return tr.translate(descr, lang)
         else:
             raise EntityNotFoundError(self.msg_entity_not_found)
 
     def get_image(self):
-        image_link = self.main_entity.get_image_link()
+        try:
+            image_link = self._image_link.result()
+        except (resilience.ServiceUnavailableError, resilience.RequestRejectedError):
+            # The answer is still useful without the image
+            image_link = None
         return image_link if image_link else ''
 
     def search_subject(self, main_word):
-        result = kdb.DBPediaKnowledgeBase().search(main_word)
+        result = kdb.get_knowledge_base().search(main_word)
         if result:
             return result
         else:
             raise EntityNotFoundError(self.msg_entity_not_found)
 
     def find_subject(self, text_ru):
-        subject_finder = txt.SubjectFinder()
-        result = subject_finder(text_ru)
+        with metrics.timed('subject'):
+            result = txt.SubjectFinder()(text_ru)
         if result:
             return result
         else:
@@ -229,10 +269,11 @@ class PropertyQuestion(Question):
     'Где убили Джона Кеннеди?'
     """
 
+    patterns = ['* NOUN', ]
+    compiled_patterns = txt.compile_patterns(patterns)
+
     def __init__(self, text_ru):
-        super().__init__(text_ru)
-        self.subject_ru = self.find_subject(self.text_ru)
-        self.subject_en = translate(self.translator, self.subject_ru, 'en')
+        super().__init__(text_ru, self.find_subject(text_ru))
         self.subject_tokens = self.tokenizer(self.subject_en)
         uri, name, description, classes = self.search_subject(self.subject_en)
         self.main_entity = Entity(uri, name, description, classes)
@@ -244,26 +285,27 @@ class PropertyQuestion(Question):
 
     @staticmethod
     def get_pattern():
-        return ['* NOUN', ]
+        return PropertyQuestion.patterns
 
     def get_answer(self, lang='ru'):
         if self.answer_confidence > 0.0001:
-            answer_list = self.top_property.get_values()
-            final_answers = []
-            for answ in answer_list:
-                if utils.is_dbpedia_link(answ):
-                    final_answer = utils.extract_link_entity(answ)
-                else:
-                    final_answer = answ
-                # another blacklist (dbpedia can have anything unexpected)
-                if final_answer not in ('*',):
-                    final_answers.append(final_answer)
-            answer_str = ', '.join(final_answers)
+            with metrics.timed('answer_formatting'):
+                answer_list = self.top_property.get_values()
+                final_answers = []
+                for answ in answer_list:
+                    if utils.is_dbpedia_link(answ):
+                        final_answer = utils.extract_link_entity(answ)
+                    else:
+                        final_answer = answ
+                    # another blacklist (dbpedia can have anything unexpected)
+                    if final_answer not in ('*',):
+                        final_answers.append(final_answer)
+                answer_str = ', '.join(final_answers)
             # ru en version (how about message?)
             if lang == 'en':
                 return answer_str
             else:
-                return translate(self.translator, answer_str, lang)
+                return tr.translate(answer_str, lang)
         else:
             raise LowAnswerConfidenceError(self.msg_property_not_found)
 
@@ -272,15 +314,15 @@ class PropertyQuestion(Question):
         return image_link if image_link else ''
 
     def search_subject(self, main_word):
-        result = kdb.DBPediaKnowledgeBase().search(main_word)
+        result = kdb.get_knowledge_base().search(main_word)
         if result:
             return result
         else:
             raise EntityNotFoundError(self.msg_entity_not_found)
 
     def find_subject(self, text_ru):
-        subject_finder = txt.SubjectFinder()
-        result = subject_finder(text_ru)
+        with metrics.timed('subject'):
+            result = txt.SubjectFinder()(text_ru)
         if result:
             return result
         else:
@@ -292,39 +334,217 @@ class WrongQuestion(Question):
     Question with no pattern matches.
     """
 
+    # This pattern means: everything else goes as WrongQuestion
+    patterns = ['*']
+    compiled_patterns = txt.compile_patterns(patterns)
+
     def __init__(self, text_ru):
         super().__init__(text_ru)
 
     @staticmethod
     def get_pattern():
-        # This pattern means: everything else goes as WrongQuestion
-        return ['*']
+        return WrongQuestion.patterns
 
     def get_answer(self, lang):
         raise UnknownQuestionTypeError(self.msg_unknown_type)
 
 
-@lru_cache(maxsize=10000)
-def translate(translator, text, lang):
-    return translator.translate(text, lang)
+_in_flight = utils.SingleFlight()
+_answer_cache = cache.make_answer_cache(config.ANSWER_CACHE_BACKEND, config.ANSWER_CACHE_SIZE,
+                                        config.ANSWER_TTL, config.ANSWER_ERROR_TTL, config.ANSWER_CACHE_PATH)
 
 
-@utils.timeit
-@lru_cache(maxsize=10000)
+def normalize_question(q_text):
+    """
+    Normalize whitespace and the first letter (as QuestionCategorizer does),
+    so that trivially different spellings of a question share the answer.
+    """
+    q_text = ' '.join(q_text.split())
+    return q_text[:1].upper() + q_text[1:]
+
+
+@metrics.timed('ask')
 def ask(q_text, language='ru'):
+    q_text = normalize_question(q_text)
+    result = _answer_cache.get(q_text, language)
+    cache_status = 'hit' if result is not None else 'miss'
+    if result is None:
+        # Concurrent identical questions wait for the one that is already being answered
+        result = _in_flight.do((q_text, language), lambda: _answer_and_cache(q_text, language),
+                               config.COALESCE_TIMEOUT)
+    metrics.inc('deepanswer_questions_total', cache=cache_status, result='error' if 'error' in result else 'answer')
+    return result
+
+
+def _answer_and_cache(q_text, language):
+    result, entity_uri = _answer(q_text, language)
+    _answer_cache.set(q_text, language, result, entity_uri)
+    return result
+
+
+def _answer(q_text, language):
+    """
+    :return: tuple (answer dict, URI of the entity the question is about or None)
+    """
+    question = None
     try:
-        question = QuestionCategorizer(q_text).categorize()
-        print(question)
-        answer = question.get_answer(language)
-        image = question.get_image()
-        print('Answer: ' + answer, 'Image: ' + image, sep='\n')
-        return {'answer': answer, 'image': image}
+        # All calls to DBpedia and the translator share the time budget of the question
+        with resilience.time_budget(config.QUESTION_TIME_BUDGET):
+            question = QuestionCategorizer(q_text).categorize()
+            answer = question.get_answer(language)
+            image = question.get_image()
+        if config.DEBUG:
+            print(question, 'Answer: ' + answer, 'Image: ' + image, sep='\n')
+        return {'answer': answer, 'image': image}, question.main_entity.uri
     except (EntityNotFoundError, LowAnswerConfidenceError,
             UnknownQuestionTypeError, EmptyPropertyDescriptionsError) as e:
         answer = e.args[0]
         error = e.args[0]
         image = ''
-        return {'answer': answer, 'image': image, 'error': error}
+        entity = getattr(question, 'main_entity', None)
+        return {'answer': answer, 'image': image, 'error': error}, entity.uri if entity else None
+    except resilience.ServiceUnavailableError as e:
+        print('Service unavailable: {0}'.format(e))
+        # Cached with the short lifetime of errors
+        error = Question.msg_service_unavailable
+        return {'answer': error, 'image': '', 'error': error}, None
+    except resilience.RequestRejectedError as e:
+        print('Request rejected: {0}'.format(e))
+        error = Question.msg_query_rejected
+        entity = getattr(question, 'main_entity', None)
+        return {'answer': error, 'image': '', 'error': error}, entity.uri if entity else None
+
+
+def invalidate_entity(entity_uri):
+    """
+    Forget cached answers and properties of the entity, e.g. after its DBpedia page was updated.
+    """
+    _answer_cache.invalidate_entity(entity_uri)
+    kdb.get_knowledge_base().invalidate_entity(entity_uri)
+
+
+def answer_cache_stats():
+    return _answer_cache.stats()
+
+
+def _collect_cache_metrics():
+    caches = dict(kdb.get_knowledge_base().cache_stats(), answers=answer_cache_stats(),
+                  translations=tr.get_cached_translator().stats(), morphology=nlp.morph_stats())
+    gauges = []
+    for name, stats in caches.items():
+        for stat in ('hits', 'misses', 'size', 'hit_rate'):
+            gauges.append(('deepanswer_cache_' + stat, {'cache': name}, stats[stat]))
+    for service, state in resilience.breaker_states().items():
+        gauges.append(('deepanswer_circuit_open', {'service': service}, int(state != 'closed')))
+    return gauges
+
+
+metrics.register_collector(_collect_cache_metrics)
+
+
+def _find_subject(q_text):
+    """
+    :return: subject of the question in russian, None for questions of unknown type or if it isn't found
+    """
+    categorizer = QuestionCategorizer(q_text)
+    if categorizer.get_type() is WrongQuestion:
+        return None
+    return txt.SubjectFinder()(categorizer.text_ru)
+
+
+def ask_many(q_texts, language='ru'):
+    """
+    Answer a batch of questions.
+    Identical questions (after normalize_question()) are answered once. Questions, subjects and answers
+    are translated in batches. Questions about the same entity are answered one after another, so the
+    entity's properties and descriptions are fetched once, while different entities are handled concurrently.
+    A question that fails gets an error result, the other questions are answered anyway.
+    :param q_texts: list of questions
+    :param language: language of the answers
+    :return: list of answers in the order of <q_texts>
+    """
+    normalized = [normalize_question(q_text) for q_text in q_texts]
+    unique_q_texts = utils.unique_values(normalized)
+
+    # Prefetch: translate all questions and subjects in one batch and resolve the subjects.
+    # The prefetch is only an optimization: every question is answered (or fails) on its own.
+    subjects_ru = {}
+    for q_text in unique_q_texts:
+        try:
+            subjects_ru[q_text] = _find_subject(q_text)
+        except Exception as e:
+            print('Subject of <{0}> not prefetched: {1!r}'.format(q_text, e))
+    # Normalized questions are the texts QuestionCategorizer passes to the questions
+    texts_ru = utils.unique_values(unique_q_texts + [subject_ru for subject_ru in subjects_ru.values() if subject_ru])
+    try:
+        with resilience.time_budget(config.QUESTION_TIME_BUDGET):
+            translations = dict(zip(texts_ru, tr.translate_many(texts_ru, 'en')))
+    except (resilience.ServiceUnavailableError, resilience.RequestRejectedError):
+        translations = {}
+
+    def resolve(subject_en):
+        # Every lookup has a budget of its own, as if it was made by its question
+        try:
+            with resilience.time_budget(config.QUESTION_TIME_BUDGET):
+                entity = kdb.get_knowledge_base().search(subject_en)
+        except (resilience.ServiceUnavailableError, resilience.RequestRejectedError):
+            return None
+        return entity[0] if entity else None
+
+    subjects_en = utils.unique_values(translations[subject_ru] for subject_ru in subjects_ru.values()
+                                      if subject_ru in translations)
+    with ThreadPoolExecutor(max_workers=config.ASK_MANY_WORKERS) as executor:
+        entity_uris = dict(zip(subjects_en, executor.map(resolve, subjects_en)))
+    # Questions with an unresolved subject make groups of their own
+    groups = OrderedDict()
+    for q_text in unique_q_texts:
+        entity_uri = entity_uris.get(translations.get(subjects_ru.get(q_text)))
+        groups.setdefault(entity_uri or q_text, []).append(q_text)
+
+    def answer(q_text):
+        try:
+            return ask(q_text, 'en')
+        except Exception as e:
+            print('Question <{0}> failed: {1!r}'.format(q_text, e))
+            error = Question.msg_internal_error
+            return {'answer': error, 'image': '', 'error': error}
+
+    # Answers in english, then translated together
+    with ThreadPoolExecutor(max_workers=config.ASK_MANY_WORKERS) as executor:
+        answers_by_group = executor.map(lambda group: [answer(q_text) for q_text in group], groups.values())
+        answers = {}
+        for group, group_answers in zip(groups.values(), answers_by_group):
+            answers.update(zip(group, group_answers))
+    if language != 'en':
+        answered = [q_text for q_text in unique_q_texts if 'error' not in answers[q_text]]
+        try:
+            with resilience.time_budget(config.QUESTION_TIME_BUDGET):
+                translated = tr.translate_many([answers[q_text]['answer'] for q_text in answered], language)
+        except resilience.ServiceUnavailableError:
+            translated = None
+            error = Question.msg_service_unavailable
+        except resilience.RequestRejectedError:
+            translated = None
+            error = Question.msg_internal_error
+        if translated is None:
+            for q_text in answered:
+                answers[q_text] = dict(answers[q_text], answer=error, error=error)
+        else:
+            for q_text, translated_answer in zip(answered, translated):
+                answers[q_text] = dict(answers[q_text], answer=translated_answer)
+    return [answers[q_text] for q_text in normalized]
+
+
+def warm_up():
+    """
+    Init hook for servers: load everything the first question would otherwise wait for
+    (NLP models, translator, property descriptions and the TF-IDF index).
+    """
+    nlp.load_models()
+    tr.get_translator()
+    # The first refresh loads all descriptions, the next ones run periodically (see PROPERTY_DESCR_REFRESH_INTERVAL)
+    kdb.get_knowledge_base().refresh_property_descr()
+    pidx.get_property_index()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,183 @@
+"""
+Time budgets, retries and circuit breakers for the calls to external services (DBpedia, translator).
+A question runs inside time_budget(): every stage takes its timeout from the remaining budget, retries back off
+exponentially with jitter without outliving the budget, and a circuit breaker per service fails fast
+while the service is down.
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import src.config as config
+
+
+class ServiceUnavailableError(Exception):
+    pass
+
+
+class DeadlineExceededError(ServiceUnavailableError):
+    pass
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    pass
+
+
+class RequestRejectedError(Exception):
+    """
+    The service answered that the request itself is wrong (HTTP 4xx): it is neither retried
+    nor counted as a failure of the service.
+    """
+    pass
+
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+@contextmanager
+def time_budget(seconds):
+    """
+    Run the block with a budget of <seconds> (a nested budget can only shrink the outer one).
+    Thread pools don't inherit it, submit the work with contextvars.copy_context().run.
+    """
+    deadline = time.monotonic() + seconds
+    outer_deadline = _deadline.get()
+    if outer_deadline is not None:
+        deadline = min(deadline, outer_deadline)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    :return: seconds left in the current budget or None if there is no budget
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def get_timeout(default: float) -> float:
+    """
+    Timeout for the next call: <default> limited by the remaining budget.
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceededError('Time budget of the question is spent.')
+    return min(default, left)
+
+
+class CircuitBreaker:
+    """
+    Opens after <failure_threshold> failures in a row and then rejects calls for <reset_timeout> seconds.
+    After that one trial call is let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self) -> None:
+        with self._lock:
+            state = self.state
+            if state == 'open' or state == 'half-open' and self._trial_running:
+                raise CircuitOpenError('{0} is unavailable, circuit is open.'.format(self.name))
+            if state == 'half-open':
+                self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+_breakers_lock = threading.Lock()
+_breakers = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    Circuit breaker shared by all clients of the service <name>.
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, config.BREAKER_FAILURE_THRESHOLD, config.BREAKER_RESET_TIMEOUT)
+        return _breakers[name]
+
+
+def breaker_states() -> dict:
+    with _breakers_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+def check_response(response) -> None:
+    """
+    Raise RequestRejectedError for a 4xx response (except 408 and 429, which are worth a retry)
+    and requests.HTTPError for the other error responses, e.g. 5xx.
+    """
+    import requests
+    try:
+        response.raise_for_status()
+    except requests.HTTPError as e:
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+            raise RequestRejectedError(str(e)) from e
+        raise
+
+
+def call(name: str, function, default_timeout: float, retry_on: tuple):
+    """
+    Call an external service with the circuit breaker of <name> and retries with exponential backoff and jitter.
+    :param name: name of the service, e.g. 'sparql'
+    :param function: function of the timeout (in seconds) that makes the call
+    :param default_timeout: timeout of one call if the budget allows it
+    :param retry_on: exceptions that are considered transient, e.g. connection errors, timeouts and 5xx responses
+    :return: result of the function
+    """
+    breaker = get_breaker(name)
+    for attempt in range(config.RETRY_MAX_ATTEMPTS):
+        timeout = get_timeout(default_timeout)
+        breaker.before_call()
+        try:
+            result = function(timeout)
+        except retry_on as e:
+            breaker.record_failure()
+            delay = random.uniform(0, min(config.RETRY_MAX_DELAY, config.RETRY_BASE_DELAY * 2 ** attempt))
+            left = remaining()
+            if attempt + 1 == config.RETRY_MAX_ATTEMPTS or left is not None and left <= delay:
+                raise ServiceUnavailableError('{0} is unavailable: {1}'.format(name, e)) from e
+            print('Retry {0} call in {1:.2f} sec due to error: {2}'.format(name, delay, e))
+            time.sleep(delay)
+        except Exception:
+            # The service did answer, the error is not about its availability
+            breaker.record_success()
+            raise
+        else:
+            breaker.record_success()
+            return result
@@ -1,19 +1,16 @@
 import re
+from functools import lru_cache
 
-import nltk
-import pymorphy2
-from nltk.corpus import wordnet
-from nltk.stem.wordnet import WordNetLemmatizer
-from nltk.tag.perceptron import PerceptronTagger
-
+import src.nlp as nlp
 import src.utils as utils
 
 
 def get_wordnet_pos(tag):
-    for letter, pos in {'J': wordnet.ADJ,
-                        'V': wordnet.VERB,
-                        'N': wordnet.NOUN,
-                        'R': wordnet.ADV}.items():
+    # wordnet.ADJ, wordnet.VERB, wordnet.NOUN, wordnet.ADV (without importing NLTK)
+    for letter, pos in {'J': 'a',
+                        'V': 'v',
+                        'N': 'n',
+                        'R': 'r'}.items():
         if tag.startswith(letter):
             return pos
     return None
@@ -24,9 +21,6 @@ class QATokenizer:
         if debug_info:
             print('Tokenizer for <{0}> init...'.format(doc_type))
         self.debug_info = debug_info
-        self.lemmatizer = WordNetLemmatizer()
-        wordnet.ensure_loaded()
-        self.tagger = PerceptronTagger()
         # Different options for different texts
         if doc_type == 'question':
             # Easy way to cover more questions
@@ -57,6 +51,15 @@ class QATokenizer:
             raise ValueError('Other types for tokenization are not supported')
         self.step = 0
 
+    # Models are shared by all tokenizers (and not pickled with them), so creating a tokenizer is cheap
+    @property
+    def lemmatizer(self):
+        return nlp.get_lemmatizer()
+
+    @property
+    def tagger(self):
+        return nlp.get_tagger()
+
     def __call__(self, doc):
         def substitute(input_word):
             if input_word in self.substitutions:
@@ -94,7 +97,7 @@ class QATokenizer:
             :return: list of normalized word forms
             """
             tokens_new = []
-            for word, tag in nltk.tag._pos_tag(tokens, None, self.tagger):
+            for word, tag in nlp.pos_tag(tokens):
                 wn_tag = get_wordnet_pos(tag)
                 if wn_tag:
                     normalized_word = self.lemmatizer.lemmatize(word, wn_tag)
@@ -119,7 +122,7 @@ class QATokenizer:
                         tokens_new.append(s)
             return utils.unique_values(tokens_new)
 
-        tokens = nltk.word_tokenize(doc.lower())
+        tokens = nlp.word_tokenize(doc.lower())
         tokens = handle_substitution(tokens)
         tokens = handle_punctuation(tokens)
         tokens = handle_normalization(tokens)
@@ -131,50 +134,86 @@ class QATokenizer:
         return tokens
 
 
-class PatternMatcher:
-    morph = pymorphy2.MorphAnalyzer()
+class QuestionPattern:
+    """
+    Question pattern, e.g. 'Кто такой NOUN', compiled into a regex.
+    Patterns with NOUN or VERB are matched against the POS form of the question.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.fl_pos = 'NOUN' in pattern or 'VERB' in pattern
+        regex_replaces = ('*', '(.*)'),
+        # regex_pattern = r'^Кто такой (.*)$'
+        self.regex = re.compile(utils.multi_replace(pattern, regex_replaces) + '$')
+
+    def __repr__(self):
+        return 'QuestionPattern: ' + self.pattern
+
 
+@lru_cache(maxsize=None)
+def compile_pattern(pattern: str) -> QuestionPattern:
+    return QuestionPattern(pattern)
+
+
+def compile_patterns(patterns: list) -> list:
+    return [compile_pattern(pattern) for pattern in patterns]
+
+
+class PatternMatcher:
     def __init__(self):
-        pass
+        # question -> its POS form, computed once per question for all patterns
+        self._pos_forms = {}
 
     def transform_question(self, question, pattern):
-        replaces = ('?', ''), ('!', '')
         if 'NOUN' in pattern or 'VERB' in pattern:
-            pos_text_list = []
-            tokens = nltk.word_tokenize(utils.multi_replace(question, replaces))
-            for i, token in enumerate(tokens):
-                # If the letter is capital and this is not the first token, then consider it as NOUN
-                if token[0].isupper() and i != 0:
-                    pos = 'NOUN'
+            return self.pos_form(question)
+        return question
+
+    def pos_form(self, question):
+        if question in self._pos_forms:
+            return self._pos_forms[question]
+        replaces = ('?', ''), ('!', '')
+        pos_text_list = []
+        tokens = nlp.word_tokenize(utils.multi_replace(question, replaces))
+        for i, token in enumerate(tokens):
+            # If the letter is capital and this is not the first token, then consider it as NOUN
+            if token[0].isupper() and i != 0:
+                pos = 'NOUN'
+            else:
+                pos = str(nlp.analyze(token)[0])
+            if pos in ('NOUN', 'VERB'):
+                if not pos_text_list:
+                    pos_text_list.append(pos)
                 else:
-                    pos = str(self.morph.tag(token)[0].POS)
-                if pos in ('NOUN', 'VERB'):
-                    if not pos_text_list:
+                    # 1 POS instead of 2 POS going one after another
+                    if pos_text_list[-1] != pos:
                         pos_text_list.append(pos)
-                    else:
-                        # 1 POS instead of 2 POS going one after another
-                        if pos_text_list[-1] != pos:
-                            pos_text_list.append(pos)
-                else:
-                    pos_text_list.append(token)
-            pos_text = ' '.join(pos_text_list)
-            return pos_text
-        return question
+            else:
+                pos_text_list.append(token)
+        pos_text = ' '.join(pos_text_list)
+        self._pos_forms[question] = pos_text
+        return pos_text
 
-    def __call__(self, question, pattern):
+    def match(self, question, patterns):
+        """
+        Check if the question matches any of the compiled patterns.
+        :param question: question text
+        :param patterns: list of QuestionPattern
+        :return: boolean
+        """
         question = question.strip()
-        regex_replaces = ('*', '(.*)'),
-        # regex_pattern = r'^Кто такой (.*)$'
-        regex_pattern = utils.multi_replace(pattern, regex_replaces) + '$'
-        question_form = self.transform_question(question, pattern)
-        regex_result = re.match(regex_pattern, question_form)
-        # print(question, pattern, regex_result, regex_result, sep=' | ')
-        return bool(regex_result)
+        for pattern in patterns:
+            question_form = self.pos_form(question) if pattern.fl_pos else question
+            if pattern.regex.match(question_form):
+                return True
+        return False
+
+    def __call__(self, question, pattern):
+        return self.match(question, [compile_pattern(pattern)])
 
 
 class SubjectFinder:
-    morph = pymorphy2.MorphAnalyzer()
-
     def __init__(self):
         pass
 
@@ -183,12 +222,10 @@ class SubjectFinder:
         simple heuristic
         """
         words_list, pos_list, token_list = [], [], []
-        for token in nltk.word_tokenize(question):
-            # pos = self.morph.tag(token)[0].POS
-            parsed_word = self.morph.parse(token)[0]
-            pos = parsed_word.tag.POS
+        for token in nlp.word_tokenize(question):
+            pos, normal_form = nlp.analyze(token)
             if pos is not None:
-                words_list.append(parsed_word.normal_form)
+                words_list.append(normal_form)
                 pos_list.append(pos)
                 token_list.append(token)
         # 2 nouns together in the end and the first begins from big letter
@@ -197,7 +234,7 @@ class SubjectFinder:
                 or token_list[-2][0].isupper() and token_list[-1][0].isupper()):
                 subject = ' '.join(words_list[-2:])
                 return subject
-        if pos_list[-1] == 'NOUN':
+        if pos_list and pos_list[-1] == 'NOUN':
             subject = words_list[-1]
             return subject
 
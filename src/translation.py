@@ -0,0 +1,130 @@
+"""
+Translation layer over the Microsoft translator.
+Several texts are sent in one translator call and every (text, target language) pair is cached,
+in memory and in a sqlite file shared by all workers, so repeated subjects and answers are translated once.
+"""
+import threading
+from concurrent import futures
+from functools import lru_cache
+
+import src.cache as cache
+import src.config as config
+import src.metrics as metrics
+import src.resilience as resilience
+import src.utils as utils
+
+# worker threads of the translator calls
+_executor = futures.ThreadPoolExecutor(max_workers=config.TRANSLATION_MAX_WORKERS)
+
+
+@lru_cache(maxsize=1)
+def get_translator():
+    from microsofttranslator import Translator
+    return Translator('max-andr', '36OSL0SDYEtJCS1Z9kmDvbXkaOFeriDcB2ZvLSAA+q8=')
+
+
+class CachedTranslator:
+    def __init__(self, translator_factory=get_translator, translation_cache=None):
+        """
+        :param translator_factory: function that returns the translator client
+        :param translation_cache: cache of (text, lang) -> translation
+        """
+        self._translator_factory = translator_factory
+        self._cache = translation_cache if translation_cache is not None else cache.make_cache(
+            'translations', config.TRANSLATION_CACHE_SIZE, path=config.TRANSLATION_CACHE_PATH or None,
+            disk_maxsize=config.TRANSLATION_DISK_CACHE_SIZE)
+        # number of translator calls and of texts sent in them
+        self.n_calls = 0
+        self.n_texts = 0
+
+    def translate(self, text: str, lang: str) -> str:
+        return self.translate_many([text], lang)[0]
+
+    @metrics.timed('translate')
+    def translate_many(self, texts: list, lang: str) -> list:
+        """
+        Translate all texts, the ones that are not cached are sent in as few translator calls as the limits allow.
+        :param texts: list of strings
+        :param lang: target language
+        :return: list of translations in the order of <texts>
+        """
+        translations = {}
+        missing = []
+        for text in utils.unique_values(texts):
+            translation = self._cache.get((text, lang))
+            if translation is None:
+                missing.append(text)
+            else:
+                translations[text] = translation
+        for chunk in self._chunks(missing):
+            for text, translation in zip(chunk, self._call(chunk, lang)):
+                self._cache.set((text, lang), translation)
+                translations[text] = translation
+        return [translations[text] for text in texts]
+
+    @staticmethod
+    def _chunks(texts: list):
+        """
+        Split texts into translator calls of at most TRANSLATION_MAX_TEXTS texts and TRANSLATION_MAX_CHARS
+        characters (a longer text is sent alone).
+        :return: generator of lists of texts
+        """
+        chunk, n_chars = [], 0
+        for text in texts:
+            if chunk and (len(chunk) == config.TRANSLATION_MAX_TEXTS or
+                          n_chars + len(text) > config.TRANSLATION_MAX_CHARS):
+                yield chunk
+                chunk, n_chars = [], 0
+            chunk.append(text)
+            n_chars += len(text)
+        if chunk:
+            yield chunk
+
+    def _call(self, texts: list, lang: str) -> list:
+        import requests
+        translator = self._translator_factory()
+        self.n_calls += 1
+        self.n_texts += len(texts)
+
+        def translate_texts():
+            if len(texts) == 1:
+                return [translator.translate(texts[0], lang)]
+            return [result['TranslatedText'] for result in translator.translate_array(texts, lang)]
+
+        # The translator client has no timeout parameter: the call runs in a worker thread and is abandoned
+        # when the timeout expires (a hung call keeps its worker, so at most TRANSLATION_MAX_WORKERS can hang)
+        def call_translator(timeout):
+            future = _executor.submit(translate_texts)
+            try:
+                return future.result(timeout)
+            except futures.TimeoutError:
+                # a call still waiting for a worker doesn't need to run at all
+                future.cancel()
+                raise
+
+        return resilience.call('translator', call_translator, config.TRANSLATOR_TIMEOUT,
+                               (requests.RequestException, ValueError, futures.TimeoutError))
+
+    def stats(self) -> dict:
+        return dict(self._cache.stats(), translator_calls=self.n_calls, translated_texts=self.n_texts)
+
+
+_translator_lock = threading.Lock()
+_translator = None
+
+
+def get_cached_translator() -> CachedTranslator:
+    global _translator
+    if _translator is None:
+        with _translator_lock:
+            if _translator is None:
+                _translator = CachedTranslator()
+    return _translator
+
+
+def translate(text: str, lang: str) -> str:
+    return get_cached_translator().translate(text, lang)
+
+
+def translate_many(texts: list, lang: str) -> list:
+    return get_cached_translator().translate_many(texts, lang)
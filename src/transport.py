@@ -0,0 +1,47 @@
+"""
+HTTP layer shared by all clients of the process.
+Each endpoint gets one requests.Session with a keep-alive connection pool, so TCP connections
+are reused between questions instead of being opened for every call.
+Sessions (and the requests package) are created on first use.
+"""
+import threading
+
+import src.config as config
+
+_lock = threading.Lock()
+_sessions = {}
+
+
+def _make_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=config.HTTP_POOL_SIZE, pool_maxsize=config.HTTP_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip, deflate' if config.HTTP_GZIP else 'identity'
+    return session
+
+
+def get_session(name: str):
+    """
+    Get the session of the given endpoint, e.g. 'sparql' or 'lookup'.
+    Sessions are created once and can be used from many threads.
+    :param name: name of the endpoint
+    :return: requests.Session
+    """
+    session = _sessions.get(name)
+    if session is None:
+        with _lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = _make_session()
+                _sessions[name] = session
+    return session
+
+
+def close_sessions() -> None:
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
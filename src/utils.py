@@ -1,17 +1,6 @@
 from functools import reduce
 from urllib.parse import urlparse
-import time
-
-
-def timeit(method):
-    def timed(*args, **kw):
-        ts = time.time()
-        result = method(*args, **kw)
-        te = time.time()
-        print('Time: %2.2f sec, function: %r, args: (%r, %r).' % (te - ts, method.__name__, args, kw))
-        return result
-
-    return timed
+import threading
 
 
 def is_link(string):
@@ -45,3 +34,50 @@ def argmax(values: list) -> int:
 
 def multi_replace(string: str, replace_tuples: tuple) -> str:
     return reduce(lambda a, kv: a.replace(*kv), replace_tuples, string)
+
+
+class SingleFlight:
+    """
+    Coalescing of concurrent calls with the same key: the first caller computes the result and the callers
+    that arrive while it is running wait for it. Nothing is kept after the call is finished,
+    so errors are passed to the waiters but not cached.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, timeout=None):
+        """
+        :param key: hashable key of the call
+        :param function: function without arguments that computes the result
+        :param timeout: max seconds to wait for the running call, after that the caller computes on its own
+        :return: result of the function
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = self._Call()
+        if is_leader:
+            try:
+                call.result = function()
+                return call.result
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        if not call.done.wait(timeout):
+            return function()
+        if call.error is not None:
+            raise call.error
+        return call.result
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import time
+import unittest
+from src.cache import *
+
+
+class MemoryCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TTLCache(maxsize=2, ttl=60)
+
+    def test_get_set(self):
+        self.cache.set('http://dbpedia.org/resource/Pavlohrad', {'p': ['v']})
+        given = self.cache.get('http://dbpedia.org/resource/Pavlohrad')
+        expected = {'p': ['v']}
+        self.assertEqual(given, expected)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_expiration(self):
+        self.cache.set('a', 1, ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_stats(self):
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.cache.get('b')
+        given = self.cache.stats()
+        expected = {'hits': 1, 'misses': 1, 'size': 1, 'hit_rate': 0.5}
+        self.assertEqual(given, expected)
+
+
+class DiskCache(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'cache.sqlite')
+
+    def test_shared_between_instances(self):
+        SqliteCache(self.path, 'entities').set(('Lincoln', '', 'Keyword', 1), ['uri'])
+        given = SqliteCache(self.path, 'entities').get(('Lincoln', '', 'Keyword', 1))
+        expected = ['uri']
+        self.assertEqual(given, expected)
+
+    def test_lru_eviction(self):
+        cache = SqliteCache(self.path, maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('a'))
+
+    def test_full_cache_not_evicted_on_every_set(self):
+        cache = SqliteCache(self.path, maxsize=20)
+        evict = cache._evict
+        n_evictions = []
+
+        def count_evictions(conn, now):
+            n_evictions.append(now)
+            evict(conn, now)
+
+        cache._evict = count_evictions
+        for i in range(60):
+            cache.set(i, i)
+        self.assertLessEqual(len(cache), 20)
+        self.assertEqual(cache.get(59), 59)
+        self.assertIsNone(cache.get(0))
+        self.assertLess(len(n_evictions), 20)
+
+    def test_expired_entries_evicted(self):
+        cache = SqliteCache(self.path, evict_every=1)
+        cache.set('a', 1, ttl=0.01)
+        time.sleep(0.02)
+        cache.set('b', 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_access_time_throttled(self):
+        cache = SqliteCache(self.path, maxsize=2, access_resolution=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        # 'a' was accessed right after it was set, so it is still the least recently used
+        self.assertIsNone(cache.get('a'))
+
+    def test_promotion_keeps_ttl(self):
+        cache = make_cache('entities', maxsize=10, ttl=60, path=self.path)
+        cache.disk.set('a', 1, ttl=0.05)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('a'))
+
+
+class Answers(unittest.TestCase):
+    def check_backend(self, backend):
+        path = os.path.join(tempfile.mkdtemp(), 'answers.sqlite')
+        answers = make_answer_cache(backend, 10, answer_ttl=60, error_ttl=0.01, path=path)
+        answers.set('Где родился Ленин?', 'en', {'answer': 'Russian Empire, Ulyanovsk', 'image': ''},
+                    'http://dbpedia.org/resource/Vladimir_Lenin')
+        answers.set('Кто мэр Павлограда?', 'en', {'answer': 'not found', 'image': '', 'error': 'not found'})
+        time.sleep(0.02)
+        self.assertIsNone(answers.get('Кто мэр Павлограда?', 'en'))
+        self.assertEqual(answers.get('Где родился Ленин?', 'en')['answer'], 'Russian Empire, Ulyanovsk')
+        answers.invalidate_entity('http://dbpedia.org/resource/Vladimir_Lenin')
+        self.assertIsNone(answers.get('Где родился Ленин?', 'en'))
+
+    def test_memory(self):
+        self.check_backend('memory')
+
+    def test_sqlite(self):
+        self.check_backend('sqlite')
+
+
+if __name__ == '__main__':
+    unittest.main()
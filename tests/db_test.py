@@ -47,6 +47,175 @@ class MetaInfo(unittest.TestCase):
         lower_boundary = 10
         self.assertGreater(count_properties, lower_boundary)
 
+class WriteBehind(unittest.TestCase):
+    class FakeClient:
+        def __init__(self):
+            self.calls = []
+
+        def batch_put_attributes(self, DomainName, Items):
+            self.calls.append((DomainName, Items))
+
+    def setUp(self):
+        self.db = type('FakeDB', (), {'_client': self.FakeClient()})()
+        self.writer = WriteBehindQueue(self.db, flush_size=25, flush_interval=60)
+
+    def test_batches_of_25(self):
+        for i in range(60):
+            self.writer.put('properties', 'http://dbpedia.org/property/p{0}'.format(i), [])
+        self.writer.close()
+        given = [len(items) for domain, items in self.db._client.calls]
+        expected = [25, 25, 10]
+        self.assertEqual(sorted(given, reverse=True), expected)
+
+    def test_batches_limited_by_sdb(self):
+        writer = WriteBehindQueue(self.db, flush_size=100, flush_interval=60)
+        for i in range(60):
+            writer.put('properties', 'http://dbpedia.org/property/p{0}'.format(i), [])
+        writer.flush()
+        given = [len(items) for domain, items in self.db._client.calls]
+        expected = [25, 25, 10]
+        self.assertEqual(given, expected)
+
+    def test_no_sleep_after_last_attempt(self):
+        class FailingClient:
+            def batch_put_attributes(self, DomainName, Items):
+                raise botocore.exceptions.EndpointConnectionError(endpoint_url='https://sdb.amazonaws.com')
+
+        db = type('FakeDB', (), {'_client': FailingClient()})()
+        writer = WriteBehindQueue(db, max_retries=1, backoff=60)
+        writer.put('questions', 'q', [])
+        start = time.monotonic()
+        writer.flush()
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_same_item_coalesced(self):
+        self.writer.put('questions', 'q', [{'Name': 'is_correct', 'Value': 'false', 'Replace': True}])
+        self.writer.put('questions', 'q', [{'Name': 'is_correct', 'Value': 'true', 'Replace': True}])
+        self.writer.flush()
+        given = self.db._client.calls
+        expected = [('questions', [{'Name': 'q', 'Attributes': [{'Name': 'is_correct', 'Value': 'true',
+                                                                  'Replace': True}]}])]
+        self.assertEqual(given, expected)
+
+class PropertyDescrPages(unittest.TestCase):
+    class FakeClient:
+        def __init__(self):
+            self.queries = []
+
+        def select(self, SelectExpression, NextToken=None):
+            self.queries.append(SelectExpression)
+            item = {'Name': 'p', 'Attributes': [{'Name': 'uri', 'Value': quote_plus('http://dbpedia.org/p/' + str(NextToken))},
+                                                {'Name': 'description', 'Value': 'postal+code'}]}
+            return {'Items': [item], 'NextToken': 1} if NextToken is None else {'Items': [item]}
+
+    def setUp(self):
+        self.db = DB.__new__(DB)
+        self.db._client = self.FakeClient()
+
+    def test_follow_next_token(self):
+        given = self.db.get_all_property_descr()
+        expected = {'http://dbpedia.org/p/None': 'postal code', 'http://dbpedia.org/p/1': 'postal code'}
+        self.assertEqual(given, expected)
+
+    def test_since(self):
+        list(self.db.iter_property_descr_pages(since='2017-05-01 12:00:00'))
+        container = self.db._client.queries[0]
+        member = "time_add > '2017-05-01 12:00:00'"
+        self.assertIn(member, container)
+
+class FeedbackStats(unittest.TestCase):
+    class FakeClient:
+        def select(self, SelectExpression, ConsistentRead, NextToken=None):
+            rows = [('q1', 'ru', 'true', '2017-05-01 12:00:00.000001'),
+                    ('q2', 'en', 'false', '2017-05-02 12:00:00.000001')]
+            name, language, is_correct, time_add = rows[0] if NextToken is None else rows[1]
+            item = {'Name': name, 'Attributes': [{'Name': 'language', 'Value': language},
+                                                {'Name': 'is_correct', 'Value': is_correct},
+                                                {'Name': 'time_add', 'Value': time_add}]}
+            return {'Items': [item], 'NextToken': 1} if NextToken is None else {'Items': [item]}
+
+        def put_attributes(self, **kwargs):
+            pass
+
+    def setUp(self):
+        self.db = DB()
+        self.db._client = self.FakeClient()
+
+    def test_reconcile_all_pages(self):
+        given = self.db.get_qa_quality()
+        expected = {'avg_score': 0.5, 'count_answers': 2,
+                    'by_language': {'ru': {'avg_score': 1.0, 'count_answers': 1},
+                                    'en': {'avg_score': 0.0, 'count_answers': 1}}}
+        self.assertEqual(given, expected)
+
+    def test_put_qa_updates_aggregate(self):
+        self.db.reconcile_qa_stats()
+        self.db.put_qa('Кто мэр Павлограда?', 'ru', 'true')
+        given = self.db.get_qa_quality()['by_language']['ru']
+        expected = {'avg_score': 1.0, 'count_answers': 2}
+        self.assertEqual(given, expected)
+
+    def test_rerating_replaces_rating(self):
+        self.db.reconcile_qa_stats()
+        self.db.put_qa('Кто мэр Павлограда?', 'ru', 'true')
+        self.db.put_qa('Кто мэр Павлограда?', 'ru', 'false')
+        given = self.db.get_qa_quality()
+        self.assertEqual(given['count_answers'], 3)
+        self.assertEqual(given['by_language']['ru'], {'avg_score': 0.5, 'count_answers': 2})
+
+    def test_per_day(self):
+        given = self.db.get_qa_quality(per_day=True)['by_day']
+        expected = {'2017-05-01': {'avg_score': 1.0, 'count_answers': 1},
+                    '2017-05-02': {'avg_score': 0.0, 'count_answers': 1}}
+        self.assertEqual(given, expected)
+
+    def test_answers_stored_during_scan_kept(self):
+        select = self.db._client.select
+
+        def select_and_put(**kwargs):
+            if 'NextToken' not in kwargs:
+                self.db.put_qa('Кто мэр Павлограда?', 'ru', 'true')
+            return select(**kwargs)
+
+        self.db._client.select = select_and_put
+        self.db.reconcile_qa_stats()
+        given = self.db.get_qa_quality()['count_answers']
+        self.assertEqual(given, 3)
+
+    def test_scanned_answers_not_added_twice(self):
+        client = self.db._client
+
+        class PutDuringScanClient:
+            def __init__(self, db):
+                self.db = db
+                self.stored = []
+
+            def select(self, SelectExpression, ConsistentRead, NextToken=None):
+                if NextToken is None:
+                    self.db.put_qa('Кто мэр Павлограда?', 'ru', 'true')
+                    return dict(client.select(SelectExpression, ConsistentRead), NextToken=1)
+                return {'Items': self.stored}
+
+            def put_attributes(self, DomainName, ItemName, Attributes):
+                self.stored.append({'Name': ItemName, 'Attributes': Attributes})
+
+        self.db._client = PutDuringScanClient(self.db)
+        self.db.reconcile_qa_stats()
+        given = self.db.get_qa_quality()['count_answers']
+        self.assertEqual(given, 2)
+
+    def test_pending_writes_flushed_before_scan(self):
+        class WriterSpy:
+            def __init__(self):
+                self.n_flushes = 0
+
+            def flush(self):
+                self.n_flushes += 1
+
+        self.db._writer = WriterSpy()
+        self.db.reconcile_qa_stats()
+        self.assertEqual(self.db._writer.n_flushes, 1)
+
 #
 # db = DB()
 # prop_descr = db.get_all_property_descr()
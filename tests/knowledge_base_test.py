@@ -1,4 +1,7 @@
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+import src.config as config
 from src.knowledge_base import *
 
 class SearchAPI(unittest.TestCase):
@@ -64,6 +67,280 @@ class PropertyDescriptions(unittest.TestCase):
         expected = 'country | The country where the thing is located.'
         self.assertEqual(given, expected)
 
+class SearchOrder(unittest.TestCase):
+    class FakeKnowledgeBase(DBPediaKnowledgeBase):
+        def __init__(self, lookup_results):
+            self._lookup_cache = cache.make_cache('lookup', 100)
+            self._label_index = label_index.LabelIndex()
+            self._label_index.add('http://dbpedia.org/resource/Apollo_11', 'Apollo 11',
+                                  classes=('http://dbpedia.org/ontology/SpaceMission',))
+            self.lookup_results = lookup_results
+            self.lookups = []
+
+        def _lookup(self, string, cls, type_, max_hits):
+            self.lookups.append(string)
+            return self.lookup_results.get(string)
+
+    def test_exact_label_without_lookup(self):
+        kb = self.FakeKnowledgeBase({})
+        self.assertEqual(kb.search('apollo 11')[0], 'http://dbpedia.org/resource/Apollo_11')
+        self.assertEqual(kb.lookups, [])
+
+    def test_similar_label_looked_up(self):
+        kb = self.FakeKnowledgeBase({'Apollo 13': ('http://dbpedia.org/resource/Apollo_13', 'Apollo 13', '', ())})
+        self.assertEqual(kb.search('Apollo 13')[0], 'http://dbpedia.org/resource/Apollo_13')
+        self.assertEqual(kb.lookups, ['Apollo 13'])
+
+    def test_fuzzy_after_lookup_miss(self):
+        fuzzy = config.LABEL_INDEX_FUZZY
+        config.LABEL_INDEX_FUZZY = True
+        try:
+            kb = self.FakeKnowledgeBase({})
+            self.assertEqual(kb.search('Apollo 111')[0], 'http://dbpedia.org/resource/Apollo_11')
+        finally:
+            config.LABEL_INDEX_FUZZY = fuzzy
+        self.assertEqual(kb.lookups, ['Apollo 111'])
+        lifetime = kb._lookup_cache.memory._data[('Apollo 111', '', 'Keyword', 1)][0] - time.monotonic()
+        self.assertLessEqual(lifetime, config.LOOKUP_NEGATIVE_TTL)
+
+    def test_no_fuzzy_by_default(self):
+        kb = self.FakeKnowledgeBase({})
+        self.assertIsNone(kb.search('Apollo 111'))
+
+
+class ParallelClassQueries(unittest.TestCase):
+    class FakeKnowledgeBase(DBPediaKnowledgeBase):
+        def __init__(self, results, delays):
+            self.results = results
+            self.delays = delays
+            self.started = []
+
+        def get_entity_properties(self, entity_uri, entity_class):
+            self.started.append(entity_class)
+            time.sleep(self.delays.get(entity_class, 0))
+            result = self.results[entity_class]
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+    def setUp(self):
+        self.parallel, self.fanout = config.PARALLEL_CLASS_QUERIES, config.CLASS_QUERY_MAX_FANOUT
+        config.PARALLEL_CLASS_QUERIES = True
+        config.CLASS_QUERY_MAX_FANOUT = 3
+
+    def tearDown(self):
+        config.PARALLEL_CLASS_QUERIES, config.CLASS_QUERY_MAX_FANOUT = self.parallel, self.fanout
+
+    def test_first_non_empty_class_wins(self):
+        # Place answers last, Thing first, but Person comes first in class order
+        kb = self.FakeKnowledgeBase({'Person': {'p': ['person']}, 'Place': {}, 'Thing': {'p': ['thing']}},
+                                    {'Person': 0.1, 'Place': 0.2})
+        given = kb._query_first_entity_properties('e', ['Place', 'Person', 'Thing'])
+        expected = {'p': ['person']}
+        self.assertEqual(given, expected)
+
+    def test_queued_queries_cancelled(self):
+        kb = self.FakeKnowledgeBase({'Person': {'p': ['person']}, 'Place': {}, 'Thing': {}, 'Agent': {}},
+                                    {'Person': 0.05, 'Place': 0.2})
+        # one worker: the queries of the next classes wait in the queue while the first ones run
+        kb._executor = ThreadPoolExecutor(max_workers=1)
+        given = kb._query_first_entity_properties('e', ['Person', 'Place', 'Thing', 'Agent'])
+        kb._executor.shutdown(wait=True)
+        self.assertEqual(given, {'p': ['person']})
+        # Place was already running, Thing was queued and cancelled, Agent was beyond the fan-out
+        self.assertEqual(kb.started, ['Person', 'Place'])
+
+    def test_next_class_submitted_after_empty_result(self):
+        config.CLASS_QUERY_MAX_FANOUT = 1
+        kb = self.FakeKnowledgeBase({'Person': {}, 'Place': {}, 'Thing': {'p': ['thing']}}, {})
+        given = kb._query_first_entity_properties('e', ['Person', 'Place', 'Thing'])
+        self.assertEqual(given, {'p': ['thing']})
+        self.assertEqual(kb.started, ['Person', 'Place', 'Thing'])
+
+    def test_error_propagated(self):
+        kb = self.FakeKnowledgeBase({'Person': ValueError('bad response'), 'Place': {'p': ['place']}}, {})
+        self.assertRaises(ValueError, kb._query_first_entity_properties, 'e', ['Person', 'Place'])
+
+
+class PropertyDescrRefresh(unittest.TestCase):
+    class FakeDB:
+        def __init__(self):
+            self.selects = []
+            # (property URI, description, time_add)
+            self.stored = [('http://dbpedia.org/ontology/country', 'country', '2017-05-01 00:00:00')]
+
+        def get_all_property_descr(self):
+            self.selects.append(None)
+            return {'http://dbpedia.org/property/postalCode': 'postal code'}
+
+        def iter_property_descr_pages(self, since=None):
+            self.selects.append(since)
+            yield [(uri, descr) for uri, descr, time_add in self.stored if since is None or time_add > since]
+
+    class FakeKnowledgeBase(DBPediaKnowledgeBase):
+        def __init__(self, fake_db):
+            self.fake_db = fake_db
+
+        @property
+        def _db(self):
+            return self.fake_db
+
+    def setUp(self):
+        self.prop_descr = DBPediaKnowledgeBase._prop_descr, DBPediaKnowledgeBase._prop_descr_loaded_at
+        DBPediaKnowledgeBase._prop_descr = None
+        self.fake_db = self.FakeDB()
+        self.kdb = self.FakeKnowledgeBase(self.fake_db)
+
+    def tearDown(self):
+        DBPediaKnowledgeBase._prop_descr, DBPediaKnowledgeBase._prop_descr_loaded_at = self.prop_descr
+
+    def test_first_refresh_loads_once(self):
+        self.assertEqual(self.kdb.refresh_property_descr(), 1)
+        self.assertEqual(self.fake_db.selects, [None])
+
+    def test_refresh_since_last_load(self):
+        self.kdb.refresh_property_descr()
+        self.fake_db.stored.append(('http://dbpedia.org/ontology/elevation', 'elevation', str(dt.datetime.now())))
+        self.assertEqual(self.kdb.refresh_property_descr(), 1)
+        self.assertEqual(len(self.fake_db.selects), 2)
+        self.assertIsNotNone(self.fake_db.selects[1])
+        self.assertIn('http://dbpedia.org/ontology/elevation', self.kdb._cached_prop_descr)
+
+    def test_late_description_not_missed(self):
+        self.kdb.refresh_property_descr()
+        self.kdb.refresh_property_descr()
+        # stored by another worker before the last refresh, but visible only after it
+        time_add = str(DBPediaKnowledgeBase._prop_descr_loaded_at - dt.timedelta(seconds=10))
+        self.fake_db.stored.append(('http://dbpedia.org/property/areaTotalKm', 'area total km', time_add))
+        self.kdb.refresh_property_descr()
+        self.assertEqual(self.kdb._cached_prop_descr['http://dbpedia.org/property/areaTotalKm'], 'area total km')
+
+
+class BulkPropertyDescriptions(unittest.TestCase):
+    LABEL = 'http://www.w3.org/2000/01/rdf-schema#label'
+    COMMENT = 'http://www.w3.org/2000/01/rdf-schema#comment'
+
+    class FakeDB:
+        def __init__(self):
+            self.stored = []
+
+        def put_property_descrs(self, prop_descrs):
+            self.stored.append(prop_descrs)
+
+    class FakeKnowledgeBase(DBPediaKnowledgeBase):
+        def __init__(self, fake_db, triples):
+            self.fake_db = fake_db
+            # (property, rdfs predicate, value) known by the fake endpoint
+            self.triples = triples
+            self.queries = []
+
+        @property
+        def _db(self):
+            return self.fake_db
+
+        def sparql(self, query):
+            self.queries.append(query)
+            return {'results': {'bindings': [{'property': {'value': prop}, 'p': {'value': p}, 'o': {'value': o}}
+                                             for prop, p, o in self.triples if '<{0}>'.format(prop) in query]}}
+
+    def setUp(self):
+        self.prop_descr = DBPediaKnowledgeBase._prop_descr, DBPediaKnowledgeBase._prop_descr_loaded_at
+        DBPediaKnowledgeBase._prop_descr = {'http://dbpedia.org/property/postalCode': 'postal code'}
+        self.fake_db = self.FakeDB()
+        # the comment comes first in the response, but the label goes first in the description
+        triples = [('http://dbpedia.org/ontology/country', self.COMMENT, 'The country where the thing is located.'),
+                   ('http://dbpedia.org/ontology/country', self.LABEL, 'country'),
+                   ('http://dbpedia.org/property/areaTotalKm', self.LABEL, 'area total km')]
+        self.kdb = self.FakeKnowledgeBase(self.fake_db, triples)
+
+    def tearDown(self):
+        DBPediaKnowledgeBase._prop_descr, DBPediaKnowledgeBase._prop_descr_loaded_at = self.prop_descr
+
+    def test_label_then_comment(self):
+        given = self.kdb.get_property_descrs(['http://dbpedia.org/ontology/country',
+                                              'http://dbpedia.org/property/areaTotalKm',
+                                              'http://dbpedia.org/property/unknown'])
+        expected = {'http://dbpedia.org/ontology/country':     'country | The country where the thing is located.',
+                    'http://dbpedia.org/property/areaTotalKm': 'area total km',
+                    'http://dbpedia.org/property/unknown':     ''}
+        self.assertEqual(given, expected)
+        self.assertEqual(len(self.kdb.queries), 1)
+
+    def test_cached_and_blacklisted_not_queried(self):
+        given = self.kdb.get_property_descrs(['http://dbpedia.org/property/postalCode',
+                                              'http://dbpedia.org/property/years'])
+        expected = {'http://dbpedia.org/property/postalCode': 'postal code',
+                    'http://dbpedia.org/property/years':      ''}
+        self.assertEqual(given, expected)
+        self.assertEqual(self.kdb.queries, [])
+
+    def test_chunks_of_50(self):
+        uris = ['http://dbpedia.org/property/p{0}'.format(i) for i in range(120)]
+        descrs = self.kdb.get_property_descrs(uris + uris[:10])
+        self.assertEqual(len(descrs), 120)
+        given = [query.count('<http://dbpedia.org/property/p') for query in self.kdb.queries]
+        expected = [50, 50, 20]
+        self.assertEqual(given, expected)
+
+    def test_fetched_descriptions_stored(self):
+        self.kdb.get_property_descrs(['http://dbpedia.org/ontology/country', 'http://dbpedia.org/property/unknown'])
+        given = self.fake_db.stored
+        expected = [{'http://dbpedia.org/ontology/country': 'country | The country where the thing is located.',
+                     'http://dbpedia.org/property/unknown': ''}]
+        self.assertEqual(given, expected)
+        self.assertIn('http://dbpedia.org/ontology/country', self.kdb._cached_prop_descr)
+
+
+class EntityImage(unittest.TestCase):
+    class FakeKnowledgeBase(DBPediaKnowledgeBase):
+        def __init__(self, images):
+            self._entity_cache = cache.make_cache('entity_properties', 100)
+            self._image_cache = cache.make_cache('entity_images', 100)
+            self.images = images
+            self.queries = []
+
+        def sparql(self, query):
+            self.queries.append(query)
+            return {'results': {'bindings': [{'thumbnail': {'value': image}}
+                                             for uri, image in self.images.items() if '<{0}>'.format(uri) in query]}}
+
+    def setUp(self):
+        self.kdb = self.FakeKnowledgeBase({'http://dbpedia.org/resource/Pavlohrad': 'http://commons/Pavlohrad.jpg'})
+
+    def test_image_query_cached(self):
+        for _ in range(2):
+            self.assertEqual(self.kdb.get_entity_image('http://dbpedia.org/resource/Pavlohrad'),
+                             'http://commons/Pavlohrad.jpg')
+        self.assertEqual(len(self.kdb.queries), 1)
+
+    def test_no_image_cached(self):
+        for _ in range(2):
+            self.assertIsNone(self.kdb.get_entity_image('http://dbpedia.org/resource/Berlin'))
+        self.assertEqual(len(self.kdb.queries), 1)
+
+    def test_from_cached_properties(self):
+        self.kdb._entity_cache.set('http://dbpedia.org/resource/Berlin', {THUMBNAIL: ['http://commons/Berlin.jpg']})
+        self.kdb._entity_cache.set('http://dbpedia.org/resource/Paris', {'p': ['v']})
+        self.assertEqual(self.kdb.get_entity_image('http://dbpedia.org/resource/Berlin'), 'http://commons/Berlin.jpg')
+        self.assertIsNone(self.kdb.get_entity_image('http://dbpedia.org/resource/Paris'))
+        self.assertEqual(self.kdb.queries, [])
+
+
+class CsvStream(unittest.TestCase):
+    def test_rows_split_between_chunks(self):
+        chunks = ['"property","obj"\r\n"http://dbpedia.org/ontology/country","http://dbpedia.org/res',
+                  'ource/Ukraine"\r', '\n"http://dbpedia.org/property/postalCode",51400\r\n']
+        given = list(iter_csv_rows(chunks))
+        expected = [['http://dbpedia.org/ontology/country', 'http://dbpedia.org/resource/Ukraine'],
+                    ['http://dbpedia.org/property/postalCode', '51400']]
+        self.assertEqual(given, expected)
+
+    def test_multiline_value(self):
+        chunks = ['"property","obj"\n"http://dbpedia.org/ontology/abstract","Pavlohrad, ""city""\n', 'in Ukraine"\n']
+        given = list(iter_csv_rows(chunks))
+        expected = [['http://dbpedia.org/ontology/abstract', 'Pavlohrad, "city"\nin Ukraine']]
+        self.assertEqual(given, expected)
+
 # kdb = DBPediaKnowledgeBase()
 # kdb.search('Lincoln', 'Person')
 # prop_value = kdb.get_entity_properties('http://dbpedia.org/resource/New-York')
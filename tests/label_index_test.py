@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+import src.config as config
+from src.label_index import *
+
+LABELS = '''http://dbpedia.org/resource/Abraham_Lincoln\tAbraham Lincoln\tAbraham Lincoln was the 16th President.\thttp://dbpedia.org/ontology/Person\t8000
+http://dbpedia.org/resource/Lincoln,_England\tLincoln, England\tLincoln is a cathedral city.\thttp://dbpedia.org/ontology/Place\t3000
+http://dbpedia.org/resource/Lincoln,_England\tLincoln
+http://dbpedia.org/resource/Abraham_Lincoln\tLincoln
+http://dbpedia.org/resource/Pavlohrad\tPavlohrad\tPavlohrad is a city.\thttp://dbpedia.org/ontology/Place\t100
+http://dbpedia.org/resource/Pavlohrad\tPavlograd
+'''
+
+
+class Search(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'labels.tsv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(LABELS)
+        self.index = build_index([path], os.path.join(self.dir, 'label_index.pkl'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_most_popular(self):
+        given = self.index.search('lincoln')
+        expected = ('http://dbpedia.org/resource/Abraham_Lincoln', 'Abraham Lincoln',
+                    'Abraham Lincoln was the 16th President.', ('http://dbpedia.org/ontology/Person',))
+        self.assertEqual(given, expected)
+
+    def test_class(self):
+        given = self.index.search('Lincoln', 'Place')[0]
+        expected = 'http://dbpedia.org/resource/Lincoln,_England'
+        self.assertEqual(given, expected)
+
+    def test_redirect(self):
+        self.assertEqual(self.index.search('Pavlograd')[0], 'http://dbpedia.org/resource/Pavlohrad')
+
+    def test_fuzzy(self):
+        self.assertEqual(self.index.fuzzy_search('Abraham Lincolnn')[0], 'http://dbpedia.org/resource/Abraham_Lincoln')
+        self.assertIsNone(self.index.fuzzy_search('Berlin'))
+
+    def test_fuzzy_class_threshold(self):
+        self.assertIsNone(self.index.fuzzy_search('Abraham Lincon'))
+        self.assertEqual(self.index.fuzzy_search('Abraham Lincon', 'Person')[0],
+                         'http://dbpedia.org/resource/Abraham_Lincoln')
+        self.index.add('http://dbpedia.org/resource/Apollo_11', 'Apollo 11',
+                       classes=('http://dbpedia.org/ontology/SpaceMission',))
+        self.assertIsNone(self.index.fuzzy_search('Apollo 13', 'SpaceMission'))
+
+    def test_similar_label_not_exact(self):
+        self.index.add('http://dbpedia.org/resource/Apollo_11', 'Apollo 11')
+        self.assertIsNone(self.index.search('Apollo 13'))
+        self.assertIsNone(self.index.search('Abraham Lincon'))
+
+    def test_prefix(self):
+        given = [result[0] for result in self.index.complete('linc')]
+        expected = ['http://dbpedia.org/resource/Abraham_Lincoln', 'http://dbpedia.org/resource/Lincoln,_England']
+        self.assertEqual(given, expected)
+
+    def test_save_and_reload(self):
+        self.index.save()
+        index = LabelIndex(self.index.path)
+        self.assertTrue(index.load())
+        self.assertEqual(index.search('Pavlograd')[0], 'http://dbpedia.org/resource/Pavlohrad')
+        self.assertEqual(len(index), 3)
+
+    def test_learn_and_reload(self):
+        self.index.save()
+        self.index.learn('http://dbpedia.org/resource/Berlin', 'Berlin', 'Berlin is\tthe capital of Germany.',
+                         ('http://dbpedia.org/ontology/Place',), 9000, 'Berlin city')
+        self.index.flush()
+        index = LabelIndex(self.index.path)
+        self.assertTrue(index.load())
+        self.assertEqual(index.search('berlin city'), ('http://dbpedia.org/resource/Berlin', 'Berlin',
+                                                        'Berlin is the capital of Germany.',
+                                                        ('http://dbpedia.org/ontology/Place',)))
+        self.assertEqual(len(index), 4)
+
+    def test_learned_labels_expire(self):
+        self.index.learn('http://dbpedia.org/resource/Berlin', 'Berlin', '', (), 9000, 'Berlin city')
+        self.index.learn('http://dbpedia.org/resource/Pavlohrad', 'Pavlohrad', '', (), 100, 'Pavlohrad city')
+        self.index.flush()
+        learned_ttl = config.LABEL_INDEX_LEARNED_TTL
+        config.LABEL_INDEX_LEARNED_TTL = -1
+        try:
+            self.assertIsNone(self.index.search('berlin city'))
+            self.assertEqual(self.index.complete('pavlohrad c'), [])
+            # built labels don't expire
+            self.assertEqual(self.index.search('Pavlohrad')[0], 'http://dbpedia.org/resource/Pavlohrad')
+            index = LabelIndex(self.index.path)
+            index.load()
+            self.assertNotIn('http://dbpedia.org/resource/Berlin', index)
+        finally:
+            config.LABEL_INDEX_LEARNED_TTL = learned_ttl
+        self.assertEqual(self.index.search('berlin city')[0], 'http://dbpedia.org/resource/Berlin')
+
+    def test_workers_share_journal(self):
+        other = LabelIndex(self.index.path)
+        self.index.learn('http://dbpedia.org/resource/Berlin', 'Berlin', '', (), 9000, 'Berlin')
+        other.learn('http://dbpedia.org/resource/Paris', 'Paris', '', (), 9000, 'Paris')
+        self.index.flush()
+        other.flush()
+        index = LabelIndex(self.index.path)
+        index.load()
+        self.assertIn('http://dbpedia.org/resource/Berlin', index)
+        self.assertIn('http://dbpedia.org/resource/Paris', index)
+
+
+if __name__ == '__main__':
+    unittest.main()
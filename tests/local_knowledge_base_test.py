@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src.local_knowledge_base import *
+
+TRIPLES = r'''
+<http://dbpedia.org/resource/Pavlohrad> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://dbpedia.org/ontology/Place> .
+<http://dbpedia.org/resource/Pavlohrad> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/2002/07/owl#Thing> .
+<http://dbpedia.org/resource/Pavlohrad> <http://www.w3.org/2000/01/rdf-schema#label> "Pavlohrad"@en .
+<http://dbpedia.org/resource/Pavlohrad> <http://www.w3.org/2000/01/rdf-schema#label> "Павлоград"@ru .
+<http://dbpedia.org/resource/Pavlohrad> <http://www.w3.org/2000/01/rdf-schema#comment> "Pavlohrad is a city in \"Ukraine\"."@en .
+<http://dbpedia.org/resource/Pavlohrad> <http://dbpedia.org/ontology/maximumElevation> "71.0"^^<http://www.w3.org/2001/XMLSchema#double> .
+<http://dbpedia.org/resource/Pavlohrad> <http://dbpedia.org/ontology/country> <http://dbpedia.org/resource/Ukraine> .
+<http://dbpedia.org/resource/Pavlohrad> <http://dbpedia.org/property/name> "Pavlohrad"@de .
+<http://dbpedia.org/resource/Pavlohrad> <http://dbpedia.org/property/years> "1780" .
+<http://dbpedia.org/resource/Pavlohrad> <http://dbpedia.org/property/postalCode> "51400" .
+<http://dbpedia.org/resource/Pavlohrad> <http://dbpedia.org/ontology/thumbnail> <http://commons.wikimedia.org/wiki/Special:FilePath/Pavlohrad.jpg?width=300> .
+<http://dbpedia.org/resource/Pavlohrad> <http://xmlns.com/foaf/0.1/homepage> <http://pavlograd-official.org/> .
+<http://dbpedia.org/resource/Pavlograd> <http://www.w3.org/2000/01/rdf-schema#label> "Pavlograd"@en .
+<http://dbpedia.org/resource/Pavlograd> <http://dbpedia.org/ontology/wikiPageRedirects> <http://dbpedia.org/resource/Pavlohrad> .
+<http://dbpedia.org/resource/Pavlohrad_(film)> <http://www.w3.org/2000/01/rdf-schema#label> "Pavlohrad"@en .
+<http://dbpedia.org/resource/Pavlohrad_(film)> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://dbpedia.org/ontology/Film> .
+<http://dbpedia.org/resource/Pavlohrad_(film)> <http://dbpedia.org/ontology/runtime> "90" .
+<http://dbpedia.org/ontology/country> <http://www.w3.org/2000/01/rdf-schema#label> "country"@en .
+<http://dbpedia.org/ontology/country> <http://www.w3.org/2000/01/rdf-schema#comment> "The country where the thing is located."@en .
+<http://dbpedia.org/ontology/country> <http://www.w3.org/2000/01/rdf-schema#label> "Land"@de .
+<http://dbpedia.org/property/postalCode> <http://www.w3.org/2000/01/rdf-schema#label> "postal code"@en .
+_:b0 <http://dbpedia.org/ontology/country> <http://dbpedia.org/resource/Ukraine> .
+'''
+
+
+class NTriples(unittest.TestCase):
+    def test_literal_with_escapes(self):
+        line = r'<http://a> <http://b> "say \"hi\"!\n"@en .'
+        given = list(parse_ntriples([line]))
+        expected = [('http://a', 'http://b', 'say "hi"!\n', 'en')]
+        self.assertEqual(given, expected)
+
+    def test_uri_and_typed_literal(self):
+        lines = ['<http://a> <http://b> <http://c> .',
+                 '<http://a> <http://b> "1"^^<http://www.w3.org/2001/XMLSchema#integer> .',
+                 '# comment']
+        given = list(parse_ntriples(lines))
+        expected = [('http://a', 'http://b', 'http://c', None), ('http://a', 'http://b', '1', '')]
+        self.assertEqual(given, expected)
+
+
+class Index(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        writer = MmapIndexWriter(os.path.join(self.dir, 'test'))
+        for key in ['a', 'ab', 'b', 'ж']:
+            writer.add(key, key.upper().encode('utf-8'))
+        writer.close()
+        self.index = MmapIndex(os.path.join(self.dir, 'test'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get(self):
+        self.assertEqual(self.index.get('ab'), b'AB')
+        self.assertEqual(self.index.get('ж'), 'Ж'.encode('utf-8'))
+        self.assertIsNone(self.index.get('aa'))
+        self.assertIsNone(self.index.get('z'))
+
+    def test_unsorted_keys(self):
+        writer = MmapIndexWriter(os.path.join(self.dir, 'unsorted'))
+        writer.add('b', b'')
+        self.assertRaises(ValueError, writer.add, 'a', b'')
+        writer.close()
+
+
+class LocalBase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        nt_path = os.path.join(cls.dir, 'dump.nt')
+        with open(nt_path, 'w', encoding='utf-8') as f:
+            f.write(TRIPLES)
+        # small chunks to go through the external merge
+        cls.sizes = build_indexes([nt_path], os.path.join(cls.dir, 'index'), chunk_size=4)
+        cls.kdb = LocalKnowledgeBase(os.path.join(cls.dir, 'index'))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def test_search_most_popular(self):
+        uri, name, description, classes = self.kdb.search('pavlohrad')
+        self.assertEqual(uri, 'http://dbpedia.org/resource/Pavlohrad')
+        self.assertEqual(description, 'Pavlohrad is a city in "Ukraine".')
+        self.assertEqual(classes, ('http://dbpedia.org/ontology/Place',))
+
+    def test_search_class_and_redirect(self):
+        self.assertEqual(self.kdb.search('Pavlohrad', 'Film')[0], 'http://dbpedia.org/resource/Pavlohrad_(film)')
+        self.assertEqual(self.kdb.search('Pavlograd')[0], 'http://dbpedia.org/resource/Pavlohrad')
+        self.assertIsNone(self.kdb.search('Kyiv'))
+
+    def test_entity_properties(self):
+        prop_value = self.kdb.get_entity_properties('http://dbpedia.org/resource/Pavlohrad',
+                                                    self.kdb._basic_entity_class)
+        self.assertEqual(prop_value['http://dbpedia.org/ontology/maximumElevation'], ['71.0'])
+        self.assertEqual(prop_value['http://dbpedia.org/property/postalCode'], ['51400'])
+        self.assertNotIn('http://dbpedia.org/property/name', prop_value)
+        self.assertNotIn('http://dbpedia.org/property/years', prop_value)
+        self.assertNotIn('http://xmlns.com/foaf/0.1/homepage', prop_value)
+
+    def test_first_entity_properties(self):
+        uri = 'http://dbpedia.org/resource/Pavlohrad'
+        self.assertEqual(self.kdb.get_entity_properties(uri, 'http://dbpedia.org/ontology/Film'), {})
+        self.assertIn('http://dbpedia.org/ontology/country',
+                      self.kdb.get_first_entity_properties(uri, ['http://dbpedia.org/ontology/Film',
+                                                                 'http://dbpedia.org/ontology/Place']))
+
+    def test_entity_image(self):
+        given = self.kdb.get_entity_image('http://dbpedia.org/resource/Pavlohrad')
+        expected = 'http://commons.wikimedia.org/wiki/Special:FilePath/Pavlohrad.jpg?width=300'
+        self.assertEqual(given, expected)
+        self.assertIsNone(self.kdb.get_entity_image('http://dbpedia.org/resource/Pavlohrad_(film)'))
+
+    def test_property_descrs(self):
+        given = self.kdb.get_property_descrs(['http://dbpedia.org/ontology/country',
+                                              'http://dbpedia.org/property/postalCode',
+                                              'http://dbpedia.org/property/unknown'])
+        expected = {'http://dbpedia.org/ontology/country':      'country | The country where the thing is located.',
+                    'http://dbpedia.org/property/postalCode':   'postal code',
+                    'http://dbpedia.org/property/unknown':      ''}
+        self.assertEqual(given, expected)
+
+    def test_sizes(self):
+        self.assertEqual(self.sizes, {'entities': 2, 'properties': 2, 'labels': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
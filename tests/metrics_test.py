@@ -0,0 +1,64 @@
+import unittest
+from src.metrics import *
+
+
+class Histograms(unittest.TestCase):
+    def setUp(self):
+        self.histogram = Histogram(buckets=(0.1, 1.0))
+
+    def test_buckets(self):
+        for value in (0.05, 0.1, 0.5, 2.0):
+            self.histogram.observe(value)
+        self.assertEqual(self.histogram.counts, [2, 1, 1])
+        self.assertEqual(self.histogram.cumulative_counts(), [2, 3, 4])
+        self.assertAlmostEqual(self.histogram.sum, 2.65)
+
+
+class Rendering(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        self.registry.inc('questions_total', result='answer')
+        self.registry.inc('questions_total', 2, result='answer')
+        self.assertEqual(self.registry.get_counter('questions_total', result='answer'), 3)
+        self.assertIn('questions_total{result="answer"} 3\n', self.registry.render())
+
+    def test_histogram(self):
+        self.registry.observe('stage_seconds', 0.003, stage='lookup')
+        given = self.registry.render()
+        self.assertIn('# TYPE stage_seconds histogram', given)
+        self.assertIn('stage_seconds_bucket{stage="lookup",le="0.005"} 1', given)
+        self.assertIn('stage_seconds_bucket{stage="lookup",le="+Inf"} 1', given)
+        self.assertIn('stage_seconds_count{stage="lookup"} 1', given)
+
+    def test_collector(self):
+        self.registry.register_collector(lambda: [('cache_size', {'cache': 'lookup'}, 10)])
+        self.assertIn('cache_size{cache="lookup"} 10', self.registry.render())
+
+    def test_label_escaping(self):
+        self.registry.inc('errors_total', stage='say "hi"')
+        self.assertIn('errors_total{stage="say \\"hi\\""} 1', self.registry.render())
+
+
+class Timing(unittest.TestCase):
+    def setUp(self):
+        registry.clear()
+
+    def test_timed_block(self):
+        with timed('categorize'):
+            pass
+        self.assertEqual(registry.get_histogram('deepanswer_stage_seconds', stage='categorize').count, 1)
+
+    def test_timed_function_with_error(self):
+        @timed('lookup')
+        def search():
+            raise IOError('timeout')
+        self.assertRaises(IOError, search)
+        self.assertRaises(IOError, search)
+        self.assertEqual(registry.get_histogram('deepanswer_stage_seconds', stage='lookup').count, 2)
+        self.assertEqual(registry.get_counter('deepanswer_stage_errors_total', stage='lookup'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import src.nlp as nlp
+from src.nlp import *
+
+
+class Morph(unittest.TestCase):
+    class FakeMorph:
+        class Parse:
+            class Tag:
+                POS = 'NOUN'
+
+            tag = Tag()
+
+            def __init__(self, normal_form):
+                self.normal_form = normal_form
+
+        def __init__(self):
+            self.parsed = []
+
+        def parse(self, token):
+            self.parsed.append(token)
+            return [self.Parse(token.lower())]
+
+    def setUp(self):
+        self.models = dict(nlp._models)
+        self.morph = self.FakeMorph()
+        nlp._models['morph'] = self.morph
+
+    def tearDown(self):
+        nlp._models.clear()
+        nlp._models.update(self.models)
+
+    def test_repeated_words_hit(self):
+        morph_cache = MorphCache(10)
+        for token in ['Павлоград', 'мэр', 'Павлоград', 'Павлоград']:
+            self.assertEqual(morph_cache.analyze(token), ('NOUN', token.lower()))
+        self.assertEqual(self.morph.parsed, ['Павлоград', 'мэр'])
+        stats = morph_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 2, 2))
+        self.assertGreater(stats['memory_bytes'], 0)
+
+    def test_size_limit(self):
+        morph_cache = MorphCache(3)
+        for i in range(10):
+            morph_cache.analyze('слово{0}'.format(i))
+        self.assertEqual(morph_cache.stats()['size'], 3)
+        # the least recently used words are evicted and analyzed again
+        morph_cache.analyze('слово9')
+        morph_cache.analyze('слово0')
+        self.assertEqual(self.morph.parsed[-1], 'слово0')
+        self.assertEqual(len(self.morph.parsed), 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import src.config as config
+from src.property_index import *
+
+DESCRS = {'http://dbpedia.org/ontology/birthPlace':      'birth place | where the person was born',
+          'http://dbpedia.org/ontology/deathPlace':      'death place | where the person died',
+          'http://dbpedia.org/ontology/populationTotal': 'population total',
+          'http://dbpedia.org/property/county':          'county'}
+
+
+class Rank(unittest.TestCase):
+    def setUp(self):
+        self.index = PropertyIndex()
+        self.index.fit(DESCRS)
+
+    def test_order_of_given_uris(self):
+        uris = ['http://dbpedia.org/ontology/populationTotal', 'http://dbpedia.org/ontology/birthPlace']
+        sims = self.index.rank(uris, 'What is the population of Pavlohrad?', [])
+        self.assertGreater(sims[0], sims[1])
+        sims = self.index.rank(list(reversed(uris)), 'What is the population of Pavlohrad?', [])
+        self.assertGreater(sims[1], sims[0])
+
+    def test_subject_tokens_removed(self):
+        uris = ['http://dbpedia.org/property/county']
+        self.assertGreater(self.index.rank(uris, 'Where is the county?', [])[0], 0)
+        self.assertEqual(self.index.rank(uris, 'Where is the county?', ['county'])[0], 0)
+
+    def test_unknown_uris_zero(self):
+        uris = ['http://dbpedia.org/property/unknown', 'http://dbpedia.org/ontology/populationTotal']
+        sims = self.index.rank(uris, 'What is the population of Pavlohrad?', [])
+        self.assertEqual(sims[0], 0)
+        self.assertGreater(sims[1], 0)
+
+    def test_unfitted_index_zeros(self):
+        sims = PropertyIndex().rank(list(DESCRS.keys()), 'What is the population of Pavlohrad?', [])
+        self.assertEqual(list(sims), [0] * len(DESCRS))
+
+
+class Add(unittest.TestCase):
+    def setUp(self):
+        self.refit_every = config.PROPERTY_INDEX_REFIT_EVERY
+        self.index = PropertyIndex()
+        self.index.fit(DESCRS)
+
+    def tearDown(self):
+        config.PROPERTY_INDEX_REFIT_EVERY = self.refit_every
+
+    def test_new_rows_ranked(self):
+        self.index.add({'http://dbpedia.org/ontology/populationDensity': 'population density'})
+        self.assertIn('http://dbpedia.org/ontology/populationDensity', self.index)
+        sims = self.index.rank(['http://dbpedia.org/ontology/populationDensity'], 'What is the population?', [])
+        self.assertGreater(sims[0], 0)
+
+    def test_first_add_fits(self):
+        index = PropertyIndex()
+        index.add(DESCRS)
+        self.assertEqual(len(index), len(DESCRS))
+
+    def test_refit_keeps_rows_added_during_fit(self):
+        fit = self.index._fit
+
+        def fit_and_add(prop_descrs):
+            fitted = fit(prop_descrs)
+            self.index.add({'http://dbpedia.org/ontology/areaTotal': 'area total'})
+            return fitted
+
+        self.index._fit = fit_and_add
+        self.index.refit()
+        self.assertEqual(len(self.index), len(DESCRS) + 1)
+        sims = self.index.rank(['http://dbpedia.org/ontology/areaTotal'], 'What is the total area?', [])
+        self.assertGreater(sims[0], 0)
+
+    def test_background_refit(self):
+        config.PROPERTY_INDEX_REFIT_EVERY = 1
+        self.index.add({'http://dbpedia.org/ontology/areaTotal': 'area total',
+                        'http://dbpedia.org/ontology/elevation': 'elevation'})
+        for thread in threading.enumerate():
+            if thread.name == 'property-index-refit':
+                thread.join()
+        self.assertEqual(self.index._n_added, 0)
+        self.assertIn('elevation', self.index._vectorizer.vocabulary_)
+        self.assertEqual(len(self.index), len(DESCRS) + 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
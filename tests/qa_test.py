@@ -1,7 +1,245 @@
+import threading
+import time
 import unittest
+import src.qa as qa
 from src.qa import *
 
 
+class Categorizer(unittest.TestCase):
+    class FakeMatcher:
+        def __init__(self, matching_types):
+            self.matching_patterns = [qtype.compiled_patterns for qtype in matching_types]
+            self.checked = []
+
+        def match(self, question, patterns):
+            self.checked.append(patterns)
+            return patterns in self.matching_patterns
+
+    def test_patterns_compiled_once(self):
+        for qtype in (DescribeQuestion, PropertyQuestion, WrongQuestion):
+            given = [pattern.pattern for pattern in qtype.compiled_patterns]
+            self.assertEqual(given, qtype.patterns)
+            for pattern in qtype.compiled_patterns:
+                self.assertIs(txt.compile_pattern(pattern.pattern), pattern)
+
+    def test_first_matching_type_wins(self):
+        categorizer = QuestionCategorizer('Павлоград')
+        categorizer.pattern_matcher = self.FakeMatcher([PropertyQuestion, WrongQuestion])
+        self.assertIs(categorizer.get_type(), PropertyQuestion)
+        given = categorizer.pattern_matcher.checked
+        expected = [DescribeQuestion.compiled_patterns, PropertyQuestion.compiled_patterns]
+        self.assertEqual(given, expected)
+
+    def test_no_matching_type(self):
+        categorizer = QuestionCategorizer('Павлоград')
+        categorizer.pattern_matcher = self.FakeMatcher([])
+        self.assertIs(categorizer.get_type(), WrongQuestion)
+
+    def test_describe_over_property(self):
+        # 'Кто такой NOUN' matches the patterns of all types
+        self.assertIs(QuestionCategorizer('Кто такой Авраам Линкольн?').get_type(), DescribeQuestion)
+        self.assertIs(QuestionCategorizer('павлоград').get_type(), DescribeQuestion)
+
+    def test_property_over_wrong(self):
+        self.assertIs(QuestionCategorizer('Кто мэр Павлограда?').get_type(), PropertyQuestion)
+
+    def test_wrong(self):
+        self.assertIs(QuestionCategorizer('12345').get_type(), WrongQuestion)
+
+
+class AskMany(unittest.TestCase):
+    SUBJECTS = {'Кто мэр Павлограда?':     'Павлограда',
+                'Какое население Павлограда?': 'Павлограда',
+                'Кто такой Эйнштейн?':     'Эйнштейн',
+                'Сломанный вопрос?':       'Сломанный'}
+    ENTITIES = {'Павлограда (en)': 'http://dbpedia.org/resource/Pavlohrad',
+                'Эйнштейн (en)':   'http://dbpedia.org/resource/Albert_Einstein'}
+
+    class FakeTranslation:
+        def __init__(self):
+            self.batches = []
+
+        def translate_many(self, texts, lang):
+            self.batches.append(list(texts))
+            return ['{0} ({1})'.format(text, lang) for text in texts]
+
+    class FakeKnowledgeBase:
+        def search(self, string):
+            uri = AskMany.ENTITIES.get(string)
+            return [uri] if uri else None
+
+    class FakeKnowledgeBaseModule:
+        def __init__(self, knowledge_base):
+            self.knowledge_base = knowledge_base
+
+        def get_knowledge_base(self):
+            return self.knowledge_base
+
+    def setUp(self):
+        self.patched = qa.ask, qa._find_subject, qa.tr, qa.kdb
+        self.asked = []
+        self.translation = self.FakeTranslation()
+        qa.ask = self.fake_ask
+        qa._find_subject = self.SUBJECTS.get
+        qa.tr = self.translation
+        qa.kdb = self.FakeKnowledgeBaseModule(self.FakeKnowledgeBase())
+
+    def tearDown(self):
+        qa.ask, qa._find_subject, qa.tr, qa.kdb = self.patched
+
+    def fake_ask(self, q_text, language='ru'):
+        self.asked.append((q_text, threading.get_ident()))
+        if q_text == 'Сломанный вопрос?':
+            raise RuntimeError('broken')
+        if q_text == 'Кто мэр Павлограда?':
+            # keeps the worker busy, so a question of another group would run in another thread
+            time.sleep(0.05)
+        return {'answer': 'answer to ' + q_text, 'image': ''}
+
+    def test_order_and_dedupe(self):
+        q_texts = ['Кто такой Эйнштейн?', 'кто мэр  Павлограда?', 'Кто мэр Павлограда?', 'Кто такой Эйнштейн?']
+        given = [result['answer'] for result in ask_many(q_texts, 'en')]
+        expected = ['answer to Кто такой Эйнштейн?', 'answer to Кто мэр Павлограда?',
+                    'answer to Кто мэр Павлограда?', 'answer to Кто такой Эйнштейн?']
+        self.assertEqual(given, expected)
+        self.assertEqual(sorted(q_text for q_text, thread in self.asked),
+                         ['Кто мэр Павлограда?', 'Кто такой Эйнштейн?'])
+
+    def test_prefetch_uses_normalized_questions(self):
+        ask_many(['  кто мэр Павлограда?'], 'en')
+        self.assertEqual(self.translation.batches[0], ['Кто мэр Павлограда?', 'Павлограда'])
+
+    def test_questions_about_entity_grouped(self):
+        ask_many(['Кто мэр Павлограда?', 'Кто такой Эйнштейн?', 'Какое население Павлограда?'], 'en')
+        threads = dict(self.asked)
+        self.assertEqual(threads['Кто мэр Павлограда?'], threads['Какое население Павлограда?'])
+        q_texts = [q_text for q_text, thread in self.asked if thread == threads['Кто мэр Павлограда?']]
+        self.assertLess(q_texts.index('Кто мэр Павлограда?'), q_texts.index('Какое население Павлограда?'))
+
+    def test_failed_question_in_its_slot(self):
+        given = ask_many(['Кто мэр Павлограда?', 'Сломанный вопрос?'], 'ru')
+        self.assertEqual(given[0], {'answer': 'answer to Кто мэр Павлограда? (ru)', 'image': ''})
+        self.assertEqual(given[1]['error'], Question.msg_internal_error)
+        # errors are not translated
+        self.assertEqual(self.translation.batches[-1], ['answer to Кто мэр Павлограда?'])
+
+
+class EntityPropertyDescriptions(unittest.TestCase):
+    PROPERTIES = {'http://dbpedia.org/ontology/country':     ['http://dbpedia.org/resource/Ukraine'],
+                  'http://dbpedia.org/property/postalCode':  ['51400'],
+                  'http://dbpedia.org/property/unknown':     ['?']}
+
+    class FakeKnowledgeBase:
+        def __init__(self):
+            self.bulk_calls = []
+            self.single_calls = []
+
+        def get_first_entity_properties(self, entity_uri, entity_classes):
+            return EntityPropertyDescriptions.PROPERTIES
+
+        def get_property_descrs(self, property_uris):
+            self.bulk_calls.append(list(property_uris))
+            return {'http://dbpedia.org/ontology/country':    'country',
+                    'http://dbpedia.org/property/postalCode': 'postal code'}
+
+        def get_property_descr(self, property_uri):
+            self.single_calls.append(property_uri)
+            return ''
+
+    class FakeKnowledgeBaseModule:
+        def __init__(self, knowledge_base):
+            self.knowledge_base = knowledge_base
+
+        def get_knowledge_base(self):
+            return self.knowledge_base
+
+    def setUp(self):
+        self.kdb = qa.kdb
+        self.knowledge_base = self.FakeKnowledgeBase()
+        qa.kdb = self.FakeKnowledgeBaseModule(self.knowledge_base)
+
+    def tearDown(self):
+        qa.kdb = self.kdb
+
+    def test_one_bulk_call(self):
+        entity = Entity('http://dbpedia.org/resource/Pavlohrad', 'Pavlohrad', '', ())
+        self.assertFalse(any(prop.is_descr_loaded for prop in entity.get_properties()))
+        given = entity.get_prop_descrs()
+        expected = ['country', 'postal code', '']
+        self.assertEqual(given, expected)
+        self.assertEqual(self.knowledge_base.bulk_calls, [list(self.PROPERTIES)])
+        self.assertTrue(all(prop.is_descr_loaded for prop in entity.get_properties()))
+        self.assertEqual([prop.descr for prop in entity.get_properties()], expected)
+        entity.get_prop_descrs()
+        self.assertEqual(len(self.knowledge_base.bulk_calls), 1)
+        self.assertEqual(self.knowledge_base.single_calls, [])
+
+
+class DescribeImage(unittest.TestCase):
+    class FakeKnowledgeBase:
+        def __init__(self, image):
+            self.image = image
+            self.release = threading.Event()
+
+        def search(self, string):
+            return 'http://dbpedia.org/resource/Pavlohrad', 'Pavlohrad', 'Pavlohrad is a city.', ()
+
+        def get_entity_image(self, entity_uri):
+            self.release.wait(1)
+            if isinstance(self.image, Exception):
+                raise self.image
+            return self.image
+
+    class FakeKnowledgeBaseModule:
+        def __init__(self, knowledge_base):
+            self.knowledge_base = knowledge_base
+
+        def get_knowledge_base(self):
+            return self.knowledge_base
+
+    class FakeTranslation:
+        def translate_many(self, texts, lang):
+            return list(texts)
+
+    class FakeText:
+        class QATokenizer:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def __call__(self, text):
+                return text.lower().split()
+
+    class FakeDescribeQuestion(DescribeQuestion):
+        def find_subject(self, text_ru):
+            return 'Pavlohrad'
+
+    def setUp(self):
+        self.patched = qa.kdb, qa.tr, qa.txt
+        qa.tr = self.FakeTranslation()
+        qa.txt = self.FakeText()
+
+    def tearDown(self):
+        qa.kdb, qa.tr, qa.txt = self.patched
+
+    def ask(self, image):
+        knowledge_base = self.FakeKnowledgeBase(image)
+        qa.kdb = self.FakeKnowledgeBaseModule(knowledge_base)
+        question = self.FakeDescribeQuestion('Pavlohrad')
+        # the image is fetched in the background while the question is answered
+        self.assertFalse(question._image_link.done())
+        knowledge_base.release.set()
+        return question.get_image()
+
+    def test_background_image(self):
+        self.assertEqual(self.ask('http://commons/Pavlohrad.jpg'), 'http://commons/Pavlohrad.jpg')
+
+    def test_no_image(self):
+        self.assertEqual(self.ask(None), '')
+
+    def test_unavailable_image(self):
+        self.assertEqual(self.ask(resilience.ServiceUnavailableError('sparql')), '')
+
+
 class PropertyPavlograd(unittest.TestCase):
     def setUp(self):
         pass
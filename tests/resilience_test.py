@@ -0,0 +1,125 @@
+import time
+import unittest
+import src.config as config
+from src.resilience import *
+
+
+class TimeBudget(unittest.TestCase):
+    def test_no_budget(self):
+        self.assertIsNone(remaining())
+        self.assertEqual(get_timeout(20), 20)
+
+    def test_timeout_limited_by_budget(self):
+        with time_budget(5):
+            self.assertLessEqual(get_timeout(20), 5)
+            self.assertEqual(get_timeout(1), 1)
+        self.assertIsNone(remaining())
+
+    def test_nested_budget_only_shrinks(self):
+        with time_budget(1):
+            with time_budget(100):
+                self.assertLessEqual(remaining(), 1)
+
+    def test_spent_budget(self):
+        with time_budget(0):
+            self.assertRaises(DeadlineExceededError, get_timeout, 20)
+
+
+class Breaker(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.05)
+
+    def test_opens_after_failures_in_a_row(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertRaises(CircuitOpenError, self.breaker.before_call)
+
+    def test_one_trial_call_when_half_open(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        time.sleep(0.06)
+        self.breaker.before_call()
+        self.assertRaises(CircuitOpenError, self.breaker.before_call)
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_failed_trial_opens_again(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        time.sleep(0.06)
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+
+
+class Retries(unittest.TestCase):
+    def setUp(self):
+        self.base_delay = config.RETRY_BASE_DELAY
+        config.RETRY_BASE_DELAY = 0.001
+        self.timeouts = []
+
+    def tearDown(self):
+        config.RETRY_BASE_DELAY = self.base_delay
+
+    def flaky(self, n_failures):
+        def function(timeout):
+            self.timeouts.append(timeout)
+            if len(self.timeouts) <= n_failures:
+                raise IOError('connection reset')
+            return 'result'
+        return function
+
+    def test_retry_until_success(self):
+        given = call('retries_success', self.flaky(2), 20, (IOError,))
+        self.assertEqual(given, 'result')
+        self.assertEqual(self.timeouts, [20, 20, 20])
+        self.assertEqual(get_breaker('retries_success').state, 'closed')
+
+    def test_unavailable_after_all_attempts(self):
+        self.assertRaises(ServiceUnavailableError, call, 'retries_fail', self.flaky(100), 20, (IOError,))
+        self.assertEqual(len(self.timeouts), config.RETRY_MAX_ATTEMPTS)
+
+    def test_other_errors_not_retried(self):
+        self.assertRaises(IOError, call, 'retries_other', self.flaky(100), 20, (ValueError,))
+        self.assertEqual(len(self.timeouts), 1)
+
+    def test_rejected_request_not_retried(self):
+        import requests
+
+        def function(timeout):
+            self.timeouts.append(timeout)
+            response = requests.Response()
+            response.status_code = 400
+            check_response(response)
+
+        for _ in range(config.BREAKER_FAILURE_THRESHOLD + 1):
+            self.assertRaises(RequestRejectedError, call, 'retries_rejected', function, 20,
+                              (requests.RequestException,))
+        self.assertEqual(len(self.timeouts), config.BREAKER_FAILURE_THRESHOLD + 1)
+        self.assertEqual(get_breaker('retries_rejected').state, 'closed')
+
+    def test_server_error_retried(self):
+        import requests
+
+        def function(timeout):
+            self.timeouts.append(timeout)
+            response = requests.Response()
+            response.status_code = 503 if len(self.timeouts) == 1 else 200
+            check_response(response)
+            return 'result'
+
+        self.assertEqual(call('retries_server_error', function, 20, (requests.RequestException,)), 'result')
+        self.assertEqual(len(self.timeouts), 2)
+
+    def test_timeout_from_budget(self):
+        with time_budget(5):
+            call('retries_budget', self.flaky(0), 20, (IOError,))
+        self.assertLessEqual(self.timeouts[0], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import json
+import unittest
+import src.config as config
+
+# The app warms up and starts the background refreshes when it is imported
+config.WARM_UP = False
+config.QA_STATS_RECONCILE_INTERVAL = 0
+config.PROPERTY_DESCR_REFRESH_INTERVAL = 0
+import flask_app.routes as routes
+from flask_app import app
+
+
+class GetAnswers(unittest.TestCase):
+    def setUp(self):
+        self.ask_many = routes.ask_many
+        self.asked = []
+        routes.ask_many = self.fake_ask_many
+        self.client = app.test_client()
+
+    def tearDown(self):
+        routes.ask_many = self.ask_many
+
+    def fake_ask_many(self, q_texts, language='ru'):
+        self.asked.append((q_texts, language))
+        return [{'answer': q_text, 'image': ''} for q_text in q_texts]
+
+    def test_invalid_questions(self):
+        for data in ['not json', json.dumps({'language': 'en'}), json.dumps('Кто мэр Павлограда?'),
+                     json.dumps(['Кто мэр Павлограда?', '  ']), json.dumps(['Кто мэр Павлограда?', 1])]:
+            response = self.client.post('/get_answers', data=data)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.get_json(force=True))
+        self.assertEqual(self.asked, [])
+
+    def test_list(self):
+        response = self.client.post('/get_answers?language=en', data=json.dumps(['Кто мэр Павлограда?']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.asked, [(['Кто мэр Павлограда?'], 'en')])
+
+    def test_dict(self):
+        data = json.dumps({'questions': ['Кто мэр Павлограда?', 'Кто такой Эйнштейн?']})
+        given = self.client.post('/get_answers', data=data).get_json(force=True)
+        expected = [{'answer': 'Кто мэр Павлограда?', 'image': ''}, {'answer': 'Кто такой Эйнштейн?', 'image': ''}]
+        self.assertEqual(given, expected)
+        self.assertEqual(self.asked[0][1], 'ru')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import time
+import unittest
+import src.config as config
+from src.cache import make_cache
+from src.translation import *
+
+
+class FakeTranslator:
+    def __init__(self):
+        self.calls = []
+
+    def translate(self, text, lang):
+        self.calls.append([text])
+        return text.upper()
+
+    def translate_array(self, texts, lang):
+        self.calls.append(texts)
+        return [{'TranslatedText': text.upper()} for text in texts]
+
+
+class Batching(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeTranslator()
+        self.translator = CachedTranslator(lambda: self.fake, make_cache('translations', 100))
+
+    def test_one_call_for_many_texts(self):
+        given = self.translator.translate_many(['Где родился Ленин?', 'Ленин', 'Ленин'], 'en')
+        expected = ['ГДЕ РОДИЛСЯ ЛЕНИН?', 'ЛЕНИН', 'ЛЕНИН']
+        self.assertEqual(given, expected)
+        self.assertEqual(self.fake.calls, [['Где родился Ленин?', 'Ленин']])
+
+    def test_cached_texts_not_sent(self):
+        self.translator.translate('Ленин', 'en')
+        self.translator.translate_many(['Ленин', 'Эйнштейн'], 'en')
+        given = self.fake.calls
+        expected = [['Ленин'], ['Эйнштейн']]
+        self.assertEqual(given, expected)
+
+    def test_cache_key_has_language(self):
+        self.translator.translate('Berlin', 'ru')
+        self.translator.translate('Berlin', 'de')
+        self.assertEqual(self.translator.stats()['translator_calls'], 2)
+
+
+class Timeout(unittest.TestCase):
+    class HangingTranslator(FakeTranslator):
+        def translate(self, text, lang):
+            time.sleep(1)
+            return super().translate(text, lang)
+
+    def setUp(self):
+        self.settings = config.TRANSLATOR_TIMEOUT, config.RETRY_MAX_ATTEMPTS
+        config.TRANSLATOR_TIMEOUT, config.RETRY_MAX_ATTEMPTS = 0.05, 1
+        fake = self.HangingTranslator()
+        self.translator = CachedTranslator(lambda: fake, make_cache('translations', 100))
+
+    def tearDown(self):
+        config.TRANSLATOR_TIMEOUT, config.RETRY_MAX_ATTEMPTS = self.settings
+
+    def test_hanging_call_abandoned(self):
+        start = time.monotonic()
+        self.assertRaises(resilience.ServiceUnavailableError, self.translator.translate, 'Ленин', 'en')
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+class Chunking(unittest.TestCase):
+    def setUp(self):
+        self.limits = config.TRANSLATION_MAX_TEXTS, config.TRANSLATION_MAX_CHARS
+        config.TRANSLATION_MAX_TEXTS, config.TRANSLATION_MAX_CHARS = 2, 10
+        self.fake = FakeTranslator()
+        self.translator = CachedTranslator(lambda: self.fake, make_cache('translations', 100))
+
+    def tearDown(self):
+        config.TRANSLATION_MAX_TEXTS, config.TRANSLATION_MAX_CHARS = self.limits
+
+    def test_max_texts(self):
+        given = self.translator.translate_many(['a', 'b', 'c', 'd', 'e'], 'en')
+        self.assertEqual(given, ['A', 'B', 'C', 'D', 'E'])
+        self.assertEqual(self.fake.calls, [['a', 'b'], ['c', 'd'], ['e']])
+
+    def test_max_chars(self):
+        self.translator.translate_many(['Ленин', 'Сталин', 'Проголосовавший'], 'en')
+        given = self.fake.calls
+        expected = [['Ленин'], ['Сталин'], ['Проголосовавший']]
+        self.assertEqual(given, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
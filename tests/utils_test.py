@@ -0,0 +1,55 @@
+import threading
+import time
+import unittest
+from src.utils import *
+
+
+class Coalescing(unittest.TestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.n_calls = 0
+
+    def slow_answer(self):
+        self.n_calls += 1
+        time.sleep(0.1)
+        return {'answer': 'Ulyanovsk'}
+
+    def run_concurrently(self, function, n_threads=5, timeout=None):
+        results = []
+
+        def target():
+            try:
+                results.append(self.single_flight.do('Где родился Ленин?', function, timeout))
+            except ValueError as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=target) for _ in range(n_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_one_computation(self):
+        results = self.run_concurrently(self.slow_answer)
+        self.assertEqual(self.n_calls, 1)
+        self.assertEqual(results, [{'answer': 'Ulyanovsk'}] * 5)
+
+    def test_error_to_all_waiters_not_cached(self):
+        def failing():
+            time.sleep(0.1)
+            raise ValueError('lookup failed')
+
+        results = self.run_concurrently(failing)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        given = self.single_flight.do('Где родился Ленин?', self.slow_answer)
+        expected = {'answer': 'Ulyanovsk'}
+        self.assertEqual(given, expected)
+
+    def test_timeout(self):
+        self.run_concurrently(self.slow_answer, n_threads=3, timeout=0.01)
+        self.assertEqual(self.n_calls, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()